@@ -0,0 +1,199 @@
+# core/middleware.py
+"""
+Auth wall + RBAC แบบ ASGI ล้วน (แทน BaseHTTPMiddleware)
+
+- ไม่ห่อ request/response ด้วย task / memory stream เพิ่ม -> StreamingResponse ไหลตรงถึง client
+- สิทธิ์ต่อ path คอมไพล์ไว้เป็น dict (module -> segment -> สิทธิ์ตาม method) และ memo ต่อ (path, method)
+- path สาธารณะ (allow list) ผ่านทันทีโดยไม่แตะ session
+- คำนวณ perms (แตะ DB) เฉพาะเมื่อ version ของสิทธิ์เปลี่ยน และรันใน threadpool ไม่บล็อก event loop
+"""
+from __future__ import annotations
+
+import os
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Dict, Mapping, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import HTMLResponse, JSONResponse, RedirectResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from database.connection import SessionLocal
+from modules.security.perms import has_perm_session, refresh_session_perms, session_perms_current
+
+# ---- RBAC rules ----
+WRITE_METHODS = frozenset({"POST", "PUT", "PATCH", "DELETE"})
+
+# rule: {"GET": perm, "WRITE": perm, "*": perm} — เลือกตาม method; ไม่มี key ที่ตรง = ใช้ค่าของ module
+_Rule = Mapping[str, Optional[str]]
+
+# module (segment แรก หรือ segment หลัง /api/v1) -> (ใช้กับ /api/v1 ด้วย?, ค่าเริ่มต้น, {segment ย่อย: rule})
+_MODULE_RULES: Dict[str, Tuple[bool, _Rule, Dict[str, _Rule]]] = {
+    "security": (
+        False,
+        {"*": "security.manage"},
+        {"password": {"*": "security.password.change"}},
+    ),
+    "payroll": (
+        True,
+        {"WRITE": "payroll.edit", "*": "payroll.view"},
+        # รายงานเงินเดือน (เฉพาะอ่าน)
+        {"payroll-entries": {"GET": "payroll.report.view"}},
+    ),
+    # Time Tracking (แยกคำขอเป็นสิทธิ์เฉพาะ)
+    "time-tracking": (
+        True,
+        {"WRITE": "time.edit", "*": "time.view"},
+        {
+            "leave-requests": {"GET": "time.leave.request", "*": "time.edit"},
+            "ot-requests": {"GET": "time.ot.request", "*": "time.edit"},
+        },
+    ),
+    # Meeting (แยกห้องประชุมต้อง manage; dashboard & bookings -> view ก็พอ)
+    "meeting": (
+        True,
+        {"WRITE": "meeting.manage", "*": "meeting.view"},
+        {"rooms": {"*": "meeting.manage"}},
+    ),
+    "recruitment": (
+        True,
+        {"WRITE": "recruitment.manage", "*": "recruitment.view"},
+        {},
+    ),
+    "data-management": (
+        True,
+        {},
+        {
+            # เข้าหน้า employees ได้ถ้ามี view/edit อย่างใดอย่างหนึ่ง
+            "employees": {"WRITE": "employees.edit", "*": "employees.view"},
+            "departments": {"*": "departments.manage"},
+            "positions": {"*": "positions.manage"},
+        },
+    ),
+}
+
+_NO_RULE = object()
+
+
+def _pick(rule: _Rule, method: str):
+    if method in rule:
+        return rule[method]
+    if method in WRITE_METHODS and "WRITE" in rule:
+        return rule["WRITE"]
+    return rule.get("*", _NO_RULE)
+
+
+@lru_cache(maxsize=4096)
+def need_perm_for(path: str, method: str) -> Optional[str]:
+    """สิทธิ์ที่ต้องมีสำหรับ (path, method) หรือ None ถ้าไม่บังคับ"""
+    segs = [s for s in path.split("/") if s]
+    is_api = len(segs) >= 3 and segs[0] == "api" and segs[1] == "v1"
+    if is_api:
+        key, rest = segs[2], segs[3:]
+    elif segs:
+        key, rest = segs[0], segs[1:]
+    else:
+        return None
+
+    entry = _MODULE_RULES.get(key)
+    if entry is None:
+        # เทียบแบบ prefix เหมือนกติกาเดิม (เช่น /payroll-entries อยู่ใต้ payroll)
+        entry = next((v for k, v in _MODULE_RULES.items() if key.startswith(k)), None)
+        if entry is not None:
+            rest = [key] + rest
+    if entry is None or (is_api and not entry[0]):
+        return None
+    _, default, sub_rules = entry
+
+    for seg in rest:
+        rule = sub_rules.get(seg)
+        if rule is not None:
+            perm = _pick(rule, method)
+            if perm is not _NO_RULE:
+                return perm
+            break
+    perm = _pick(default, method)
+    return None if perm is _NO_RULE else perm
+
+
+# ---- session helpers ----
+def get_session_uid(sess: Optional[dict]):
+    if not sess:
+        return None
+    return sess.get("emp_id") or sess.get("employee_id") or sess.get("user_id")
+
+
+def _refresh_perms(sess: dict, uid) -> None:
+    try:
+        with SessionLocal() as db:
+            refresh_session_perms(db, sess, uid)
+    except Exception:
+        sess.setdefault("perms", [])
+
+
+# ---- Middlewares ----
+class AuthWallMiddleware:
+    def __init__(self, app: ASGIApp, allow_paths=None, allow_prefixes=None):
+        self.app = app
+        self.allow_paths = frozenset(allow_paths or ())
+        self.allow_prefixes = tuple(allow_prefixes or ())
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+
+        # public paths
+        if path in self.allow_paths or (self.allow_prefixes and path.startswith(self.allow_prefixes)):
+            await self.app(scope, receive, send)
+            return
+
+        sess = scope.get("session")
+        uid = get_session_uid(sess)
+        if not uid:
+            if path.startswith("/api/"):
+                response = JSONResponse({"detail": "Unauthorized"}, status_code=401)
+            else:
+                response = RedirectResponse("/auth/login", status_code=302)
+            await response(scope, receive, send)
+            return
+
+        # เติม/รีเฟรช perms ในซีชันเฉพาะเมื่อ version เปลี่ยน (ปกติไม่แตะ DB)
+        if not session_perms_current(sess):
+            await run_in_threadpool(_refresh_perms, sess, uid)
+
+        # RBAC check
+        required = need_perm_for(path, scope["method"])
+        if required and not has_perm_session(sess, required):
+            if path.startswith("/api/"):
+                response = JSONResponse({"detail": "Forbidden"}, status_code=403)
+            else:
+                response = HTMLResponse("Forbidden", status_code=403)
+            await response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
+
+
+class DevStubMiddleware:
+    """HRM_DEV_ADMIN=1 -> ล็อกอินเป็น admin อัตโนมัติ (ไว้ทดสอบ)"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        sess = scope.get("session") if scope["type"] == "http" else None
+        if os.environ.get("HRM_DEV_ADMIN") == "1" and sess is not None:
+            if not get_session_uid(sess):
+                sess["emp_id"] = 1
+                sess["role"] = "ADMIN"
+                sess["email"] = "admin@hrm.local"
+                sess["name"] = "Dev Admin"
+            state = scope.setdefault("state", {})
+            if "current_user" not in state:
+                state["current_user"] = SimpleNamespace(id=1, role="ADMIN")
+            if not session_perms_current(sess):
+                await run_in_threadpool(_refresh_perms, sess, sess["emp_id"])
+        await self.app(scope, receive, send)
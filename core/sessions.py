@@ -0,0 +1,262 @@
+# core/sessions.py
+"""
+Server-side session (แทน cookie ที่เก็บข้อมูลทั้งก้อน)
+
+- cookie เก็บแค่ session id แบบสุ่ม (opaque) — ข้อมูลจริง (ids / role / perms) อยู่ฝั่ง server
+- backend เลือกได้: memory (LRU + TTL, process เดียว) / sqlite (แชร์ได้หลาย worker)
+- request.session โหลดจาก backend ตอนถูกอ่านครั้งแรกเท่านั้น (backend ที่บล็อกโหลดล่วงหน้าใน threadpool)
+  และเขียนกลับเฉพาะเมื่อถูกแก้
+- ตั้งค่า: SESSION_BACKEND = sqlite (ค่าเริ่มต้น) | memory | cookie (SessionMiddleware เดิมของ Starlette)
+          SESSION_SQLITE_PATH (ค่าเริ่มต้น database/hrm_sessions.db), SESSION_MEMORY_MAX (ค่าเริ่มต้น 10000)
+"""
+from __future__ import annotations
+
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time as _time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Iterator, Optional
+
+DEFAULT_SESSION_SQLITE_PATH = os.path.join("database", "hrm_sessions.db")
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+# ------------------------------------------------------------
+# Backends
+# ------------------------------------------------------------
+class SessionBackend:
+    blocking = False  # True = เรียกใน threadpool ตอนเขียน
+
+    def load(self, sid: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def save(self, sid: str, data: dict, ttl: int) -> None:
+        raise NotImplementedError
+
+    def delete(self, sid: str) -> None:
+        raise NotImplementedError
+
+
+class MemorySessionBackend(SessionBackend):
+    """LRU + TTL ในหน่วยความจำ (ใช้ได้เมื่อรัน worker เดียว)"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max(1, int(max_entries))
+        self._items: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid: str) -> Optional[dict]:
+        with self._lock:
+            hit = self._items.get(sid)
+            if hit is None:
+                return None
+            data, expires_at = hit
+            if expires_at <= _time.time():
+                del self._items[sid]
+                return None
+            self._items.move_to_end(sid)
+            return dict(data)
+
+    def save(self, sid: str, data: dict, ttl: int) -> None:
+        with self._lock:
+            self._items[sid] = (dict(data), _time.time() + ttl)
+            self._items.move_to_end(sid)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def delete(self, sid: str) -> None:
+        with self._lock:
+            self._items.pop(sid, None)
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """เก็บใน SQLite ไฟล์แยก (ไม่ปนกับฐานข้อมูลหลัก / ไม่โดน backup-restore)"""
+
+    blocking = True
+    PURGE_EVERY = 500  # ลบแถวหมดอายุทุก ๆ N ครั้งที่เขียน
+
+    def __init__(self, path: str = DEFAULT_SESSION_SQLITE_PATH):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._local = threading.local()
+        self._writes = 0
+        with self._conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS http_sessions(
+                    id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, sid: str) -> Optional[dict]:
+        row = self._conn().execute(
+            "SELECT data, expires_at FROM http_sessions WHERE id=?", (sid,)
+        ).fetchone()
+        if not row:
+            return None
+        if row[1] <= _time.time():
+            self.delete(sid)
+            return None
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            return None
+
+    def save(self, sid: str, data: dict, ttl: int) -> None:
+        conn = self._conn()
+        now = _time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO http_sessions(id, data, expires_at) VALUES(?,?,?)",
+            (sid, json.dumps(data, separators=(",", ":")), now + ttl),
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM http_sessions WHERE expires_at <= ?", (now,))
+
+    def delete(self, sid: str) -> None:
+        self._conn().execute("DELETE FROM http_sessions WHERE id=?", (sid,))
+
+
+def create_session_backend(kind: Optional[str] = None) -> SessionBackend:
+    kind = (kind or os.getenv("SESSION_BACKEND", "sqlite")).lower()
+    if kind == "memory":
+        return MemorySessionBackend(int(os.getenv("SESSION_MEMORY_MAX", "10000") or 10000))
+    if kind == "sqlite":
+        return SQLiteSessionBackend(os.getenv("SESSION_SQLITE_PATH", DEFAULT_SESSION_SQLITE_PATH))
+    raise ValueError(f"Unknown SESSION_BACKEND: {kind}")
+
+
+# ------------------------------------------------------------
+# Lazy session object (request.session)
+# ------------------------------------------------------------
+class LazySession(MutableMapping):
+    def __init__(self, backend: SessionBackend, sid: Optional[str]):
+        self._backend = backend
+        self.sid = sid
+        self._data: Optional[dict] = None
+        self.modified = False
+        self._drop_sid: Optional[str] = None
+
+    def _load(self) -> dict:
+        if self._data is None:
+            self._data = (self._backend.load(self.sid) if self.sid else None) or {}
+        return self._data
+
+    def __getitem__(self, key: str) -> Any:
+        return self._load()[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._load()[key] = value
+        self.modified = True
+
+    def __delitem__(self, key: str) -> None:
+        del self._load()[key]
+        self.modified = True
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._load())
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def clear(self) -> None:
+        self._data = {}
+        self.modified = True
+
+    def regenerate(self) -> None:
+        """เปลี่ยน session id (เช่น ตอนล็อกอิน) กัน session fixation; ข้อมูลเดิมยังอยู่"""
+        self._load()
+        if self.sid:
+            self._drop_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+# ------------------------------------------------------------
+# Middleware
+# ------------------------------------------------------------
+class ServerSessionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        backend: SessionBackend,
+        session_cookie: str = "session",
+        max_age: int = 14 * 24 * 60 * 60,
+        path: str = "/",
+        same_site: str = "lax",
+        https_only: bool = False,
+    ):
+        self.app = app
+        self.backend = backend
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.path = path
+        self.security_flags = "httponly; samesite=" + same_site
+        if https_only:
+            self.security_flags += "; secure"
+
+    async def _call_backend(self, fn, *args):
+        if self.backend.blocking:
+            return await run_in_threadpool(fn, *args)
+        return fn(*args)
+
+    def _cookie(self, value: str, max_age: int) -> str:
+        return f"{self.session_cookie}={value}; path={self.path}; Max-Age={max_age}; {self.security_flags}"
+
+    async def _commit(self, session: LazySession) -> Optional[str]:
+        """บันทึกลง backend (ถ้าถูกแก้) แล้วคืนค่า Set-Cookie ที่ต้องส่ง (หรือ None)"""
+        if not session.modified:
+            return None
+        if session._drop_sid:
+            await self._call_backend(self.backend.delete, session._drop_sid)
+        data = session._data or {}
+        if not data:
+            if session.sid:
+                await self._call_backend(self.backend.delete, session.sid)
+                return self._cookie("null", 0)
+            return None
+        if not session.sid:
+            session.sid = secrets.token_urlsafe(32)
+        await self._call_backend(self.backend.save, session.sid, data, self.max_age)
+        return self._cookie(session.sid, self.max_age)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        sid = HTTPConnection(scope).cookies.get(self.session_cookie) or None
+        session = LazySession(self.backend, sid)
+        if sid and self.backend.blocking:
+            # backend ที่บล็อก (sqlite): โหลดใน threadpool ก่อน ไม่ให้ request.session อ่าน DB บน event loop
+            session._data = (await run_in_threadpool(self.backend.load, sid)) or {}
+        scope["session"] = session
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                header = await self._commit(session)
+                if header:
+                    MutableHeaders(scope=message).append("Set-Cookie", header)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
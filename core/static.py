@@ -0,0 +1,173 @@
+# core/static.py
+"""
+เสิร์ฟ /static แบบเบา
+
+- StaticBypassMiddleware: ชั้นนอกสุด -> คำขอ /static/... ไปถึง StaticFiles ตรง ๆ
+  ไม่ผ่าน SessionMiddleware (ไม่ถอด/เซ็น cookie) และไม่ผ่าน AuthWall
+- CachedStaticFiles: ETag / Last-Modified (จาก StaticFiles เดิม, ตอบ 304 ได้) +
+  Cache-Control ยาวสำหรับไฟล์ที่มี fingerprint (ชื่อไฟล์มี hash หรือ ?v=...)
+  และเสิร์ฟไฟล์บีบอัดล่วงหน้า (.br / .gz ข้างไฟล์จริง) ตาม Accept-Encoding
+
+สร้างไฟล์บีบอัดล่วงหน้า:  python -m core.static [directory]
+(.br ต้องมีแพ็กเกจ brotli; ไม่มีจะสร้างเฉพาะ .gz)
+"""
+from __future__ import annotations
+
+import gzip
+import os
+import re
+import stat
+import sys
+from mimetypes import guess_type
+from urllib.parse import parse_qs
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE_SEC", "0") or 0)
+STATIC_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+COMPRESSIBLE_SUFFIXES = frozenset({".js", ".css", ".html", ".svg", ".json", ".map", ".txt", ".xml"})
+_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+_FINGERPRINT_RE = re.compile(r"\.[0-9a-fA-F]{8,}\.[A-Za-z0-9]+$")
+
+
+def _accepted_encodings(header: str) -> frozenset:
+    """encoding ที่ client รับได้จาก Accept-Encoding (q=0 = ไม่รับ; "*" ครอบ br/gzip ที่ไม่ได้ระบุ)"""
+    q_of: dict[str, float] = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for p in params.split(";"):
+            k, _, v = p.strip().partition("=")
+            if k.strip().lower() == "q":
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        q_of[name] = q
+    out = {name for name, q in q_of.items() if q > 0}
+    if q_of.get("*", 0) > 0:
+        out.update(enc for enc, _ in _ENCODINGS if enc not in q_of)
+    return frozenset(out)
+
+
+class CachedStaticFiles(StaticFiles):
+    def _cache_control(self, full_path: str, scope: Scope) -> str:
+        qs = (scope.get("query_string") or b"").decode("latin-1")
+        if _FINGERPRINT_RE.search(full_path) or (qs and "v" in parse_qs(qs)):
+            return f"public, max-age={STATIC_IMMUTABLE_MAX_AGE}, immutable"
+        if STATIC_MAX_AGE > 0:
+            return f"public, max-age={STATIC_MAX_AGE}"
+        return "no-cache"  # ให้ browser revalidate ด้วย ETag ทุกครั้ง (ได้ 304 ถ้าไม่เปลี่ยน)
+
+    def _precompressed(self, full_path: str, src_stat, request_headers: Headers):
+        accepted = _accepted_encodings(request_headers.get("accept-encoding", ""))
+        if not accepted:
+            return None
+        for encoding, ext in _ENCODINGS:
+            if encoding not in accepted:
+                continue
+            try:
+                st = os.stat(full_path + ext)
+            except OSError:
+                continue
+            # ไฟล์บีบอัดเก่ากว่าต้นฉบับ (แก้ไฟล์แล้วยังไม่รัน precompress) -> ไม่ใช้
+            if stat.S_ISREG(st.st_mode) and st.st_mtime >= src_stat.st_mtime:
+                return full_path + ext, st, encoding
+        return None
+
+    def file_response(self, full_path, stat_result, scope: Scope, status_code: int = 200):
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+        compressible = os.path.splitext(full_path)[1].lower() in COMPRESSIBLE_SUFFIXES
+
+        served = (
+            self._precompressed(full_path, stat_result, request_headers)
+            if (compressible and status_code == 200) else None
+        )
+        if served:
+            path, st, encoding = served
+            response = FileResponse(
+                path,
+                status_code=status_code,
+                stat_result=st,
+                media_type=guess_type(full_path)[0] or "text/plain",
+            )
+            response.headers["content-encoding"] = encoding
+        else:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+
+        if compressible:
+            response.headers["vary"] = "Accept-Encoding"
+        response.headers["cache-control"] = self._cache_control(full_path, scope)
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+class StaticBypassMiddleware:
+    """ส่งคำขอที่ขึ้นต้นด้วย prefix ไปที่ static app ทันที (ต้องเป็น middleware ชั้นนอกสุด)"""
+
+    def __init__(self, app: ASGIApp, static_app: ASGIApp, prefix: str = "/static"):
+        self.app = app
+        self.static_app = static_app
+        self.prefix = prefix.rstrip("/")
+        self._prefix_slash = self.prefix + "/"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            path = scope["path"]
+            root_path = scope.get("root_path", "")
+            if root_path and path.startswith(root_path):
+                path = path[len(root_path):]
+            if path.startswith(self._prefix_slash):
+                child = dict(scope)
+                child["path"] = path[len(self.prefix):]
+                child["root_path"] = ""
+                await self.static_app(child, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+# ---- precompress ----
+def precompress(directory: str, min_size: int = 1024) -> int:
+    """สร้าง .gz (และ .br ถ้ามี brotli) ให้ไฟล์ที่บีบได้ซึ่งใหม่กว่าไฟล์บีบอัดเดิม; คืนจำนวนไฟล์ที่เขียน"""
+    try:
+        import brotli  # optional
+    except ImportError:
+        brotli = None
+
+    written = 0
+    for root, _dirs, files in os.walk(directory):
+        for name in files:
+            src = os.path.join(root, name)
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_SUFFIXES:
+                continue
+            st = os.stat(src)
+            if st.st_size < min_size:
+                continue
+            data = None
+            for ext, enabled in ((".gz", True), (".br", brotli is not None)):
+                dst = src + ext
+                if not enabled or (os.path.exists(dst) and os.stat(dst).st_mtime >= st.st_mtime):
+                    continue
+                if data is None:
+                    with open(src, "rb") as f:
+                        data = f.read()
+                out = gzip.compress(data, compresslevel=9, mtime=0) if ext == ".gz" else brotli.compress(data)
+                with open(dst, "wb") as f:
+                    f.write(out)
+                written += 1
+    return written
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else "static"
+    print(f"✓ precompressed {precompress(target)} file(s) in {target}")
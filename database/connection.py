@@ -1,19 +1,107 @@
 # database/connection.py
 import os
+import sqlite3
 from typing import Generator
 
-from sqlalchemy import create_engine, inspect, text
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 
 from database.base import Base
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./hrm.db")
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {},
-)
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)).strip())
+    except Exception:
+        return default
+
+# ---------- engine factory ----------
+# SQLite: WAL ให้ผู้อ่านไม่ต้องรอผู้เขียน (payroll / rebuild attendance), busy_timeout แทน error "database is locked"
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE_KB = _env_int("SQLITE_CACHE_SIZE_KB", 65536)        # 64 MB ต่อ connection
+SQLITE_MMAP_SIZE = _env_int("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)     # 256 MB
+SQLITE_BUSY_TIMEOUT_MS = _env_int("SQLITE_BUSY_TIMEOUT_MS", 5000)
+
+# dialect อื่น (PostgreSQL / MySQL)
+DB_POOL_SIZE = _env_int("DB_POOL_SIZE", 10)
+DB_MAX_OVERFLOW = _env_int("DB_MAX_OVERFLOW", 20)
+DB_POOL_RECYCLE = _env_int("DB_POOL_RECYCLE_SEC", 1800)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") not in ("0", "false", "False")
+
+def _is_sqlite_memory(url: str) -> bool:
+    return url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url
+
+def _sqlite_pragmas(memory: bool) -> list[str]:
+    pragmas = [
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+    if not memory:
+        pragmas.insert(0, f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        pragmas.append(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    return pragmas
+
+def make_engine(url: str = DATABASE_URL) -> Engine:
+    if url.startswith("sqlite"):
+        eng = create_engine(
+            url,
+            connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000.0},
+        )
+        pragmas = _sqlite_pragmas(_is_sqlite_memory(url))
+
+        @event.listens_for(eng, "connect")
+        def _on_connect(dbapi_conn, _record):
+            cur = dbapi_conn.cursor()
+            try:
+                for p in pragmas:
+                    cur.execute(p)
+            finally:
+                cur.close()
+
+        return eng
+
+    return create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+
+engine = make_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+IS_SQLITE = engine.dialect.name == "sqlite"
+
+# ---------- SQLite backup / restore (ปลอดภัยกับ WAL) ----------
+# คัดลอกไฟล์ .db ตรง ๆ จะไม่ได้ข้อมูลที่ยังค้างใน -wal -> ใช้ online backup API ของ sqlite3 แทน
+def sqlite_backup_to(dest_path: str) -> None:
+    raw = engine.raw_connection()
+    try:
+        dst = sqlite3.connect(dest_path)
+        try:
+            raw.driver_connection.backup(dst)
+        finally:
+            dst.close()
+    finally:
+        raw.close()
+
+def sqlite_restore_from(src_path: str) -> None:
+    """เขียนทับฐานข้อมูลที่เปิดอยู่ด้วยไฟล์ backup (ทำใน transaction ของ sqlite เอง ไม่ต้องรีสตาร์ต)"""
+    src = sqlite3.connect(src_path)
+    try:
+        raw = engine.raw_connection()
+        try:
+            src.backup(raw.driver_connection)
+        finally:
+            raw.close()
+    finally:
+        src.close()
+    engine.dispose()  # connection เก่าใน pool เริ่มใหม่พร้อม pragmas
 
 # ---------- small helpers ----------
 def _cols(insp, table: str) -> set[str]:
@@ -38,7 +126,7 @@ def ensure_leave_balances_table_and_columns(engine):
     else:
         with engine.begin() as conn:
             # เพิ่มคอลัมน์ปัจจุบัน
-            for col in ("opening", "accrued", "used", "adjusted", "carry_in"):
+            for col in ("opening", "accrued", "used", "adjusted", "carry_in", "pending"):
                 _ensure_column(conn, "leave_balances", col, "REAL DEFAULT 0.0")
 
             # ถ้ามี legacy 'opening_quota' แต่ยังไม่มี 'opening' → เพิ่มแล้วคัดลอกค่า
@@ -65,12 +153,14 @@ def ensure_leave_types_columns(engine):
         sqls.append("ALTER TABLE leave_types ADD COLUMN accrue_per_year REAL DEFAULT 0.0")
     if "max_quota" not in cols:
         sqls.append("ALTER TABLE leave_types ADD COLUMN max_quota REAL DEFAULT 0.0")
+    if "carry_over_cap" not in cols:
+        sqls.append("ALTER TABLE leave_types ADD COLUMN carry_over_cap REAL DEFAULT 0.0")
 
     if sqls:
         with engine.begin() as conn:
             for s in sqls:
                 conn.execute(text(s))
-        print("✓ Migrated leave_types: ensured annual_quota / affects_balance / accrue_per_year / max_quota.")
+        print("✓ Migrated leave_types: ensured annual_quota / affects_balance / accrue_per_year / max_quota / carry_over_cap.")
     else:
         print("✓ Migrated leave_types: columns already present.")
 
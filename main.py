@@ -1,67 +1,19 @@
 # main.py
 import sys, asyncio, os
-from types import SimpleNamespace
 
 import uvicorn
 from fastapi import FastAPI, Request
 from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
 from core.templates import templates  # อินสแตนซ์ Jinja2Templates กลาง
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import RedirectResponse, JSONResponse, HTMLResponse as StarletteHTMLResponse
+from starlette.responses import RedirectResponse
 from starlette.middleware.sessions import SessionMiddleware
 from sqlalchemy import text
 
 from database.base import Base
 from database.connection import create_all_tables, SessionLocal, engine
-
-# ---- RBAC helpers ----
-WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
-
-def _need_perm_for(path: str, method: str):
-    # Security
-    if path.startswith("/security"):
-        if path.startswith("/security/password"):
-            return "security.password.change"
-        return "security.manage"
-
-    # Payroll
-    if path.startswith("/payroll") or path.startswith("/api/v1/payroll"):
-        # รายงานเงินเดือน (เฉพาะอ่าน)
-        if "/payroll-entries" in path and method == "GET":
-            return "payroll.report.view"
-        return "payroll.edit" if method in WRITE_METHODS else "payroll.view"
-
-    # Time Tracking (แยกคำขอเป็นสิทธิ์เฉพาะ)
-    if path.startswith("/time-tracking") or path.startswith("/api/v1/time-tracking"):
-        if "/leave-requests" in path:
-            return "time.leave.request" if method == "GET" else "time.edit"
-        if "/ot-requests" in path:
-            return "time.ot.request" if method == "GET" else "time.edit"
-        return "time.edit" if method in WRITE_METHODS else "time.view"
-
-    # Meeting (แยกห้องประชุมต้อง manage)
-    if path.startswith("/meeting") or path.startswith("/api/v1/meeting"):
-        if "/rooms" in path:
-            return "meeting.manage"
-        # dashboard & bookings -> view ก็พอ
-        return "meeting.manage" if method in WRITE_METHODS else "meeting.view"
-
-    # Recruitment
-    if path.startswith("/recruitment") or path.startswith("/api/v1/recruitment"):
-        return "recruitment.manage" if method in WRITE_METHODS else "recruitment.view"
-
-    # Data Management
-    if path.startswith("/data-management") or path.startswith("/api/v1/data-management"):
-        if "/employees" in path:
-            # เข้าหน้า employees ได้ถ้ามี view/edit อย่างใดอย่างหนึ่ง
-            return "employees.edit" if method in WRITE_METHODS else "employees.view"
-        if "/departments" in path:
-            return "departments.manage"
-        if "/positions" in path:
-            return "positions.manage"
-
-    return None
+from core.middleware import AuthWallMiddleware, get_session_uid
+from core.static import CachedStaticFiles, StaticBypassMiddleware
+from core.sessions import ServerSessionMiddleware, create_session_backend
 
 # ----- Windows event loop policy -----
 if sys.platform.startswith("win"):
@@ -74,81 +26,12 @@ if sys.platform.startswith("win"):
 app = FastAPI(title="HRM System API", version="1.0.0")
 
 # ----- Small helpers -----
-def _sess(request: Request):
-    return request.session if "session" in request.scope else {}
-
-def _get_uid(sess: dict | None):
-    if not sess: return None
-    return sess.get("emp_id") or sess.get("employee_id") or sess.get("user_id")
-
 def _is_logged_in(request: Request) -> bool:
-    return "session" in request.scope and bool(_get_uid(request.session))
-
-# ----- Middlewares -----
-class DevStubMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        from modules.security.perms import compute_user_perms
-        sess = _sess(request)
-        if os.environ.get("HRM_DEV_ADMIN") == "1" and sess is not None:
-            if not _get_uid(sess):
-                sess["emp_id"] = 1
-                sess["role"] = "ADMIN"
-                sess["email"] = "admin@hrm.local"
-                sess["name"] = "Dev Admin"
-            if not hasattr(request.state, "current_user"):
-                request.state.current_user = SimpleNamespace(id=1, role="ADMIN")
-            if not sess.get("perms"):
-                try:
-                    with SessionLocal() as db:
-                        sess["perms"] = sorted(list(
-                            compute_user_perms(db, sess["emp_id"], sess.get("role") or "USER")
-                        ))
-                except Exception:
-                    sess["perms"] = []
-        return await call_next(request)
-
-class AuthWallMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, allow_paths=None, allow_prefixes=None):
-        super().__init__(app)
-        self.allow_paths = set(allow_paths or set())
-        self.allow_prefixes = tuple(allow_prefixes or ())
-
-    async def dispatch(self, request: Request, call_next):
-        from modules.security.perms import has_perm_session, compute_user_perms
-
-        path = request.url.path
-
-        # public paths
-        if path in self.allow_paths or any(path.startswith(p) for p in self.allow_prefixes):
-            return await call_next(request)
-
-        sess = _sess(request)
-        uid = _get_uid(sess)
-        if not uid:
-            if path.startswith("/api/"):
-                return JSONResponse({"detail": "Unauthorized"}, status_code=401)
-            return RedirectResponse("/auth/login", status_code=302)
-
-        # เติม perms เข้าซีชันถ้ายังไม่มี (กันพลาด)
-        if not sess.get("perms"):
-            try:
-                with SessionLocal() as db:
-                    sess["perms"] = sorted(list(
-                        compute_user_perms(db, uid, sess.get("role") or "USER")
-                    ))
-            except Exception:
-                sess.setdefault("perms", [])
-
-        # RBAC check
-        required = _need_perm_for(path, request.method)
-        if required and not has_perm_session(sess, required):
-            if path.startswith("/api/"):
-                return JSONResponse({"detail": "Forbidden"}, status_code=403)
-            return StarletteHTMLResponse("Forbidden", status_code=403)
-
-        return await call_next(request)
+    return "session" in request.scope and bool(get_session_uid(request.session))
 
+# ----- Middlewares (ASGI ล้วน: core/middleware.py) -----
 # เปิดใช้ AuthWall (DevStub เปิดเมื่ออยากทดสอบ)
+# from core.middleware import DevStubMiddleware
 # app.add_middleware(DevStubMiddleware)
 app.add_middleware(
     AuthWallMiddleware,
@@ -157,18 +40,32 @@ app.add_middleware(
 )
 
 # ----- Session & Middlewares -----
-app.add_middleware(
-    SessionMiddleware,
-    secret_key=os.environ.get("SESSION_SECRET", "dev-secret"),
-    session_cookie="hrm_session",
-    same_site="lax",
-    https_only=False,
-    max_age=60 * 60 * 24 * 7,
-)
+# SESSION_BACKEND=sqlite (ค่าเริ่มต้น) / memory -> cookie เก็บแค่ session id; cookie -> แบบเดิม (ข้อมูลทั้งก้อนใน cookie)
+if os.environ.get("SESSION_BACKEND", "sqlite").lower() == "cookie":
+    app.add_middleware(
+        SessionMiddleware,
+        secret_key=os.environ.get("SESSION_SECRET", "dev-secret"),
+        session_cookie="hrm_session",
+        same_site="lax",
+        https_only=False,
+        max_age=60 * 60 * 24 * 7,
+    )
+else:
+    app.add_middleware(
+        ServerSessionMiddleware,
+        backend=create_session_backend(),
+        session_cookie="hrm_session",
+        same_site="lax",
+        https_only=False,
+        max_age=60 * 60 * 24 * 7,
+    )
 
 # ----- Static & Templates -----
 os.makedirs("static/uploads/rooms", exist_ok=True)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+static_files = CachedStaticFiles(directory="static")
+app.mount("/static", static_files, name="static")  # ให้ url_for('static', ...) ใช้ได้
+# ชั้นนอกสุด: /static/... ไม่ผ่าน session / auth wall
+app.add_middleware(StaticBypassMiddleware, static_app=static_files, prefix="/static")
 app.state.templates = templates
 
 # ให้เทมเพลตเรียก has_perm จาก session ได้ (แสดง/ซ่อนเมนู)
@@ -231,6 +128,8 @@ app.include_router(auth_router, include_in_schema=False)
 # ----- Startup -----
 from modules.data_management.migrations import migrate_employees_contact_columns
 from modules.meeting.migrations import migrate_meeting_rooms_columns, run_startup_migrations
+from modules.time_tracking.migrations import ensure_time_tracking_indexes
+from modules.time_tracking.services import start_attendance_recompute_worker
 
 @app.on_event("startup")
 def on_startup():
@@ -241,6 +140,11 @@ def on_startup():
     create_all_tables()
     print("Database tables created successfully.")
 
+    try:
+        ensure_time_tracking_indexes(engine)
+    except Exception as e:
+        print(f"⚠️ Migrate warning (time-tracking indexes): {e}")
+
     ensure_password_hash_column()
     ensure_security_tables(engine)
     ensure_permissions_schema(engine)
@@ -251,6 +155,9 @@ def on_startup():
 
     ensure_default_admin()
 
+    # คำนวณ attendance_daily ใหม่เฉพาะช่องที่ถูก mark (เบื้องหลัง)
+    start_attendance_recompute_worker()
+
     try:
         migrate_employees_contact_columns(engine)
         print("✓ Migrated employees: added email/phone_number if missing.")
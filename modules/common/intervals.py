@@ -0,0 +1,68 @@
+# modules/common/intervals.py
+"""
+ตรวจช่วงเวลาทับซ้อนแบบทั้งชุด (ใช้กับ ลา / OT / จองห้องประชุม)
+
+- ช่วงเป็นแบบครึ่งเปิด [start, end): a ทับ b เมื่อ a.start < b.end และ b.start < a.end
+- แบ่งกลุ่มตาม key (employee_id / room_id) แล้ว sweep ตาม start: O(n log n)
+- ฝั่ง DB ให้ผู้เรียกโหลดช่วงเดิมด้วย predicate (key IN ..., start < max_end, end > min_start)
+  ซึ่งใช้ index (key, status, start, end) ได้
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Any, Hashable, Iterable, NamedTuple, Optional, Sequence
+
+
+class Conflict(NamedTuple):
+    index: int                       # ลำดับของช่วงที่เสนอ (ใน batch)
+    existing_id: Optional[Any] = None  # id ของแถวเดิมใน DB ที่ทับ
+    other_index: Optional[int] = None  # หรือ ลำดับของช่วงใน batch เดียวกันที่ทับ
+
+
+def find_conflicts(
+    proposed: Sequence[tuple[Hashable, Any, Any]],
+    existing: Iterable[tuple[Hashable, Any, Any, Any]] = (),
+) -> dict[int, Conflict]:
+    """
+    proposed: [(key, start, end), ...]
+    existing: [(key, start, end, id), ...] (แถวเดิมใน DB)
+    คืน {index: Conflict} เฉพาะช่วงที่เสนอซึ่งทับกับแถวเดิมหรือกับช่วงอื่นใน batch
+    (ช่วงเดิมทับกันเองไม่นับ)
+    """
+    # event = (start, end, is_proposed, ref) ; ref = index หรือ id เดิม
+    groups: dict[Hashable, list] = defaultdict(list)
+    for i, (key, s, e) in enumerate(proposed):
+        groups[key].append((s, e, True, i))
+    if not groups:
+        return {}
+    for key, s, e, ref in existing:
+        if key in groups:
+            groups[key].append((s, e, False, ref))
+
+    out: dict[int, Conflict] = {}
+
+    def _flag(item, other) -> None:
+        if not item[2] or item[3] in out:
+            return
+        if other[2]:
+            out[item[3]] = Conflict(index=item[3], other_index=other[3])
+        else:
+            out[item[3]] = Conflict(index=item[3], existing_id=other[3])
+
+    for items in groups.values():
+        # ถ้า start เท่ากัน ให้แถวเดิมมาก่อน -> ช่วงที่เสนอจะถูกรายงานว่าทับแถวเดิม
+        items.sort(key=lambda x: (x[0], x[2], x[1]))
+        holder = None  # ช่วงที่ end ไกลสุดจนถึงตอนนี้
+        for cur in items:
+            if holder is not None and cur[0] < holder[1]:
+                _flag(cur, holder)
+                _flag(holder, cur)
+            if holder is None or cur[1] > holder[1]:
+                holder = cur
+    return out
+
+
+def span_of(proposed: Sequence[tuple[Hashable, Any, Any]]) -> tuple[set, Any, Any]:
+    """(ชุด key, start ต่ำสุด, end สูงสุด) สำหรับ query แถวเดิมครั้งเดียว"""
+    keys = {k for k, _, _ in proposed}
+    return keys, min(s for _, s, _ in proposed), max(e for _, _, e in proposed)
@@ -0,0 +1,113 @@
+# modules/data_management/directory.py
+"""
+Employee directory cache (read-through) — ใช้ร่วมกันทุกโมดูล (รายงาน / payroll / อีเมลห้องประชุม)
+
+- เก็บเฉพาะข้อมูลแสดงผล: id -> EmployeeCard(code, ชื่อ, email, แผนก, ตำแหน่ง)
+- get_many(db, ids) โหลดเฉพาะ id ที่ยังไม่มีใน cache ด้วย query เดียว (IN เป็นก้อน)
+- ล้างเมื่อ create/update/delete employee (และเมื่อแก้ชื่อแผนก/ตำแหน่ง)
+- หมดอายุตาม TTL กันข้อมูลค้างเมื่อรันหลาย process
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time as _time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+EMPLOYEE_DIRECTORY_TTL = int(os.getenv("EMPLOYEE_DIRECTORY_TTL_SEC", "300") or 300)
+_IN_CHUNK = 900  # ต่ำกว่าเพดานตัวแปรของ SQLite
+
+
+@dataclass(frozen=True)
+class EmployeeCard:
+    id: int
+    code: Optional[str]
+    first_name: str
+    last_name: str
+    email: Optional[str]
+    department: Optional[str]
+    position: Optional[str]
+
+    @property
+    def full_name(self) -> str:
+        return f"{(self.first_name or '').strip()} {(self.last_name or '').strip()}".strip()
+
+    @property
+    def label(self) -> str:
+        """ชื่อสำหรับแสดง (ไม่มีชื่อใช้ email)"""
+        return self.full_name or (self.email or "")
+
+
+_lock = threading.Lock()
+_cards: Dict[int, tuple[EmployeeCard, float]] = {}  # id -> (card, loaded_at)
+
+
+def invalidate(employee_ids: Optional[Iterable[int]] = None) -> None:
+    """ล้างบาง id (หรือทั้งหมดถ้าไม่ระบุ)"""
+    with _lock:
+        if employee_ids is None:
+            _cards.clear()
+            return
+        for i in employee_ids:
+            _cards.pop(int(i), None)
+
+
+def _load(db: Session, ids: list[int]) -> Dict[int, EmployeeCard]:
+    E, D, P = models.Employee, models.Department, models.Position
+    out: Dict[int, EmployeeCard] = {}
+    for i in range(0, len(ids), _IN_CHUNK):
+        chunk = ids[i:i + _IN_CHUNK]
+        rows = (
+            db.query(E.id, E.employee_id_number, E.first_name, E.last_name, E.email, D.name, P.name)
+            .outerjoin(D, D.id == E.department_id)
+            .outerjoin(P, P.id == E.position_id)
+            .filter(E.id.in_(chunk))
+            .all()
+        )
+        for eid, code, fn, ln, email, dept, pos in rows:
+            out[eid] = EmployeeCard(
+                id=eid,
+                code=code,
+                first_name=fn or "",
+                last_name=ln or "",
+                email=(email or "").strip() or None,
+                department=dept,
+                position=pos,
+            )
+    return out
+
+
+def get_many(db: Session, employee_ids: Iterable[Optional[int]]) -> Dict[int, EmployeeCard]:
+    """{id: EmployeeCard} ของ id ที่มีอยู่จริง (id ที่ไม่พบจะไม่อยู่ในผลลัพธ์)"""
+    wanted = {int(i) for i in employee_ids if i is not None}
+    if not wanted:
+        return {}
+
+    now = _time.monotonic()
+    found: Dict[int, EmployeeCard] = {}
+    with _lock:
+        for i in wanted:
+            hit = _cards.get(i)
+            if hit and (now - hit[1]) < EMPLOYEE_DIRECTORY_TTL:
+                found[i] = hit[0]
+
+    missing = sorted(wanted - found.keys())
+    if missing:
+        loaded = _load(db, missing)
+        with _lock:
+            for i, card in loaded.items():
+                _cards[i] = (card, now)
+        found.update(loaded)
+    return found
+
+
+def get(db: Session, employee_id: Optional[int]) -> Optional[EmployeeCard]:
+    if employee_id is None:
+        return None
+    return get_many(db, [employee_id]).get(int(employee_id))
+
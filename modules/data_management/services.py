@@ -5,6 +5,7 @@ from sqlalchemy.orm import Session, joinedload
 from sqlalchemy.exc import IntegrityError
 
 from . import models, schemas
+from . import directory
 
 # -------------------------------------------------
 # Helpers
@@ -111,6 +112,7 @@ def update_department(db: Session, department_id: int, department_update: schema
             status_code=status.HTTP_409_CONFLICT,
             detail="Update failed due to unique constraint",
         )
+    directory.invalidate()  # ชื่อแผนกอยู่ใน EmployeeCard
     db.refresh(db_department)
     return db_department
 
@@ -202,6 +204,7 @@ def update_position(db: Session, position_id: int, position_update: schemas.Posi
             status_code=status.HTTP_409_CONFLICT,
             detail="Update failed due to unique constraint",
         )
+    directory.invalidate()  # ชื่อตำแหน่งอยู่ใน EmployeeCard
     db.refresh(db_position)
     return db_position
 
@@ -317,6 +320,7 @@ def create_employee(db: Session, employee: schemas.EmployeeCreate):
             status_code=status.HTTP_409_CONFLICT,
             detail="Employee unique constraint violated (ID card/employee ID/email/phone)",
         )
+    directory.invalidate([db_employee.id])
     db.refresh(db_employee)
     db.refresh(db_employee, attribute_names=["department", "position"])
     return db_employee
@@ -374,6 +378,7 @@ def update_employee(db: Session, employee_id: int, employee_update: schemas.Empl
             detail="Update failed due to unique constraint",
         )
 
+    directory.invalidate([employee_id])
     db.refresh(db_employee)
     db.refresh(db_employee, attribute_names=["department", "position"])
     return db_employee
@@ -399,4 +404,5 @@ def delete_employee(db: Session, employee_id: int):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Cannot delete employee due to related records (foreign key constraints).",
         )
+    directory.invalidate([employee_id])
     return {"message": "Employee deleted successfully"}
@@ -99,6 +99,17 @@ def ensure_meeting_bookings_columns(engine: Engine = default_engine) -> None:
             print("✓ Migrated meeting_bookings: added attendee_count")
 
 
+def ensure_meeting_bookings_indexes(engine: Engine = default_engine) -> None:
+    """
+    index สำหรับตรวจเวลาซ้อนทับ: (room_id, start_time, end_time)
+    """
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_meeting_bookings_room_time "
+            "ON meeting_bookings (room_id, start_time, end_time)"
+        ))
+
+
 # -------------------------------------------------------------------
 # Entry for app startup
 # -------------------------------------------------------------------
@@ -108,3 +119,4 @@ def run_startup_migrations(engine: Engine = default_engine) -> None:
     """
     migrate_meeting_rooms_columns(engine)
     ensure_meeting_bookings_columns(engine)
+    ensure_meeting_bookings_indexes(engine)
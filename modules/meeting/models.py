@@ -12,6 +12,7 @@ from sqlalchemy import (
     ForeignKey,
     Text,
     Boolean,
+    Index,
 )
 from sqlalchemy import Enum as SAEnum
 from sqlalchemy.orm import relationship
@@ -75,6 +76,10 @@ class Booking(Base):
         passive_deletes=True,
     )
 
+    __table_args__ = (
+        Index("ix_meeting_bookings_room_time", "room_id", "start_time", "end_time"),
+    )
+
 
 class BookingAttendee(Base):
     __tablename__ = "meeting_booking_attendees"
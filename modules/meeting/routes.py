@@ -131,6 +131,10 @@ def create_booking(payload: BookingCreate, db: Session = Depends(get_db)):
     booking = svc_create_booking(db, payload)
     return booking
 
+@api.post("/bookings/bulk", response_model=List[BookingOut])
+def create_bookings_bulk(payload: List[BookingCreate], db: Session = Depends(get_db)):
+    return services.create_bookings_bulk(db, payload)
+
 @api.put("/bookings/{booking_id}", response_model=BookingOut)
 def update_booking(booking_id: int, payload: BookingUpdate, db: Session = Depends(get_db)):
     st = payload.start_time
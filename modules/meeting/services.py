@@ -12,7 +12,8 @@ from sqlalchemy.orm import Session, joinedload
 from modules.meeting import models, schemas
 from modules.common.email_service import EmailService
 from config.settings import email_settings
-from modules.data_management.models import Employee as DMEmployee
+from modules.data_management import directory
+from modules.common.intervals import find_conflicts, span_of
 
 email_svc = EmailService(email_settings)
 
@@ -20,15 +21,15 @@ email_svc = EmailService(email_settings)
 def _emails_from_employee_ids(db: Session, employee_ids: Optional[List[int]]) -> List[str]:
     if not employee_ids:
         return []
-    rows = db.query(DMEmployee).filter(DMEmployee.id.in_(employee_ids)).all()
-    return [(r.email or "").strip() for r in rows if (r.email or "").strip()]
+    cards = directory.get_many(db, employee_ids)
+    return [c.email for c in cards.values() if c.email]
 
 def _get_room_coordinator_emails(db: Session, room: models.MeetingRoom) -> List[str]:
     emails: List[str] = []
     if room.coordinator_employee_id:
-        emp = db.get(DMEmployee, room.coordinator_employee_id)
-        if emp and (emp.email or "").strip():
-            emails.append(emp.email.strip())
+        card = directory.get(db, room.coordinator_employee_id)
+        if card and card.email:
+            emails.append(card.email)
     if (room.coordinator_email or "").strip():
         emails.append(room.coordinator_email.strip())
     return sorted({e for e in emails if "@" in e})
@@ -53,6 +54,24 @@ def assert_no_overlap(
     if q.first():
         raise HTTPException(status_code=400, detail="ช่วงเวลานี้ถูกจองแล้ว (ห้องเดียวกันและเวลาซ้อนทับ)")
 
+def find_booking_conflicts(db: Session, proposed: List[tuple]) -> dict:
+    """proposed = [(room_id, start, end), ...] -> {index: Conflict} (เทียบ DB + เทียบกันเองในชุด)"""
+    if not proposed:
+        return {}
+    rooms, lo, hi = span_of(proposed)
+    B = models.Booking
+    existing = (
+        db.query(B.room_id, B.start_time, B.end_time, B.id)
+        .filter(
+            B.room_id.in_(rooms),
+            B.status != models.BookingStatus.CANCELLED,
+            B.start_time < hi,
+            B.end_time > lo,
+        )
+        .all()
+    )
+    return find_conflicts(proposed, existing)
+
 # ----------------------------- email ------------------------------
 def _format_dt(dt: datetime) -> str:
     return dt.strftime("%Y-%m-%d %H:%M")
@@ -66,15 +85,22 @@ def send_booking_email(db: Session, booking: models.Booking, extra_to: Optional[
     if booking.requester_email:
         to_list.append(booking.requester_email)
 
+    # ผู้เข้าร่วมที่เป็นพนักงาน: ดึง card ครั้งเดียวทั้งรายการ
+    try:
+        attendees = list(booking.attendees or [])
+        cards = directory.get_many(db, (a.employee_id for a in attendees if a.employee_id))
+    except Exception:
+        attendees, cards = [], {}
+
     # from attendees (relationship)
     try:
-        for a in (booking.attendees or []):
+        for a in attendees:
             if (a.attendee_email or "").strip():
                 to_list.append(a.attendee_email.strip())
             elif a.employee_id:
-                emp = db.get(DMEmployee, a.employee_id)
-                if emp and (emp.email or "").strip():
-                    to_list.append(emp.email.strip())
+                card = cards.get(a.employee_id)
+                if card and card.email:
+                    to_list.append(card.email)
     except Exception:
         pass
 
@@ -87,11 +113,11 @@ def send_booking_email(db: Session, booking: models.Booking, extra_to: Optional[
 
     attendee_lines: List[str] = []
     try:
-        for a in (booking.attendees or []):
+        for a in attendees:
             label = (a.attendee_name or "") or (a.attendee_email or "")
             if a.employee_id and not label:
-                emp = db.get(DMEmployee, a.employee_id)
-                label = (f"{(emp.first_name or '').strip()} {(emp.last_name or '').strip()}").strip() or (emp.email or "")
+                card = cards.get(a.employee_id)
+                label = card.label if card else ""
             if label:
                 attendee_lines.append(label)
     except Exception:
@@ -140,7 +166,7 @@ def create_booking(db: Session, payload: schemas.BookingCreate) -> models.Bookin
     # บันทึกผู้เข้าร่วม
     attendee_count = 0
     if getattr(payload, "attendee_employee_ids", None):
-        emps = db.query(DMEmployee).filter(DMEmployee.id.in_(payload.attendee_employee_ids)).all()
+        emps = list(directory.get_many(db, payload.attendee_employee_ids).values())
         for emp in emps:
             full_name = f"{emp.first_name or ''} {emp.last_name or ''}".strip()
             db.add(models.BookingAttendee(
@@ -167,6 +193,83 @@ def create_booking(db: Session, payload: schemas.BookingCreate) -> models.Bookin
     )
     return booking
 
+def create_bookings_bulk(db: Session, payloads: List[schemas.BookingCreate]) -> List[models.Booking]:
+    """จองหลายรายการ (เช่น ประชุมประจำ): ตรวจห้อง/ช่วงเวลาทั้งชุดครั้งเดียว แล้ว commit ครั้งเดียว"""
+    if not payloads:
+        return []
+
+    room_ids = {p.room_id for p in payloads}
+    rooms = {r.id: r for r in db.query(models.MeetingRoom).filter(models.MeetingRoom.id.in_(room_ids)).all()}
+    for i, p in enumerate(payloads):
+        room = rooms.get(p.room_id)
+        if not room or not room.is_active:
+            raise HTTPException(status_code=400, detail=f"รายการที่ {i}: ห้องไม่พร้อมใช้งาน")
+        if p.end_time <= p.start_time:
+            raise HTTPException(status_code=400, detail=f"รายการที่ {i}: ช่วงเวลาผิดพลาด")
+
+    conflicts = find_booking_conflicts(db, [(p.room_id, p.start_time, p.end_time) for p in payloads])
+    if conflicts:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "message": "ช่วงเวลานี้ถูกจองแล้ว (ห้องเดียวกันและเวลาซ้อนทับ)",
+                "conflicts": [c._asdict() for _, c in sorted(conflicts.items())],
+            },
+        )
+
+    emp_ids = {eid for p in payloads for eid in (getattr(p, "attendee_employee_ids", None) or [])}
+    emps = directory.get_many(db, emp_ids)
+
+    bookings: List[models.Booking] = []
+    for p in payloads:
+        status_model = models.BookingStatus.PENDING
+        if getattr(p, "status", None):
+            status_model = getattr(models.BookingStatus, p.status.name, models.BookingStatus.PENDING)
+        booking = models.Booking(
+            room_id=p.room_id,
+            subject=p.subject,
+            requester_email=(p.requester_email or "").strip() or None,
+            contact_person=(getattr(p, "contact_person", None) or "").strip() or None,
+            start_time=p.start_time,
+            end_time=p.end_time,
+            notes=p.notes,
+            status=status_model,
+        )
+        attendee_count = 0
+        for eid in dict.fromkeys(getattr(p, "attendee_employee_ids", None) or []):
+            emp = emps.get(eid)
+            if not emp:
+                continue
+            full_name = f"{emp.first_name or ''} {emp.last_name or ''}".strip()
+            booking.attendees.append(models.BookingAttendee(
+                employee_id=emp.id,
+                attendee_name=full_name or None,
+                attendee_email=(emp.email or None),
+            ))
+            attendee_count += 1
+        if hasattr(booking, "attendee_count"):
+            booking.attendee_count = attendee_count
+        bookings.append(booking)
+
+    db.add_all(bookings)
+    db.commit()
+
+    for booking, p in zip(bookings, payloads):
+        extra = [
+            (emps[eid].email or "").strip()
+            for eid in (getattr(p, "attendee_employee_ids", None) or [])
+            if eid in emps and (emps[eid].email or "").strip()
+        ]
+        send_booking_email(db, booking, extra_to=extra)
+
+    return (
+        db.query(models.Booking)
+        .options(joinedload(models.Booking.attendees), joinedload(models.Booking.room))
+        .filter(models.Booking.id.in_([b.id for b in bookings]))
+        .order_by(models.Booking.start_time.asc())
+        .all()
+    )
+
 def update_booking(db: Session, booking_id: int, payload: schemas.BookingUpdate) -> models.Booking:
     booking = db.get(models.Booking, booking_id)
     if not booking:
@@ -198,7 +301,10 @@ def booking_summary(db: Session, date_from: date, date_to: date) -> Dict:
         .filter(models.Booking.start_time <= end_dt, models.Booking.end_time >= start_dt)
         .filter(models.Booking.status != models.BookingStatus.CANCELLED)
     )
-    bookings = q.all()
+    bookings = q.options(joinedload(models.Booking.room)).all()
+    coords = directory.get_many(
+        db, {b.room.coordinator_employee_id for b in bookings if b.room and b.room.coordinator_employee_id}
+    )
 
     total_rooms = db.query(func.count(models.MeetingRoom.id)).scalar() or 0
     total_bookings = len(bookings)
@@ -221,9 +327,9 @@ def booking_summary(db: Session, date_from: date, date_to: date) -> Dict:
         try:
             room = b.room
             if room and room.coordinator_employee_id:
-                emp = db.get(DMEmployee, room.coordinator_employee_id)
-                if emp:
-                    coord_key = (f"{(emp.first_name or '').strip()} {(emp.last_name or '').strip()}").strip() or (emp.email or "-")
+                card = coords.get(room.coordinator_employee_id)
+                if card:
+                    coord_key = card.label or "-"
         except Exception:
             pass
         by_coord[coord_key]["count"] += 1
@@ -15,7 +15,7 @@ from sqlalchemy import or_, desc
 
 from database.connection import get_db
 from modules.payroll import models, schemas, services
-from modules.data_management import models as dm_models
+from modules.data_management import directory
 from modules.payroll.models import PayrollEntry
 from modules.data_management.models import Employee
 from modules.payroll.schemas import PayrollEntryInDB
@@ -357,6 +357,20 @@ def delete_payroll_run(payroll_run_id: int, db: Session = Depends(get_db)):
     return {"message": "รอบการจ่ายเงินเดือนถูกลบแล้ว"}
 
 
+# คำนวณทั้งรอบในครั้งเดียว (bulk load + bulk upsert)
+@api_router.post("/payroll-runs/{payroll_run_id}/calculate", status_code=status.HTTP_200_OK)
+def calculate_payroll_run_route(
+    payroll_run_id: int,
+    employee_ids: Optional[List[int]] = Query(None, description="ระบุเฉพาะบางคน (ไม่ระบุ = ทุกคนที่มีโครงสร้างเงินเดือน)"),
+    parallel: bool = Query(False, description="คำนวณแบบขนานหลาย process"),
+    workers: Optional[int] = Query(None, ge=1, description="จำนวน worker (ไม่ระบุ = PAYROLL_WORKERS หรือจำนวน CPU)"),
+    db: Session = Depends(get_db),
+):
+    return services.calculate_payroll_run(
+        db=db, run_id=payroll_run_id, employee_ids=employee_ids, parallel=parallel, workers=workers
+    )
+
+
 # ---------- API ROUTES : Payroll Entries ----------
 @api_router.post("/payroll-entries/", response_model=schemas.PayrollEntryInDB, status_code=status.HTTP_201_CREATED)
 def create_payroll_entry_route(payroll_entry: schemas.PayrollEntryCreate, db: Session = Depends(get_db)):
@@ -399,8 +413,7 @@ def payroll_entries_report(
     p_start, p_end, label = _compute_period(month, start_date, end_date)
 
     q = (
-        db.query(models.PayrollEntry, dm_models.Employee, models.PayrollRun)
-        .join(dm_models.Employee, dm_models.Employee.id == models.PayrollEntry.employee_id)
+        db.query(models.PayrollEntry, models.PayrollRun)
         .join(models.PayrollRun, models.PayrollRun.id == models.PayrollEntry.payroll_run_id)
         .filter(
             models.PayrollRun.period_start >= p_start,
@@ -424,7 +437,13 @@ def payroll_entries_report(
     allowance_totals_by_type: dict[str, float] = {}
     deduction_totals_by_type: dict[str, float] = {}
 
-    for entry, emp, run in q.all():
+    results = q.all()
+    cards = directory.get_many(db, {entry.employee_id for entry, _ in results})
+
+    for entry, run in results:
+        emp = cards.get(entry.employee_id)
+        if emp is None:  # พนักงานถูกลบไปแล้ว (เดิม inner join ตัดทิ้ง)
+            continue
         allow_map = _parse_items_to_map(entry.calculated_allowances_json)
         deduct_map = _parse_items_to_map(entry.calculated_deductions_json)
 
@@ -447,7 +466,7 @@ def payroll_entries_report(
 
         row = {
             "employee_id": emp.id,
-            "employee_name": f"{emp.first_name} {emp.last_name}",
+            "employee_name": emp.full_name,
             "payroll_run_id": run.id,
             "period_start": run.period_start,
             "period_end": run.period_end,
@@ -716,7 +735,7 @@ def _build_payslip_context(db: Session, entry_id: int) -> dict:
         raise HTTPException(status_code=404, detail="ไม่พบรายการจ่ายเงินเดือน")
 
     run = db.query(models.PayrollRun).get(entry.payroll_run_id)
-    employee = db.query(dm_models.Employee).get(entry.employee_id)
+    employee = directory.get(db, entry.employee_id)
 
     allowances, deductions = [], []
     try:
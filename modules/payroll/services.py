@@ -1,61 +1,207 @@
 from __future__ import annotations
 
-from typing import List, Optional
+from typing import Callable, List, Optional
 from datetime import datetime, date
-import json
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from itertools import repeat
+import json, os
 import ast, re
 
+# numpy ไม่บังคับ: ถ้ามีจะใช้ประเมินสูตรแบบ column (ทั้งรอบในครั้งเดียว)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from fastapi import HTTPException
-from sqlalchemy import select, func, or_, and_
+from sqlalchemy import select, func, or_, and_, update
 from sqlalchemy.orm import Session, joinedload
 
 from modules.payroll import models, schemas
+from modules.data_management import directory
 # ดึง metric จากฝั่ง time_tracking
-from modules.time_tracking.services import get_attendance_metrics
+from modules.time_tracking.services import (
+    get_attendance_metrics,
+    get_attendance_metrics_bulk,
+    drain_dirty_attendance,
+)
 
 # -------------------- Safe formula engine --------------------
 _ALLOWED_FUNCS   = {"min": min, "max": max, "round": round, "abs": abs}
 _ALLOWED_BINOPS  = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv)
 _ALLOWED_UNARYOPS = (ast.UAdd, ast.USub)
 
+# สูตรที่คอมไพล์แล้ว (key = ข้อความสูตร) -> ฟังก์ชัน f(variables) -> float
+_FORMULA_CACHE: dict[str, Callable[[dict], float]] = {}
+
+def _zero_formula(variables: dict) -> float:
+    return 0.0
+
+def _normalize_formula(expr) -> str:
+    return re.sub(r"\{([A-Za-z_][A-Za-z0-9_]*)\}", r"\1", str(expr)).strip()
+
+def _compile_node(node) -> Callable[[dict], float]:
+    """แปลง AST ที่ผ่านการตรวจแล้วเป็น closure (ตรวจครั้งเดียวตอนคอมไพล์)"""
+    if isinstance(node, ast.Expression):
+        return _compile_node(node.body)
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, (int, float)):
+            c = float(node.value)
+            return lambda v: c
+        raise ValueError("const not allowed")
+    if isinstance(node, ast.BinOp) and isinstance(node.op, _ALLOWED_BINOPS):
+        l, r = _compile_node(node.left), _compile_node(node.right)
+        if isinstance(node.op, ast.Add):  return lambda v: l(v) + r(v)
+        if isinstance(node.op, ast.Sub):  return lambda v: l(v) - r(v)
+        if isinstance(node.op, ast.Mult): return lambda v: l(v) * r(v)
+        if isinstance(node.op, ast.Div):
+            def _div(v):
+                a, b = l(v), r(v)
+                return a / b if b != 0 else 0.0
+            return _div
+        def _floordiv(v):
+            a, b = l(v), r(v)
+            return a // b if b != 0 else 0.0
+        return _floordiv
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, _ALLOWED_UNARYOPS):
+        operand = _compile_node(node.operand)
+        if isinstance(node.op, ast.UAdd):
+            return lambda v: +operand(v)
+        return lambda v: -operand(v)
+    if isinstance(node, ast.Name):
+        key = node.id
+        return lambda v: float(v.get(key, 0.0) or 0.0)
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _ALLOWED_FUNCS:
+        fn = _ALLOWED_FUNCS[node.func.id]
+        args = [_compile_node(a) for a in node.args]
+        return lambda v: float(fn(*[a(v) for a in args]))
+    raise ValueError("disallowed")
+
+def _compile_formula(expr: str) -> Callable[[dict], float]:
+    """คอมไพล์สูตรครั้งเดียว (พร้อม cache) — สูตรที่ไม่ถูกต้องได้ฟังก์ชันที่คืน 0 เสมอ"""
+    key = str(expr)
+    fn = _FORMULA_CACHE.get(key)
+    if fn is not None:
+        return fn
+
+    try:
+        body = _compile_node(ast.parse(_normalize_formula(key), mode="eval"))
+
+        def fn(variables: dict) -> float:
+            try:
+                return float(body(variables))
+            except Exception:
+                return 0.0
+    except Exception:
+        fn = _zero_formula
+
+    _FORMULA_CACHE[key] = fn
+    return fn
+
+def _invalidate_formula(*exprs) -> None:
+    for expr in exprs:
+        if expr:
+            _FORMULA_CACHE.pop(str(expr), None)
+            _VECTOR_FORMULA_CACHE.pop(str(expr), None)
+
 def _safe_eval_expr(expr: str, variables: dict[str, float]) -> float:
     """ประเมินนิพจน์เลขคณิตแบบปลอดภัย (+ - * / // () และ min/max/round/abs)
        รองรับ {Var} หรือ Var"""
     if not expr:
         return 0.0
-    expr = re.sub(r"\{([A-Za-z_][A-Za-z0-9_]*)\}", r"\1", str(expr)).strip()
-
-    def _eval(node):
-        if isinstance(node, ast.Expression):
-            return _eval(node.body)
-        if isinstance(node, ast.Num):
-            return float(node.n)
-        if isinstance(node, ast.Constant):
-            if isinstance(node.value, (int, float)):
-                return float(node.value)
-            raise ValueError("const not allowed")
-        if isinstance(node, ast.BinOp) and isinstance(node.op, _ALLOWED_BINOPS):
-            l, r = _eval(node.left), _eval(node.right)
-            if isinstance(node.op, ast.Add):       return l + r
-            if isinstance(node.op, ast.Sub):       return l - r
-            if isinstance(node.op, ast.Mult):      return l * r
-            if isinstance(node.op, ast.Div):       return l / r if r != 0 else 0.0
-            if isinstance(node.op, ast.FloorDiv):  return l // r if r != 0 else 0.0
-        if isinstance(node, ast.UnaryOp) and isinstance(node.op, _ALLOWED_UNARYOPS):
-            v = _eval(node.operand)
-            return +v if isinstance(node.op, ast.UAdd) else -v
-        if isinstance(node, ast.Name):
-            return float(variables.get(node.id, 0.0) or 0.0)
-        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _ALLOWED_FUNCS:
-            fn = _ALLOWED_FUNCS[node.func.id]
-            args = [_eval(a) for a in node.args]
-            return float(fn(*args))
-        raise ValueError("disallowed")
-
+    return _compile_formula(expr)(variables)
+
+# -------------------- Vectorized formula engine (numpy) --------------------
+# ประเมินสูตรเดียวกับ _safe_eval_expr แต่ทีละ "คอลัมน์" (ทุกคนในรอบพร้อมกัน)
+# กรณีที่ผลลัพธ์อาจต่างจาก Python (เช่น min() อาร์กิวเมนต์เดียว, round(x, n)) จะไม่ vectorize
+# และค่าที่ไม่ finite ระหว่างทางจะถูกคำนวณซ้ำด้วย _safe_eval_expr ทีละคน
+_VECTOR_FORMULA_CACHE: dict[str, Optional[Callable]] = {}
+
+class _NotVectorizable(Exception):
+    pass
+
+def _compile_vector_node(node) -> Callable:
+    """คืน f(cols, n, bad) -> ndarray ; bad = mask ของแถวที่ต้อง fallback"""
+    def _track(res, bad):
+        bad |= ~np.isfinite(res)
+        return res
+
+    if isinstance(node, ast.Expression):
+        return _compile_vector_node(node.body)
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, (int, float)):
+            c = float(node.value)
+            return lambda cols, n, bad: _track(np.full(n, c), bad)
+        raise _NotVectorizable("const")
+    if isinstance(node, ast.BinOp) and isinstance(node.op, _ALLOWED_BINOPS):
+        l, r = _compile_vector_node(node.left), _compile_vector_node(node.right)
+        if isinstance(node.op, ast.Add):  return lambda cols, n, bad: _track(l(cols, n, bad) + r(cols, n, bad), bad)
+        if isinstance(node.op, ast.Sub):  return lambda cols, n, bad: _track(l(cols, n, bad) - r(cols, n, bad), bad)
+        if isinstance(node.op, ast.Mult): return lambda cols, n, bad: _track(l(cols, n, bad) * r(cols, n, bad), bad)
+        op = np.divide if isinstance(node.op, ast.Div) else np.floor_divide
+
+        def _div(cols, n, bad):
+            a, b = l(cols, n, bad), r(cols, n, bad)
+            # หารด้วย 0 -> 0 เหมือน _safe_eval_expr
+            return _track(op(a, b, out=np.zeros(n), where=(b != 0)), bad)
+        return _div
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, _ALLOWED_UNARYOPS):
+        operand = _compile_vector_node(node.operand)
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        return lambda cols, n, bad: -operand(cols, n, bad)
+    if isinstance(node, ast.Name):
+        key = node.id
+        return lambda cols, n, bad: _track(cols[key] if key in cols else np.zeros(n), bad)
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _ALLOWED_FUNCS and not node.keywords:
+        name = node.func.id
+        args = [_compile_vector_node(a) for a in node.args]
+        if name in ("min", "max") and len(args) >= 2:
+            reduce = np.minimum.reduce if name == "min" else np.maximum.reduce
+            return lambda cols, n, bad: _track(reduce([a(cols, n, bad) for a in args]), bad)
+        if name == "abs" and len(args) == 1:
+            return lambda cols, n, bad: np.abs(args[0](cols, n, bad))
+        if name == "round" and len(args) == 1:
+            return lambda cols, n, bad: np.round(args[0](cols, n, bad))
+    raise _NotVectorizable("node")
+
+def _compile_vector_formula(expr: str) -> Optional[Callable]:
+    key = str(expr)
+    if key in _VECTOR_FORMULA_CACHE:
+        return _VECTOR_FORMULA_CACHE[key]
     try:
-        return float(_eval(ast.parse(expr, mode="eval")))
+        fn = _compile_vector_node(ast.parse(_normalize_formula(key), mode="eval"))
     except Exception:
-        return 0.0
+        fn = None
+    _VECTOR_FORMULA_CACHE[key] = fn
+    return fn
+
+def _eval_formula_columns(expr: str, cols: dict, rows: list[dict]) -> list[float]:
+    """ประเมินสูตรของทุกแถวในครั้งเดียว; ผลเท่ากับ [_safe_eval_expr(expr, r) for r in rows]"""
+    n = len(rows)
+    fn = _compile_vector_formula(expr) if (np is not None and expr) else None
+    if fn is None:
+        return [_safe_eval_expr(expr, r) for r in rows]
+
+    bad = np.zeros(n, dtype=bool)
+    with np.errstate(all="ignore"):
+        try:
+            res = np.broadcast_to(np.asarray(fn(cols, n, bad), dtype=float), (n,))
+        except Exception:
+            return [_safe_eval_expr(expr, r) for r in rows]
+
+    out = res.tolist()
+    for i in np.flatnonzero(bad).tolist():
+        out[i] = _safe_eval_expr(expr, rows[i])
+    return out
+
+def _formula_columns(rows: list[dict]) -> dict:
+    keys = {k for r in rows for k in r}
+    return {
+        k: np.array([float(r.get(k, 0.0) or 0.0) for r in rows], dtype=float)
+        for k in keys
+    }
 
 # -------------------- Variable builders --------------------
 def _formula_variables_from_attendance(
@@ -63,7 +209,10 @@ def _formula_variables_from_attendance(
 ) -> dict[str, float]:
 
     m = get_attendance_metrics(db, employee_id, period_start, period_end) or {}
+    return _formula_variables(m, base_salary)
 
+def _formula_variables(m: dict, base_salary: float) -> dict[str, float]:
+    """สร้างตัวแปรสูตรจาก metrics ของ time_tracking (ไม่แตะ DB)"""
     minute_rate = float(base_salary or 0) / 30.0 / 8.0 / 60.0
     hour_rate   = minute_rate * 60.0
 
@@ -110,16 +259,24 @@ def _items_from_formula_types(
 ) -> tuple[list[dict], list[dict]]:
 
     vars_map = _formula_variables_from_attendance(db, employee_id, period_start, period_end, base_salary)
+    allow_types, deduct_types = _active_formula_types(db)
+    return _formula_items(vars_map, allow_types, deduct_types)
+
+def _uses_specific_ot(formula: str | None) -> bool:
+    if not formula:
+        return False
+    f = str(formula)
+    # ครอบคลุมทุก bucket
+    return ("OT1xMinutes" in f) or ("OT15Minutes" in f) or ("OT30Minutes" in f)
 
+def _active_formula_types(db: Session) -> tuple[list, list]:
     allow_types = db.query(models.AllowanceType).filter(models.AllowanceType.is_active == True).all()
     deduct_types = db.query(models.DeductionType).filter(models.DeductionType.is_active == True).all()
+    return allow_types, deduct_types
 
-    def _uses_specific_ot(formula: str | None) -> bool:
-        if not formula:
-            return False
-        f = str(formula)
-        # ครอบคลุมทุก bucket
-        return ("OT1xMinutes" in f) or ("OT15Minutes" in f) or ("OT30Minutes" in f)
+def _formula_items(
+    vars_map: dict[str, float], allow_types: list, deduct_types: list
+) -> tuple[list[dict], list[dict]]:
 
     has_specific_ot = any(_uses_specific_ot(t.formula) for t in allow_types + deduct_types)
 
@@ -146,6 +303,31 @@ def _items_from_formula_types(
 
     return formula_allow, formula_deduct
 
+def _formula_items_many(
+    vars_list: list[dict[str, float]], allow_types: list, deduct_types: list
+) -> list[tuple[list[dict], list[dict]]]:
+    """เหมือน _formula_items แต่ของทุกคนในรอบ: แต่ละสูตรถูกประเมินครั้งเดียวแบบ column"""
+    if np is None or not vars_list:
+        return [_formula_items(v, allow_types, deduct_types) for v in vars_list]
+
+    has_specific_ot = any(_uses_specific_ot(t.formula) for t in allow_types + deduct_types)
+    rows = [dict(v) for v in vars_list]
+    if has_specific_ot:
+        for r in rows:
+            r["OTMinutes"] = 0.0
+    cols = _formula_columns(rows)
+
+    out: list[tuple[list[dict], list[dict]]] = [([], []) for _ in rows]
+    for side, types in ((0, allow_types), (1, deduct_types)):
+        for t in types:
+            if not t.formula:
+                continue
+            for i, val in enumerate(_eval_formula_columns(t.formula, cols, rows)):
+                amt = _money(val)
+                if amt != 0:
+                    out[i][side].append({"label": t.name, "name": t.name, "amount": amt})
+    return out
+
 # -------------------- Helpers --------------------
 def _money(x: float | int | None) -> float:
     try:
@@ -223,12 +405,16 @@ def get_allowance_type(db: Session, allowance_type_id: int):
 def update_allowance_type(db: Session, allowance_type_id: int, allowance_type: schemas.AllowanceTypeUpdate):
     obj = get_allowance_type(db, allowance_type_id); 
     if not obj: return None
+    old_formula = obj.formula
     for k,v in allowance_type.model_dump(exclude_unset=True).items(): setattr(obj,k,v)
-    db.commit(); db.refresh(obj); return obj
+    db.commit(); db.refresh(obj)
+    if obj.formula != old_formula: _invalidate_formula(old_formula)
+    return obj
 def delete_allowance_type(db: Session, allowance_type_id: int):
     obj = get_allowance_type(db, allowance_type_id); 
     if not obj: return None
-    db.delete(obj); db.commit(); return True
+    old_formula = obj.formula
+    db.delete(obj); db.commit(); _invalidate_formula(old_formula); return True
 
 # --- Deduction Types CRUD ---
 def create_deduction_type(db: Session, deduction_type: schemas.DeductionTypeCreate):
@@ -240,12 +426,16 @@ def get_deduction_type(db: Session, deduction_type_id: int):
 def update_deduction_type(db: Session, deduction_type_id: int, deduction_type: schemas.DeductionTypeUpdate):
     obj = get_deduction_type(db, deduction_type_id); 
     if not obj: return None
+    old_formula = obj.formula
     for k,v in deduction_type.model_dump(exclude_unset=True).items(): setattr(obj,k,v)
-    db.commit(); db.refresh(obj); return obj
+    db.commit(); db.refresh(obj)
+    if obj.formula != old_formula: _invalidate_formula(old_formula)
+    return obj
 def delete_deduction_type(db: Session, deduction_type_id: int):
     obj = get_deduction_type(db, deduction_type_id); 
     if not obj: return None
-    db.delete(obj); db.commit(); return True
+    old_formula = obj.formula
+    db.delete(obj); db.commit(); _invalidate_formula(old_formula); return True
 
 # --- Salary Structure CRUD ---
 def create_salary_structure(db: Session, salary_structure: schemas.SalaryStructureCreate):
@@ -469,12 +659,7 @@ def calculate_and_save_payroll_entry(
     allowances.extend(form_allow)
     deductions.extend(form_deduct)
 
-    # Totals
-    total_allowances = _money(sum(a["amount"] for a in allowances))
-    total_deductions = _money(sum(d["amount"] for d in deductions))
-
-    gross = _money(base_salary + total_allowances)
-    net   = _money(gross - total_deductions)
+    values = _entry_values(base_salary, allowances, deductions)
 
     # Upsert
     entry = (db.query(models.PayrollEntry)
@@ -482,39 +667,222 @@ def calculate_and_save_payroll_entry(
                        models.PayrollEntry.employee_id == employee_id)
                .first())
 
-    payload_allow  = json.dumps(allowances, ensure_ascii=False)
-    payload_deduct = json.dumps(deductions, ensure_ascii=False)
-
     if entry is None:
         entry = models.PayrollEntry(
             payroll_run_id=run_id, employee_id=employee_id,
-            gross_salary=gross, net_salary=net,
-            calculated_allowances_json=payload_allow,
-            calculated_deductions_json=payload_deduct,
             payment_status=models.PaymentStatus.PENDING,
+            **values,
         )
         db.add(entry)
     else:
-        entry.gross_salary = gross
-        entry.net_salary = net
-        entry.calculated_allowances_json = payload_allow
-        entry.calculated_deductions_json = payload_deduct
+        for k, v in values.items(): setattr(entry, k, v)
 
     db.commit(); db.refresh(entry)
     _recalculate_run_total_amount(db, run_id)
     return entry
 
+def _entry_values(base_salary: float, allowances: list[dict], deductions: list[dict]) -> dict:
+    """รวมยอด + แปลงเป็น JSON สำหรับเก็บลง PayrollEntry"""
+    total_allowances = _money(sum(a["amount"] for a in allowances))
+    total_deductions = _money(sum(d["amount"] for d in deductions))
+
+    gross = _money(base_salary + total_allowances)
+    net   = _money(gross - total_deductions)
+
+    return {
+        "gross_salary": gross,
+        "net_salary": net,
+        "calculated_allowances_json": json.dumps(allowances, ensure_ascii=False),
+        "calculated_deductions_json": json.dumps(deductions, ensure_ascii=False),
+    }
+
+# -------------------- Calculate whole payroll run (batch) --------------------
+def _run_employee_ids(db: Session, run_id: int) -> list[int]:
+    """พนักงานในรอบ = คนที่มีโครงสร้างเงินเดือน + คนที่มี entry ในรอบนี้อยู่แล้ว"""
+    ids = {eid for (eid,) in db.query(models.SalaryStructure.employee_id).all()}
+    ids.update(
+        eid for (eid,) in db.query(models.PayrollEntry.employee_id)
+                            .filter(models.PayrollEntry.payroll_run_id == run_id).all()
+    )
+    return sorted(ids)
+
+def _base_salaries(db: Session, employee_ids: list[int], period_end: date) -> dict[int, float]:
+    """เลือกโครงสร้างเงินเดือนล่าสุดที่มีผลภายใน period_end (ถ้าไม่มีใช้อันล่าสุด) — query เดียว"""
+    by_emp: dict[int, list] = {}
+    for ss in (db.query(models.SalaryStructure)
+                 .filter(models.SalaryStructure.employee_id.in_(employee_ids))
+                 .order_by(models.SalaryStructure.effective_date.desc(), models.SalaryStructure.id.asc())
+                 .all()):
+        by_emp.setdefault(ss.employee_id, []).append(ss)
+
+    out: dict[int, float] = {}
+    for emp_id, rows in by_emp.items():
+        ss = next((r for r in rows if r.effective_date <= period_end), None) or rows[0]
+        out[emp_id] = _money(ss.base_salary)
+    return out
+
+def _fixed_items(db: Session, item_model, type_model, type_fk, employee_ids: list[int],
+                 period_start: date, period_end: date) -> dict[int, list[dict]]:
+    rows = (
+        db.query(item_model, type_model.name)
+          .join(type_model, type_model.id == type_fk)
+          .filter(
+              item_model.employee_id.in_(employee_ids),
+              item_model.status == models.StatusEnum.ACTIVE,
+              item_model.effective_date >= period_start,
+              item_model.effective_date <= period_end,
+          )
+          .order_by(item_model.id.asc())
+          .all()
+    )
+    out: dict[int, list[dict]] = {}
+    for it, name in rows:
+        out.setdefault(it.employee_id, []).append({"label": name, "name": name, "amount": _money(it.amount)})
+    return out
+
+def _compute_run_entries(
+    db: Session, employee_ids: list[int], period_start: date, period_end: date, recompute: bool = True
+) -> list[dict]:
+    """คำนวณ entry ของพนักงานทั้งชุดในหน่วยความจำ (ไม่เขียน DB)
+       โหลดข้อมูลทุกอย่างแบบ bulk: เงินเดือน, รายรับ/รายหักคงที่, ประเภทสูตร, metrics เวลา
+       recompute=False: ไม่ recompute attendance ที่ถูก mark (อ่านอย่างเดียว)"""
+    if not employee_ids:
+        return []
+
+    salaries = _base_salaries(db, employee_ids, period_end)
+    fixed_allow = _fixed_items(db, models.EmployeeAllowance, models.AllowanceType,
+                               models.EmployeeAllowance.allowance_type_id,
+                               employee_ids, period_start, period_end)
+    fixed_deduct = _fixed_items(db, models.EmployeeDeduction, models.DeductionType,
+                                models.EmployeeDeduction.deduction_type_id,
+                                employee_ids, period_start, period_end)
+    allow_types, deduct_types = _active_formula_types(db)
+    metrics = get_attendance_metrics_bulk(db, employee_ids, period_start, period_end, recompute=recompute)
+
+    vars_list = [_formula_variables(metrics.get(emp_id) or {}, salaries.get(emp_id, 0.0)) for emp_id in employee_ids]
+    formula_items = _formula_items_many(vars_list, allow_types, deduct_types)
+
+    results: list[dict] = []
+    for emp_id, (form_allow, form_deduct) in zip(employee_ids, formula_items):
+        base_salary = salaries.get(emp_id, 0.0)
+        allowances = list(fixed_allow.get(emp_id, [])) + form_allow
+        deductions = list(fixed_deduct.get(emp_id, [])) + form_deduct
+
+        results.append({"employee_id": emp_id, **_entry_values(base_salary, allowances, deductions)})
+    return results
+
+def _save_run_entries(db: Session, run_id: int, results: list[dict]) -> dict:
+    """bulk upsert entries ของรอบ + อัปเดตยอดรวมของรอบด้วย statement เดียว"""
+    existing: dict[int, int] = {}
+    for entry_id, emp_id in (db.query(models.PayrollEntry.id, models.PayrollEntry.employee_id)
+                               .filter(models.PayrollEntry.payroll_run_id == run_id)
+                               .order_by(models.PayrollEntry.id.asc()).all()):
+        existing.setdefault(emp_id, entry_id)
+
+    inserts: list[dict] = []
+    updates: list[dict] = []
+    for row in results:
+        entry_id = existing.get(row["employee_id"])
+        if entry_id is None:
+            inserts.append({**row, "payroll_run_id": run_id, "payment_status": models.PaymentStatus.PENDING})
+        else:
+            updates.append({k: v for k, v in row.items() if k != "employee_id"} | {"id": entry_id})
+
+    if inserts:
+        db.bulk_insert_mappings(models.PayrollEntry, inserts)
+    if updates:
+        db.bulk_update_mappings(models.PayrollEntry, updates)
+
+    total_q = (select(func.coalesce(func.sum(models.PayrollEntry.net_salary), 0.0))
+               .where(models.PayrollEntry.payroll_run_id == run_id)
+               .scalar_subquery())
+    db.execute(
+        update(models.PayrollRun)
+        .where(models.PayrollRun.id == run_id)
+        .values(total_amount_paid=total_q)
+    )
+    return {"created": len(inserts), "updated": len(updates)}
+
+# ---- Parallel mode (process pool, แต่ละ worker ใช้ SessionLocal ของตัวเอง) ----
+# - process แม่ recompute attendance ที่ถูก mark ครั้งเดียวก่อนแตกงาน -> worker อ่านอย่างเดียว
+#   (ไม่มีหลาย process เขียน SQLite พร้อมกัน / ไม่เจอ "database is locked")
+# - ใช้ "spawn": server มีหลาย thread (เช่น worker recompute) -> fork แล้วอาจติด lock ที่ค้างอยู่
+PAYROLL_WORKERS    = int(os.getenv("PAYROLL_WORKERS", "0") or 0)      # 0 = ตามจำนวน CPU
+PAYROLL_CHUNK_SIZE = int(os.getenv("PAYROLL_CHUNK_SIZE", "200") or 200)
+
+def _compute_run_chunk(employee_ids: list[int], period_start: date, period_end: date) -> list[dict]:
+    from database.connection import SessionLocal
+    db = SessionLocal()
+    try:
+        return _compute_run_entries(db, employee_ids, period_start, period_end, recompute=False)
+    finally:
+        db.close()
+
+def _compute_run_entries_parallel(
+    employee_ids: list[int], period_start: date, period_end: date, workers: int
+) -> list[dict]:
+    """แบ่งพนักงานเป็น chunk แล้วคำนวณใน process pool
+       ผลลัพธ์เรียงตาม employee_ids เสมอ (Executor.map คืนผลตามลำดับ chunk)"""
+    size = max(1, PAYROLL_CHUNK_SIZE)
+    chunks = [employee_ids[i:i + size] for i in range(0, len(employee_ids), size)]
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=get_context("spawn")) as ex:
+        parts = ex.map(_compute_run_chunk, chunks, repeat(period_start), repeat(period_end))
+        return [row for part in parts for row in part]
+
+def _resolve_workers(workers: Optional[int]) -> int:
+    n = workers or PAYROLL_WORKERS or (os.cpu_count() or 1)
+    return max(1, int(n))
+
+def calculate_payroll_run(
+    db: Session,
+    run_id: int,
+    employee_ids: Optional[list[int]] = None,
+    parallel: bool = False,
+    workers: Optional[int] = None,
+) -> dict:
+    """คำนวณเงินเดือนทั้งรอบในครั้งเดียว (แทนการเรียก calculate_and_save_payroll_entry ทีละคน)
+       ผลลัพธ์ของแต่ละคนเหมือน calculate_and_save_payroll_entry ทุกประการ
+       parallel=True: คำนวณใน process pool (workers / PAYROLL_WORKERS) แล้วเขียนลง DB ครั้งเดียว"""
+    run = db.get(models.PayrollRun, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="ไม่พบรอบการจ่ายเงินเดือน")
+
+    period_start, period_end = _coalesce_period(run)
+    ids = sorted({int(i) for i in employee_ids}) if employee_ids is not None else _run_employee_ids(db, run_id)
+    n_workers = _resolve_workers(workers) if parallel else 1
+
+    try:
+        if n_workers > 1 and len(ids) > PAYROLL_CHUNK_SIZE:
+            drain_dirty_attendance()
+            results = _compute_run_entries_parallel(ids, period_start, period_end, n_workers)
+        else:
+            results = _compute_run_entries(db, ids, period_start, period_end)
+        counts = _save_run_entries(db, run_id, results)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    db.refresh(run)
+    return {
+        "ok": True,
+        "payroll_run_id": run_id,
+        "employees": len(results),
+        "workers": n_workers,
+        **counts,
+        "total_amount_paid": float(run.total_amount_paid or 0.0),
+    }
+
 # -------------------- Payslip context --------------------
 def build_payslip_context(db: Session, entry_id: int) -> dict | None:
     entry = (
         db.query(models.PayrollEntry)
-          .options(joinedload(models.PayrollEntry.employee),
-                   joinedload(models.PayrollEntry.payroll_run))
+          .options(joinedload(models.PayrollEntry.payroll_run))
           .filter(models.PayrollEntry.id == entry_id).first()
     )
     if not entry: return None
 
-    emp = entry.employee
+    emp = directory.get(db, entry.employee_id)
     run = entry.payroll_run
 
     def _parse(js):
@@ -542,13 +910,10 @@ def build_payslip_context(db: Session, entry_id: int) -> dict | None:
 
     employee_fullname = None; employee_code = None; department_name = None; position_name = None
     if emp is not None:
-        fn = getattr(emp, "first_name", None) or getattr(emp, "firstname", None) or getattr(emp, "name", None)
-        ln = getattr(emp, "last_name", None) or getattr(emp, "lastname", None)
-        employee_fullname = " ".join([p for p in [fn, ln] if p]) or fn or "-"
-        employee_code = getattr(emp, "employee_code", None) or getattr(emp, "code", None)
-        dept = getattr(emp, "department", None); pos = getattr(emp, "position", None)
-        department_name = getattr(dept, "name", None) if dept else None
-        position_name   = getattr(pos, "name", None) if pos else None
+        employee_fullname = emp.full_name or "-"
+        employee_code = emp.code
+        department_name = emp.department
+        position_name   = emp.position
 
     return {
         "company_name": "บริษัทของคุณ",
@@ -6,7 +6,7 @@ from sqlalchemy import text
 
 from database.connection import get_db
 from modules.security.passwords import verify_password, hash_password, is_bcrypt_hash
-from modules.security.perms import compute_user_perms
+from modules.security.perms import refresh_session_perms
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -52,7 +52,9 @@ def do_login(
         )
         db.commit()
 
-    # เซสชันหลัก
+    # เซสชันหลัก (server-side session: ออก session id ใหม่ทุกครั้งที่ล็อกอิน)
+    if hasattr(request.session, "regenerate"):
+        request.session.regenerate()
     request.session["emp_id"] = row["id"]
     request.session["employee_id"] = row["id"]
     request.session["user_id"] = row["id"]
@@ -60,8 +62,7 @@ def do_login(
     request.session["role"] = row["role"]
 
     # คำนวณ perms และเซฟลง session (กัน None ให้เรียบร้อย)
-    perms = compute_user_perms(db, emp_id=row["id"], role_name=row["role"])
-    request.session["perms"] = sorted([p for p in perms if isinstance(p, str) and p.strip()])
+    refresh_session_perms(db, request.session, row["id"], row["role"])
 
     return RedirectResponse("/dashboard", status_code=303)
 
@@ -6,6 +6,9 @@ from fastapi.responses import FileResponse
 from core.templates import templates
 # from starlette.templating import Jinja2Templates
 from .deps import require_perm, get_current_employee, is_admin
+from .perms import bump_perms_version
+from database.connection import IS_SQLITE, sqlite_backup_to, sqlite_restore_from
+from modules.data_management import directory
 
 api_backup = APIRouter(prefix="/api/v1/security/db", tags=["Security DB API"])
 pages = APIRouter(tags=["Security DB Pages"])
@@ -14,6 +17,13 @@ BACKUP_DIR = "backups"
 DB_PATH = "hrm.db"
 os.makedirs(BACKUP_DIR, exist_ok=True)
 
+def _snapshot(dest: str) -> None:
+    # WAL: ข้อมูลล่าสุดอาจอยู่ใน hrm.db-wal -> ใช้ online backup แทนการคัดลอกไฟล์
+    if IS_SQLITE:
+        sqlite_backup_to(dest)
+    else:
+        shutil.copyfile(DB_PATH, dest)
+
 @pages.get("/security/backup")
 def backup_page(request: Request, _=Depends(require_perm("security.manage"))):
     # templates = Jinja2Templates(directory="templates")
@@ -34,7 +44,7 @@ def make_backup(me=Depends(get_current_employee)):
         raise HTTPException(500, "DB file not found")
     ts = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
     dest = os.path.join(BACKUP_DIR, f"backup-{ts}.sqlite")
-    shutil.copyfile(DB_PATH, dest)
+    _snapshot(dest)
     return {"ok": True, "file": os.path.basename(dest)}
 
 @api_backup.get("/download")
@@ -52,20 +62,26 @@ def restore_backup(file: UploadFile = File(None), name: str = "", me=Depends(get
         raise HTTPException(403, "Admins only")
     ts = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
     safe = os.path.join(BACKUP_DIR, f"auto-before-restore-{ts}.sqlite")
-    if os.path.exists(DB_PATH):
-        shutil.copyfile(DB_PATH, safe)
     if file and file.filename:
-        tmp = os.path.join(BACKUP_DIR, f"upload-{ts}.sqlite")
-        with open(tmp, "wb") as f:
+        src = os.path.join(BACKUP_DIR, f"upload-{ts}.sqlite")
+        with open(src, "wb") as f:
             f.write(file.file.read())
-        shutil.copyfile(tmp, DB_PATH)
     elif name:
         src = os.path.join(BACKUP_DIR, name)
         if not os.path.isfile(src):
             raise HTTPException(404, "Backup not found")
-        shutil.copyfile(src, DB_PATH)
     else:
         raise HTTPException(400, "Provide backup file or name")
+
+    if os.path.exists(DB_PATH):
+        _snapshot(safe)
+    if IS_SQLITE:
+        sqlite_restore_from(src)
+        # ข้อมูลเปลี่ยนทั้งก้อน -> ล้าง cache ในหน่วยความจำ
+        directory.invalidate()
+        bump_perms_version()
+        return {"ok": True}
+    shutil.copyfile(src, DB_PATH)
     return {"ok": True, "notice": "Restart the app to reload connections"}
 
 __all__ = ["api_backup", "pages"]
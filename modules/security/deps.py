@@ -9,7 +9,7 @@ from sqlalchemy import text
 from sqlalchemy.orm import Session
 
 from database.connection import get_db
-from modules.security.perms import compute_user_perms  # มีอยู่แล้ว
+from modules.security.perms import refresh_session_perms, session_perms_current
 
 # ------------------------------------------------------------
 # Helpers: อ่าน employee จาก DB
@@ -108,9 +108,9 @@ def is_admin(
 # Permissions helpers (cache ลง session)
 # ------------------------------------------------------------
 def _ensure_session_perms(request: Request, db: Session) -> Set[str]:
-    perms_in_sess = request.session.get("perms")
-    if isinstance(perms_in_sess, list):
-        return set(perms_in_sess)
+    # ใช้ของใน session ถ้า version ยังตรง (ไม่แตะ DB)
+    if session_perms_current(request.session):
+        return set(request.session["perms"])
 
     uid = _get_session_user_id(request)
     if not uid:
@@ -124,9 +124,7 @@ def _ensure_session_perms(request: Request, db: Session) -> Set[str]:
         if role:
             request.session["role"] = role
 
-    codes = compute_user_perms(db, uid, role or "USER")
-    request.session["perms"] = list(codes)
-    return set(codes)
+    return set(refresh_session_perms(db, request.session, uid, role or "USER"))
 
 
 def has_perm(request: Request, code: str, db: Session) -> bool:
@@ -1,7 +1,7 @@
 # modules/security/permissions_service.py
 from sqlalchemy import text
 from sqlalchemy.orm import Session
-from .perms import DEFAULT_PERMS
+from .perms import DEFAULT_PERMS, bump_perms_version
 
 # --------- สร้างตาราง Security ทั้งหมด (id-based) ----------
 def ensure_security_tables(engine):
@@ -49,6 +49,7 @@ def set_role_permission(db: Session, role_id: int, perm_id: int, enabled: bool):
             WHERE role_id=:r AND perm_id=:p
         """), {"r": role_id, "p": perm_id})
     db.commit()
+    bump_perms_version()
 
 def list_user_roles(db: Session, user_id: int):
     return db.execute(text("SELECT role_id FROM security_user_roles WHERE user_id=:u"), {"u": user_id}).scalars().all()
@@ -64,6 +65,7 @@ def set_user_role(db: Session, user_id: int, role_id: int, enabled: bool):
             DELETE FROM security_user_roles WHERE user_id=:u AND role_id=:r
         """), {"u": user_id, "r": role_id})
     db.commit()
+    bump_perms_version()
 
 # seed mapping เริ่มต้นแบบเบา ๆ (ไม่บังคับว่าต้องมี perms ทั้งหมด)
 def seed_default_roles_permissions(db):
@@ -102,6 +104,7 @@ def seed_default_roles_permissions(db):
                 VALUES (:rid, :pid)
             """), {"rid": role_id, "pid": pid})
     db.commit()
+    bump_perms_version()
     
 def seed_full_permissions(db: Session):
     # ensure roles
@@ -121,4 +124,5 @@ def seed_full_permissions(db: Session):
         JOIN security_permissions p
         WHERE r.name='ADMIN'
     """))
-    db.commit()
\ No newline at end of file
+    db.commit()
+    bump_perms_version()
@@ -1,8 +1,12 @@
 # modules/security/perms.py
-from typing import List, Tuple, Set
+import os
+import threading
+import time as _time
+from typing import Dict, List, Optional, Tuple, Set
 from sqlalchemy.orm import Session
 from sqlalchemy.engine import Engine
 from sqlalchemy import text
+from database.connection import engine as _engine
 from .model import AppModule
 
 DEFAULT_ROLES: List[str] = ["ADMIN", "MANAGER", "USER"]
@@ -41,6 +45,7 @@ def ensure_permissions_schema(engine: Engine):
             conn.execute(_t(
                 "INSERT OR IGNORE INTO security_permissions(code, description) VALUES(:c,:d)"
             ), {"c": code, "d": desc})
+        _ensure_perm_version_table(conn)
 
 def seed_admin_all(engine: Engine):
     from sqlalchemy import text as _t
@@ -60,6 +65,7 @@ def seed_admin_all(engine: Engine):
             FROM security_roles r, security_permissions p
             WHERE r.name='ADMIN'
         """))
+    bump_perms_version()
 
 def is_admin_session(session: dict | None) -> bool:
     return ((session or {}).get("role") == "ADMIN")
@@ -77,18 +83,138 @@ def has_perm_session(session: dict, code: str) -> bool:
 def has_perm(session: dict, code: str) -> bool:
     return has_perm_session(session, code)
 
-def compute_user_perms(db: Session, emp_id: int, role_name: str) -> Set[str]:
-    codes: Set[str] = set()
+# ------------------------------------------------------------
+# Permission cache (versioned)
+# ------------------------------------------------------------
+# - role -> permission codes โหลดทั้งตารางครั้งเดียว (ไม่ query ต่อ role)
+# - ผลต่อผู้ใช้ cache ตาม (emp_id, role) คู่กับ version
+# - แก้ role/perm (set_role_permission / set_user_role) -> bump_perms_version()
+# - session เก็บ perms + perms_ver; คำนวณใหม่เฉพาะเมื่อ version เปลี่ยน
+# - version เก็บใน DB (security_perm_version แถวเดียว) -> ทุก worker / ทุกการรีสตาร์ตเห็นค่าเดียวกัน
+#   แต่ละ process อ่านซ้ำทุก PERMS_VERSION_TTL_SEC วินาที (revoke มีผลทุก worker ภายในช่วงนี้)
+# - bump = MAX(version + 1, เวลาปัจจุบันเป็น ms) กันค่าซ้ำกับ session เก่าหลัง restore ฐานข้อมูล
+# - role map หมดอายุตาม PERMS_CACHE_TTL_SEC (โหลดใหม่ ไม่เปลี่ยน version)
 
-    rows = db.execute(text("""
-        SELECT p.code
+PERMS_CACHE_TTL = int(os.getenv("PERMS_CACHE_TTL_SEC", "300") or 300)
+PERMS_VERSION_TTL = float(os.getenv("PERMS_VERSION_TTL_SEC", "2") or 2)
+
+_MODULE_PERM_MAP: Dict[str, Tuple[str, str]] = {
+    AppModule.EMPLOYEES.value: ("employees.view", "employees.edit"),
+    AppModule.PAYROLL.value: ("payroll.view", "payroll.edit"),
+    AppModule.MEETING.value: ("meeting.view", "meeting.manage"),
+    AppModule.TIME_TRACKING.value: ("time.view", "time.edit"),
+    AppModule.RECRUITMENT.value: ("recruitment.view", "recruitment.manage"),
+    AppModule.PERSONAL_PROFILE.value: ("personal_profile.view", "personal_profile.edit"),
+    AppModule.DASHBOARD.value: ("dashboard.view", "dashboard.view"),
+}
+
+_perm_lock = threading.Lock()
+_perm_cache: dict = {
+    "version": None, "checked_at": 0.0, "loaded_at": 0.0, "roles": None, "legacy": None, "users": {},
+}
+
+def _clear_perm_cache_locked() -> None:
+    _perm_cache["roles"] = None
+    _perm_cache["legacy"] = None
+    _perm_cache["users"] = {}
+
+def _ensure_perm_version_table(conn) -> None:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS security_perm_version(
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    """))
+    conn.execute(text("INSERT OR IGNORE INTO security_perm_version(id, version) VALUES (1, 1)"))
+
+def _read_perm_version() -> Optional[int]:
+    try:
+        with _engine.connect() as conn:
+            return conn.execute(text("SELECT version FROM security_perm_version WHERE id = 1")).scalar()
+    except Exception:
+        return None
+
+def bump_perms_version() -> int:
+    """เรียกหลัง commit ทุกครั้งที่แก้ role / permission / user-role"""
+    new_ver = None
+    try:
+        with _engine.begin() as conn:
+            _ensure_perm_version_table(conn)
+            conn.execute(
+                text("UPDATE security_perm_version SET version = MAX(version + 1, :now) WHERE id = 1"),
+                {"now": int(_time.time() * 1000)},
+            )
+            new_ver = conn.execute(text("SELECT version FROM security_perm_version WHERE id = 1")).scalar()
+    except Exception as e:
+        print(f"[PERMS] bump version failed: {e}")
+    with _perm_lock:
+        _clear_perm_cache_locked()
+        if new_ver is None:  # DB ใช้ไม่ได้: อย่างน้อย process นี้ต้องคำนวณใหม่
+            new_ver = (_perm_cache["version"] or 0) + 1
+        _perm_cache["version"] = new_ver
+        _perm_cache["checked_at"] = _time.monotonic()
+        return new_ver
+
+def perms_version() -> int:
+    now = _time.monotonic()
+    with _perm_lock:
+        if _perm_cache["roles"] is not None and (now - _perm_cache["loaded_at"]) >= PERMS_CACHE_TTL:
+            _clear_perm_cache_locked()
+        ver = _perm_cache["version"]
+        if ver is not None and (now - _perm_cache["checked_at"]) < PERMS_VERSION_TTL:
+            return ver
+
+    db_ver = _read_perm_version()
+    with _perm_lock:
+        if db_ver is None:
+            db_ver = _perm_cache["version"] or 0
+        if db_ver != _perm_cache["version"]:
+            _clear_perm_cache_locked()
+            _perm_cache["version"] = db_ver
+        _perm_cache["checked_at"] = now
+        return db_ver
+
+def _role_perm_map(db: Session) -> Tuple[Dict[str, frozenset], Dict[str, frozenset]]:
+    """(security roles -> codes, legacy role_permissions -> codes)"""
+    with _perm_lock:
+        roles, legacy = _perm_cache["roles"], _perm_cache["legacy"]
+    if roles is not None and legacy is not None:
+        return roles, legacy
+
+    by_role: Dict[str, set] = {}
+    for rname, code in db.execute(text("""
+        SELECT r.name, p.code
         FROM security_roles r
         JOIN security_role_permissions rp ON rp.role_id = r.id
         JOIN security_permissions p ON p.id = rp.perm_id
-        WHERE r.name = :role
-    """), {"role": role_name}).scalars().all()
-    codes.update(rows)
+    """)).all():
+        by_role.setdefault(rname, set()).add(code)
+
+    by_legacy: Dict[str, set] = {}
+    for rname, code in db.execute(text("SELECT role, perm FROM role_permissions")).all():
+        by_legacy.setdefault(rname, set()).add(code)
+
+    roles = {k: frozenset(v) for k, v in by_role.items()}
+    legacy = {k: frozenset(v) for k, v in by_legacy.items()}
+    with _perm_lock:
+        if _perm_cache["roles"] is None:
+            _perm_cache["roles"] = roles
+            _perm_cache["legacy"] = legacy
+            _perm_cache["loaded_at"] = _time.monotonic()
+    return roles, legacy
 
+def compute_user_perms(db: Session, emp_id: int, role_name: str) -> Set[str]:
+    ver = perms_version()
+    key = (emp_id, role_name)
+    with _perm_lock:
+        hit = _perm_cache["users"].get(key)
+    if hit and hit[0] == ver:
+        return set(hit[1])
+
+    roles, legacy = _role_perm_map(db)
+    codes: Set[str] = set(roles.get(role_name, ()))
+
+    # role เสริมของผู้ใช้ (join เดียว) -> codes จาก map ที่ cache ไว้
     extra_roles = db.execute(text("""
         SELECT r.name
         FROM security_user_roles ur
@@ -96,31 +222,15 @@ def compute_user_perms(db: Session, emp_id: int, role_name: str) -> Set[str]:
         WHERE ur.user_id = :u
     """), {"u": emp_id}).scalars().all()
     for rname in extra_roles:
-        rcodes = db.execute(text("""
-            SELECT p.code
-            FROM security_roles r
-            JOIN security_role_permissions rp ON rp.role_id = r.id
-            JOIN security_permissions p ON p.id = rp.perm_id
-            WHERE r.name = :role
-        """), {"role": rname}).scalars().all()
-        codes.update(rcodes)
-
-    mod_map = {
-        AppModule.EMPLOYEES.value: ("employees.view", "employees.edit"),
-        AppModule.PAYROLL.value: ("payroll.view", "payroll.edit"),
-        AppModule.MEETING.value: ("meeting.view", "meeting.manage"),
-        AppModule.TIME_TRACKING.value: ("time.view", "time.edit"),
-        AppModule.RECRUITMENT.value: ("recruitment.view", "recruitment.manage"),
-        AppModule.PERSONAL_PROFILE.value: ("personal_profile.view", "personal_profile.edit"),
-        AppModule.DASHBOARD.value: ("dashboard.view", "dashboard.view"),
-    }
+        codes.update(roles.get(rname, ()))
+
     rows = db.execute(text("""
         SELECT module, can_view, can_edit
         FROM module_permissions
         WHERE employee_id = :u
     """), {"u": emp_id}).mappings().all()
     for r in rows:
-        view_code, edit_code = mod_map.get(str(r["module"]).lower(), (None, None))
+        view_code, edit_code = _MODULE_PERM_MAP.get(str(r["module"]).lower(), (None, None))
         if view_code:
             if r["can_view"]: codes.add(view_code)
             else: codes.discard(view_code)
@@ -128,9 +238,24 @@ def compute_user_perms(db: Session, emp_id: int, role_name: str) -> Set[str]:
             if r["can_edit"]: codes.add(edit_code)
             else: codes.discard(edit_code)
 
-    legacy = db.execute(text("SELECT perm FROM role_permissions WHERE role=:r"),
-                        {"r": role_name}).scalars().all()
-    codes.update(legacy)
+    codes.update(legacy.get(role_name, ()))
 
     # กัน None/ว่าง
-    return {c for c in codes if isinstance(c, str) and c.strip()}
+    out = frozenset(c for c in codes if isinstance(c, str) and c.strip())
+    with _perm_lock:
+        if _perm_cache["version"] == ver:
+            _perm_cache["users"][key] = (ver, out)
+    return set(out)
+
+# ---- session helpers ----
+def session_perms_current(session: Optional[dict]) -> bool:
+    """perms ใน session ยังใช้ได้ (คำนวณด้วย version ปัจจุบัน)"""
+    sess = session or {}
+    return isinstance(sess.get("perms"), list) and sess.get("perms_ver") == perms_version()
+
+def refresh_session_perms(db: Session, session: dict, emp_id: int, role_name: Optional[str] = None) -> List[str]:
+    ver = perms_version()
+    perms = sorted(compute_user_perms(db, emp_id, role_name or session.get("role") or "USER"))
+    session["perms"] = perms
+    session["perms_ver"] = ver
+    return perms
@@ -7,7 +7,6 @@ from sqlalchemy import text
 
 from database.connection import get_db
 from .deps import require_perm
-from .perms import compute_user_perms
 from .permissions_service import (
     list_roles, list_permissions, role_permission_ids,
     set_role_permission, list_user_roles, set_user_role
@@ -48,13 +47,8 @@ def api_toggle_role_perm(
     enabled: bool = Form(...),
     db: Session = Depends(get_db),
 ):
+    # bump version ของสิทธิ์ -> ทุก session คำนวณใหม่เองในคำขอถัดไป
     set_role_permission(db, role_id, perm_id, enabled)
-
-    # ถ้าเป็น role เดียวกับที่ user ปัจจุบันใช้อยู่ ให้รีเฟรชสิทธิ์ใน session
-    role_name = db.execute(text("SELECT name FROM security_roles WHERE id=:id"), {"id": role_id}).scalar()
-    if role_name and request.session.get("role") == role_name:
-        emp_id = request.session.get("emp_id")
-        request.session["perms"] = list(compute_user_perms(db, emp_id, role_name))
     return {"ok": True}
 
 # ----------------------------
@@ -90,13 +84,8 @@ def api_toggle_user_role(
     enabled: bool = Form(...),
     db: Session = Depends(get_db),
 ):
+    # bump version ของสิทธิ์ -> ทุก session คำนวณใหม่เองในคำขอถัดไป
     set_user_role(db, user_id, role_id, enabled)
-
-    # ถ้าแก้ role ของ user ที่กำลังล็อกอิน และเป็น role ที่เขาใช้อยู่ -> รีเฟรชสิทธิ์
-    if user_id == request.session.get("emp_id"):
-        role_name = db.execute(text("SELECT name FROM security_roles WHERE id=:id"), {"id": role_id}).scalar()
-        if role_name and request.session.get("role") == role_name:
-            request.session["perms"] = list(compute_user_perms(db, user_id, role_name))
     return {"ok": True}
 
 __all__ = ["api", "pages"]
@@ -0,0 +1,58 @@
+# modules/time_tracking/migrations.py
+from __future__ import annotations
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from database.connection import engine as default_engine
+
+
+# -------------------------------------------------------------------
+# Composite indexes (hot queries: พนักงาน + ช่วงวัน / สถานะ)
+# -------------------------------------------------------------------
+# ชื่อ index ต้องตรงกับ __table_args__ ใน models.py (DB ใหม่ได้จาก create_all)
+TIME_TRACKING_INDEXES = (
+    ("ix_time_entries_emp_check_in", "time_entries", "employee_id, check_in_time"),
+    ("ix_time_entries_check_in", "time_entries", "check_in_time"),
+    ("ix_leave_requests_emp_status_dates", "leave_requests", "employee_id, status, start_date, end_date"),
+    ("ix_ot_requests_emp_status_times", "ot_requests", "employee_id, status, start_time, end_time"),
+    ("ix_attendance_daily_day_emp", "attendance_daily", "day, employee_id"),
+)
+
+
+def _dedupe_attendance_daily(conn) -> int:
+    """เหลือแถวเดียว (id ต่ำสุด) ต่อ (employee_id, day) ก่อนสร้าง unique index"""
+    res = conn.execute(text("""
+        DELETE FROM attendance_daily
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM attendance_daily GROUP BY employee_id, day
+        )
+    """))
+    return res.rowcount or 0
+
+
+def ensure_time_tracking_indexes(engine: Engine = default_engine) -> None:
+    """
+    เรียกตอนแอปสตาร์ท (หลัง create_all)
+    - composite index ของ time_entries / leave_requests / ot_requests / attendance_daily
+    - unique (employee_id, day) บน attendance_daily (ลบแถวซ้ำก่อน)
+    """
+    insp = inspect(engine)
+    tables = set(insp.get_table_names())
+    has_unique = "attendance_daily" in tables and any(
+        ix.get("name") == "uq_attendance_daily_emp_day" for ix in insp.get_indexes("attendance_daily")
+    )
+    with engine.begin() as conn:
+        for name, table, cols in TIME_TRACKING_INDEXES:
+            if table in tables:
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({cols})"))
+
+        if "attendance_daily" in tables and not has_unique:
+            removed = _dedupe_attendance_daily(conn)
+            if removed:
+                print(f"✓ attendance_daily: removed {removed} duplicate (employee_id, day) rows")
+            conn.execute(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS uq_attendance_daily_emp_day "
+                "ON attendance_daily (employee_id, day)"
+            ))
+    print("✓ time-tracking indexes ensured.")
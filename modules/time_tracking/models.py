@@ -1,7 +1,7 @@
 # modules/time_tracking/models.py
 from sqlalchemy import (
     Column, Integer, String, Date, DateTime, Time, Boolean,
-    ForeignKey, Text, Enum, Float, UniqueConstraint
+    ForeignKey, Text, Enum, Float, UniqueConstraint, Index
 )
 from sqlalchemy.orm import relationship
 from database.base import Base
@@ -43,6 +43,7 @@ class LeaveBalance(Base):
     used          = Column(Float, default=0.0)  # ใช้ไปแล้ว
     adjusted      = Column(Float, default=0.0)  # ปรับมือ (+/-)
     carry_in      = Column(Float, default=0.0)  # โอนจากปีก่อน (ถ้าใช้)
+    pending       = Column(Float, default=0.0)  # รออนุมัติ (ยอดสะสมจาก leave_usage_ledger)
     updated_at    = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     @property
@@ -76,6 +77,7 @@ class LeaveType(Base):
     # ✅ ใหม่: ตั้งค่าผ่าน UI
     accrue_per_year = Column(Float, default=0.0)  # เพิ่มสิทธิ์ต่อปี
     max_quota = Column(Float, default=0.0)        # เพดานสูงสุด
+    carry_over_cap = Column(Float, default=0.0)   # ยกยอดคงเหลือไปปีถัดไปได้สูงสุด (0 = ไม่ยกไป)
 
     leave_requests = relationship("LeaveRequest", back_populates="leave_type")
 
@@ -93,6 +95,11 @@ class TimeEntry(Base):
     early_exit_minutes = Column(Float, default=0.0)
     status = Column(Enum(TimeEntryStatus), default=TimeEntryStatus.PENDING, nullable=False)
 
+    __table_args__ = (
+        Index("ix_time_entries_emp_check_in", "employee_id", "check_in_time"),
+        Index("ix_time_entries_check_in", "check_in_time"),
+    )
+
     employee = relationship("Employee", back_populates="time_entries")
 
 # ---------------- Leave Request ----------------
@@ -111,6 +118,10 @@ class LeaveRequest(Base):
     employee = relationship("Employee", back_populates="leave_requests")
     leave_type = relationship("LeaveType", back_populates="leave_requests")
 
+    __table_args__ = (
+        Index("ix_leave_requests_emp_status_dates", "employee_id", "status", "start_date", "end_date"),
+    )
+
 # ---------------- Working Schedule ----------------
 class WorkingSchedule(Base):
     __tablename__ = "working_schedules"
@@ -169,6 +180,10 @@ class OvertimeRequest(Base):
     employee = relationship("Employee", back_populates="ot_requests")
     ot_type = relationship("OvertimeType", back_populates="ot_requests")
 
+    __table_args__ = (
+        Index("ix_ot_requests_emp_status_times", "employee_id", "status", "start_time", "end_time"),
+    )
+
 # ---------------- Attendance ----------------
 class AttendanceStatus(str, enum.Enum):
     PRESENT = "PRESENT"
@@ -187,3 +202,63 @@ class AttendanceDaily(Base):
     late_minutes = Column(Integer, nullable=False, default=0)
     early_leave_minutes = Column(Integer, nullable=False, default=0)
     is_paid_leave = Column(Boolean, nullable=False, default=True)
+
+    __table_args__ = (
+        Index("uq_attendance_daily_emp_day", "employee_id", "day", unique=True),
+        Index("ix_attendance_daily_day_emp", "day", "employee_id"),
+    )
+
+class AttendanceDirty(Base):
+    """ช่อง (พนักงาน, วัน) ที่ข้อมูลต้นทางเปลี่ยน รอคำนวณ attendance_daily ใหม่
+       employee_id = NULL หมายถึงทุกคนในวันนั้น (เช่น แก้วันหยุด)"""
+    __tablename__ = "attendance_dirty"
+
+    id = Column(Integer, primary_key=True, index=True)
+    employee_id = Column(Integer, nullable=True, index=True)
+    day = Column(Date, nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class JobLease(Base):
+    """สิทธิ์รันงานเบื้องหลังแบบมีเจ้าของเดียว (หลาย worker / หลายเครื่องแชร์ DB เดียวกัน)
+       owner ต่ออายุ expires_at เป็นระยะ; หมดอายุแล้ว process อื่นรับช่วงได้"""
+    __tablename__ = "job_leases"
+
+    name = Column(String(64), primary_key=True)
+    owner = Column(String(128), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+class AttendanceMonthly(Base):
+    """ผลรวม attendance ต่อ (พนักงาน, เดือน) — สร้างจาก attendance_daily + OT Requests
+       month = วันที่ 1 ของเดือน; ไม่มีแถว = ยังไม่ได้ rollup (ให้อ่านจากรายวันแทน)"""
+    __tablename__ = "attendance_monthly"
+    __table_args__ = (UniqueConstraint("employee_id", "month", name="uq_attendance_monthly_emp_month"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    employee_id = Column(Integer, ForeignKey("employees.id"), nullable=False, index=True)
+    month = Column(Date, nullable=False, index=True)
+    late_minutes = Column(Integer, nullable=False, default=0)
+    early_leave_minutes = Column(Integer, nullable=False, default=0)
+    absent_days = Column(Integer, nullable=False, default=0)
+    unpaid_leave_days = Column(Integer, nullable=False, default=0)
+    work_minutes = Column(Integer, nullable=False, default=0)
+    ot1x_minutes = Column(Integer, nullable=False, default=0)
+    ot15x_minutes = Column(Integer, nullable=False, default=0)
+    ot3x_minutes = Column(Integer, nullable=False, default=0)
+    refreshed_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class LeaveUsageLedger(Base):
+    """สมุดบัญชีการใช้สิทธิ์ลา (append-only) — ทุกแถวคือการเปลี่ยน used / pending ของ
+       (พนักงาน, ประเภทลา, ปี) หนึ่งครั้ง; ผลรวมของ ledger = ยอดใน leave_balances"""
+    __tablename__ = "leave_usage_ledger"
+    __table_args__ = (Index("ix_leave_usage_ledger_key", "employee_id", "leave_type_id", "year"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    employee_id = Column(Integer, ForeignKey("employees.id"), nullable=False)
+    leave_type_id = Column(Integer, ForeignKey("leave_types.id"), nullable=False)
+    year = Column(Integer, nullable=False)
+    leave_request_id = Column(Integer, nullable=True, index=True)  # ไม่ผูก FK: คำขอถูกลบได้ แต่ประวัติต้องอยู่
+    kind = Column(String(20), nullable=False)  # create / approve / reject / update / delete / rebuild
+    used_delta = Column(Float, nullable=False, default=0.0)
+    pending_delta = Column(Float, nullable=False, default=0.0)
+    note = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
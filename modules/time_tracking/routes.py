@@ -3,15 +3,16 @@ from fastapi import (
     APIRouter, Depends, HTTPException, status, Request,
     UploadFile, File, Query
 )
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func, or_
 from typing import List, Optional
-from datetime import date, datetime, time
+from datetime import date, datetime, time, timedelta
 import pandas as pd
 import io
+import json
 
-from database.connection import get_db
+from database.connection import get_db, SessionLocal
 from modules.data_management.models import Employee
 from modules.time_tracking.models import TimeEntry
 from . import schemas, services
@@ -117,9 +118,9 @@ def list_logs(
             )
         )
     elif date_from:
-        q = q.filter(func.date(TimeEntry.check_in_time) >= date_from)
+        q = q.filter(TimeEntry.check_in_time >= datetime.combine(date_from, time.min))
     elif date_to:
-        q = q.filter(func.date(TimeEntry.check_in_time) <= date_to)
+        q = q.filter(TimeEntry.check_in_time < datetime.combine(date_to + timedelta(days=1), time.min))
 
     items = q.offset(offset).limit(limit).all()
     return {"count": q.count(), "items": items}
@@ -176,6 +177,14 @@ def seed_leave_balances_api(
 ):
     return services.seed_leave_balances(db=db, year=year)
 
+@api_router.post("/leave-balances/rollover")
+def rollover_leave_balances_api(
+    from_year: int = Query(..., description="ปีที่ปิดยอด (ยกไปปี from_year + 1)"),
+    dry_run: bool = Query(True, description="ดูตัวอย่างผลโดยไม่บันทึก"),
+    db: Session = Depends(get_db),
+):
+    return services.rollover_leave_balances(db=db, from_year=from_year, dry_run=dry_run)
+
 @api_router.patch("/leave-balances/{balance_id}")
 def patch_leave_balance_api(
     balance_id: int,
@@ -200,7 +209,35 @@ def api_adjust_leave_balance(
     )
     return lb
 
+@api_router.get("/leave-balances/{employee_id}/{year}/{leave_type_id}/ledger",
+                response_model=List[schemas.LeaveUsageLedgerOut])
+def api_leave_usage_ledger(
+    employee_id: int, year: int, leave_type_id: int,
+    skip: int = Query(0, ge=0), limit: int = Query(200, ge=1, le=1000),
+    db: Session = Depends(get_db),
+):
+    return services.get_leave_usage_ledger(
+        db=db, employee_id=employee_id, leave_type_id=leave_type_id, year=year, skip=skip, limit=limit
+    )
+
+@api_router.post("/leave-balances/ledger/rebuild")
+def api_rebuild_leave_usage(
+    year: int = Query(...),
+    dry_run: bool = Query(True, description="ดูส่วนต่างโดยไม่บันทึก"),
+    db: Session = Depends(get_db),
+):
+    return services.rebuild_leave_usage(db=db, year=year, dry_run=dry_run)
+
 # -------- Leave approve / reject --------
+@api_router.post("/leave-requests/approve-batch")
+def api_approve_leave_batch(payload: schemas.LeaveRequestBatchApprove, db: Session = Depends(get_db)):
+    results = services.approve_leave_requests_batch(db=db, request_ids=payload.ids)
+    return {
+        "approved": sum(1 for r in results if r["ok"]),
+        "failed": sum(1 for r in results if not r["ok"]),
+        "results": results,
+    }
+
 @api_router.post("/leave-requests/{request_id}/approve",
                  response_model=schemas.LeaveRequestInDB)
 def api_approve_leave(request_id: int, db: Session = Depends(get_db)):
@@ -228,6 +265,10 @@ def api_leave_balance(
 def create_leave_request_api(payload: schemas.LeaveRequestCreate, db: Session = Depends(get_db)):
     return services.create_leave_request(db=db, leave_request=payload)
 
+@api_router.post("/leave-requests/bulk", response_model=List[schemas.LeaveRequestInDB], status_code=status.HTTP_201_CREATED)
+def create_leave_requests_bulk_api(payload: List[schemas.LeaveRequestCreate], db: Session = Depends(get_db)):
+    return services.create_leave_requests_bulk(db=db, leave_requests=payload)
+
 @api_router.get("/leave-requests/", response_model=List[schemas.LeaveRequestInDB])
 def list_leave_requests_api(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     return services.get_leave_requests(db=db, skip=skip, limit=limit)
@@ -308,6 +349,55 @@ def get_time_entries_report_api(
         limit=limit,
     )
 
+@api_router.get("/report/data/page")
+def get_daily_report_page(
+    date_from: date = Query(...),
+    date_to: Optional[date] = Query(None),
+    employee_id_number: Optional[str] = Query(None),
+    include_leaves: bool = Query(True),
+    include_ot: bool = Query(True),
+    cursor: Optional[int] = Query(None, description="employee_id สุดท้ายของหน้าก่อน (next_cursor)"),
+    limit: int = Query(50, ge=1, le=1000, description="จำนวนพนักงานต่อหน้า"),
+    db: Session = Depends(get_db),
+):
+    return services.page_daily_report(
+        db=db,
+        date_from=date_from,
+        date_to=date_to or date_from,
+        employee_id_number=employee_id_number,
+        include_leaves=include_leaves,
+        include_ot=include_ot,
+        cursor=cursor,
+        limit=limit,
+    )
+
+@api_router.get("/report/stream")
+def stream_daily_report(
+    date_from: date = Query(...),
+    date_to: Optional[date] = Query(None),
+    employee_id_number: Optional[str] = Query(None),
+    include_leaves: bool = Query(True),
+    include_ot: bool = Query(True),
+):
+    """NDJSON: หนึ่งบรรทัดต่อหนึ่งแถว (พนักงาน, วัน) ส่งออกทันทีที่คำนวณเสร็จทีละชุดพนักงาน"""
+    _to = date_to or date_from
+
+    def _rows():
+        # session ของตัวเอง: dependency get_db ปิดก่อน response จะ stream จบ
+        db = SessionLocal()
+        try:
+            for row in services.iter_daily_report(
+                db, date_from, _to,
+                employee_id_number=employee_id_number,
+                include_leaves=include_leaves,
+                include_ot=include_ot,
+            ):
+                yield json.dumps(row, ensure_ascii=False) + "\n"
+        finally:
+            db.close()
+
+    return StreamingResponse(_rows(), media_type="application/x-ndjson")
+
 # ---------- Working Schedules ----------
 @api_router.post("/working-schedules/", response_model=schemas.WorkingScheduleInDB, status_code=status.HTTP_201_CREATED)
 def create_working_schedule(schedule: schemas.WorkingScheduleCreate, db: Session = Depends(get_db)):
@@ -368,12 +458,27 @@ def delete_time_entry(entry_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="ไม่พบบันทึกเวลา")
     return {"message": "บันทึกเวลาถูกลบแล้ว"}
 
+# def ธรรมดา: FastAPI รันใน threadpool -> pandas / งาน DB ที่บล็อกไม่ค้าง event loop
 @api_router.post("/time-entries/import", status_code=status.HTTP_200_OK)
-async def import_time_entries(file: UploadFile = File(...), db: Session = Depends(get_db)):
+def import_time_entries(
+    file: UploadFile = File(...),
+    stream: bool = Query(False, description="อ่านไฟล์เป็นก้อน ๆ (เหมาะกับไฟล์ device export ขนาดใหญ่)"),
+    db: Session = Depends(get_db),
+):
     if not (file.filename.endswith(".csv") or file.filename.endswith(".xlsx")):
         raise HTTPException(status_code=400, detail="ไฟล์ต้องเป็น CSV หรือ Excel (.xlsx)")
     try:
-        content = await file.read()
+        if stream:
+            # ไม่ buffer ทั้งไฟล์: pandas อ่านจาก spooled file ทีละ chunk
+            if file.filename.endswith(".csv"):
+                chunks = pd.read_csv(file.file, encoding="utf-8", chunksize=max(1, services.IMPORT_CHUNK_ROWS))
+            else:
+                chunks = [pd.read_excel(file.file)]
+            res = services.import_time_entries_stream(db, chunks)
+            count = res["created"] + res["updated"]
+            return {"message": f"นำเข้าข้อมูลสำเร็จ {count} รายการ", "imported_count": count, **res}
+
+        content = file.file.read()
         if file.filename.endswith(".csv"):
             df = pd.read_csv(io.StringIO(content.decode("utf-8")))
         else:
@@ -458,6 +563,10 @@ def delete_ot_type(ot_type_id: int, db: Session = Depends(get_db)):
 def create_ot_request(ot_request: schemas.OvertimeRequestCreate, db: Session = Depends(get_db)):
     return services.create_ot_request(db=db, ot_request=ot_request)
 
+@api_router.post("/ot-requests/bulk", response_model=List[schemas.OvertimeRequestInDB], status_code=status.HTTP_201_CREATED)
+def create_ot_requests_bulk(payload: List[schemas.OvertimeRequestCreate], db: Session = Depends(get_db)):
+    return services.create_ot_requests_bulk(db=db, ot_requests=payload)
+
 @api_router.get("/ot-requests/", response_model=List[schemas.OvertimeRequestInDB])
 def list_ot_requests(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     return services.get_ot_requests(db=db, skip=skip, limit=limit)
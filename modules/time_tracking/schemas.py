@@ -1,7 +1,7 @@
 # modules/time_tracking/schemas.py
 from pydantic import BaseModel, Field, ConfigDict, field_validator
 from datetime import date, time, datetime
-from typing import Optional
+from typing import List, Optional
 from . import models
 from .models import DayOfWeek
 
@@ -165,6 +165,7 @@ class LeaveBalanceOut(BaseModel):
     used: float = 0
     adjusted: float = 0
     carry_in: float = 0
+    pending: float = 0
     available: float = 0
     # เพิ่ม metadata ฝั่งแสดงผล (ถ้าต้องการ)
     leave_type_name: str
@@ -193,6 +194,7 @@ class LeaveBalanceBase(BaseModel):
 
 class LeaveBalanceInDB(LeaveBalanceBase):
     id: int
+    pending: Optional[float] = 0
     available: float
     class Config:
         orm_mode = True
@@ -201,6 +203,19 @@ class LeaveBalanceAdjust(BaseModel):
     adjusted_delta: float           # + เพิ่ม / - ลด
     note: Optional[str] = None
 
+class LeaveUsageLedgerOut(BaseModel):
+    id: int
+    employee_id: int
+    leave_type_id: int
+    year: int
+    leave_request_id: Optional[int] = None
+    kind: str
+    used_delta: float = 0
+    pending_delta: float = 0
+    note: Optional[str] = None
+    created_at: Optional[datetime] = None
+    model_config = ConfigDict(from_attributes=True)
+
 class TimeEntryInDB(TimeEntryBase):
     id: int
     employee: EmployeeForTimeEntry
@@ -216,6 +231,7 @@ class LeaveTypeBase(BaseModel):
     # ✅ ใหม่
     accrue_per_year: float = 0.0
     max_quota: float = 0.0
+    carry_over_cap: float = 0.0
 
 class LeaveTypeCreate(LeaveTypeBase):
     pass
@@ -229,6 +245,7 @@ class LeaveTypeUpdate(BaseModel):
     # ✅ ใหม่
     accrue_per_year: Optional[float] = None
     max_quota: Optional[float] = None
+    carry_over_cap: Optional[float] = None
 
 class LeaveTypeInDB(LeaveTypeBase):
     id: int
@@ -255,6 +272,9 @@ class LeaveRequestUpdate(BaseModel):
     reason: Optional[str] = None
     status: Optional[models.LeaveStatus] = None
 
+class LeaveRequestBatchApprove(BaseModel):
+    ids: List[int] = Field(..., min_length=1)
+
 class LeaveRequestInDB(LeaveRequestBase):
     id: int
     request_date: datetime
@@ -4,13 +4,21 @@ from __future__ import annotations
 from datetime import datetime as _dt
 from datetime import date, time, timedelta, datetime
 from typing import List, Optional
-from os import getenv
+from os import getenv, getpid
 from typing import List, Optional, Iterable, Dict, Tuple, DefaultDict
 from collections import defaultdict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Mapping
+import socket
+import threading
+import time as _time
+import uuid
 
 import pandas as pd
 from fastapi import HTTPException, status
-from sqlalchemy import or_, func, and_, text
+from sqlalchemy import or_, func, and_, text, case, literal
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session, joinedload
 
 from . import models, schemas
@@ -24,6 +32,8 @@ from .models import (
     LeaveStatus,
 )
 from modules.data_management.models import Employee
+from modules.data_management import directory
+from modules.common.intervals import find_conflicts, span_of
 
 # =====================================================================
 # Environment / Defaults
@@ -54,16 +64,21 @@ DEF_END_TIME              = _env_time("ATT_DEFAULT_END_TIME", "17:30")
 
 STD_DAY_MINUTES = DEF_STD_DAILY_MINUTES  # alias
 
+# หักนาทีพัก (WorkingSchedule.break_minutes_override) ออกจาก OT ใน metrics หรือไม่
+# ค่าเริ่มต้นปิด = พฤติกรรมเดิม (ของเดิมเทียบ day_of_week กับ int จึงไม่เคยหักจริง) — เปิดแล้วยอด OT/ค่าจ้าง OT เปลี่ยน
+ATT_OT_DEDUCT_BREAK = getenv("ATT_OT_DEDUCT_BREAK", "0") in ("1", "true", "True")
+
 # =====================================================================
 # Leave Balance core
 # =====================================================================
 
-def _days_between_std(start_dt: datetime, end_dt: datetime) -> float:
-    """คำนวณวันจากนาทีจริง ÷ STD_DAY_MINUTES (ถ้า 0 นาทีให้นับเป็น 1 วัน)."""
-    mins = max(0, int((end_dt - start_dt).total_seconds() // 60))
-    if mins == 0:
-        mins = STD_DAY_MINUTES
-    return round(mins / float(STD_DAY_MINUTES), 4)
+def _new_leave_balance(employee_id: int, leave_type_id: int, year: int) -> LeaveBalance:
+    lb = models.LeaveBalance(employee_id=employee_id, leave_type_id=leave_type_id, year=year)
+    # เฉพาะฟิลด์ที่มีจริงในตาราง
+    for name in ("opening", "accrued", "used", "adjusted", "carry_in", "pending"):
+        if hasattr(models.LeaveBalance, name):
+            setattr(lb, name, 0.0)
+    return lb
 
 def get_or_create_leave_balance(db: Session, employee_id: int, leave_type_id: int, year: int):
     """
@@ -80,15 +95,7 @@ def get_or_create_leave_balance(db: Session, employee_id: int, leave_type_id: in
     )
     created = False
     if not lb:
-        lb = models.LeaveBalance(
-            employee_id=employee_id,
-            leave_type_id=leave_type_id,
-            year=year,
-        )
-        # เฉพาะฟิลด์ที่มีจริงในตาราง
-        for name in ("opening", "accrued", "used", "adjusted", "carry_in"):
-            if hasattr(models.LeaveBalance, name):
-                setattr(lb, name, 0.0)
+        lb = _new_leave_balance(employee_id, leave_type_id, year)
         db.add(lb)
         db.flush()
         created = True
@@ -154,44 +161,208 @@ def _years_of_service(emp: Employee, year: int) -> int:
     yrs = (asof.year - hd.year) - (1 if (asof.month, asof.day) < (hd.month, hd.day) else 0)
     return max(0, yrs)
 
+SEED_BATCH_ROWS = _env_int("LEAVE_SEED_BATCH_ROWS", 500)
+
+def _opening_quota_for(yrs: int, lt) -> float:
+    base = float(getattr(lt, "annual_quota", 0.0) or 0.0)
+    accrue = float(getattr(lt, "accrue_per_year", 0.0) or 0.0)
+    cap = float(getattr(lt, "max_quota", 0.0) or 0.0)
+    opening_val = base + yrs * accrue
+    if cap > 0:
+        opening_val = min(opening_val, cap)
+    return float(opening_val)
+
+def _opening_column() -> str:
+    # เข้ากับ schema เก่า/ใหม่
+    return "opening" if hasattr(models.LeaveBalance, "opening") else "opening_quota"
+
+def _upsert_leave_balances(db: Session, rows: list[dict], update_cols: Iterable[str]) -> bool:
+    """INSERT ... ON CONFLICT(employee_id, leave_type_id, year) DO UPDATE (SQLite / PostgreSQL)
+       คืน False ถ้า dialect ไม่รองรับ (ให้ผู้เรียก fallback เป็น bulk insert/update)"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as _insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as _insert
+    else:
+        return False
+
+    table = models.LeaveBalance.__table__
+    batch = max(1, SEED_BATCH_ROWS)
+    for i in range(0, len(rows), batch):
+        stmt = _insert(table).values(rows[i:i + batch])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.employee_id, table.c.leave_type_id, table.c.year],
+            set_={c: stmt.excluded[c] for c in update_cols},
+        )
+        db.execute(stmt)
+    return True
+
 def seed_leave_balances(db: Session, year: int):
     """
     opening = min( annual_quota + years_of_service * accrue_per_year , max_quota(if >0) )
     ใช้เฉพาะ leave type ที่ affects_balance = True
+    set-based: อ่าน balance เดิมของปีครั้งเดียว แล้ว upsert ทั้งชุด (แถวใหม่ยอดอื่นเป็น 0)
     """
-    employees = db.query(Employee).all()
+    employees = db.query(Employee.id, Employee.hire_date).all()
     leave_types = db.query(models.LeaveType).filter(models.LeaveType.affects_balance == True).all()
+    if not employees or not leave_types:
+        return {"ok": True, "year": year, "created": 0, "updated": 0}
+
+    existing = {
+        (emp_id, lt_id): lb_id
+        for lb_id, emp_id, lt_id in db.query(
+            models.LeaveBalance.id, models.LeaveBalance.employee_id, models.LeaveBalance.leave_type_id
+        ).filter(models.LeaveBalance.year == year).all()
+    }
 
-    created = 0
+    opening_col = _opening_column()
+    now = datetime.utcnow()
+    rows: list[dict] = []
     for emp in employees:
         yrs = _years_of_service(emp, year)
         for lt in leave_types:
-            lb, is_new = get_or_create_leave_balance(db, emp.id, lt.id, year)
+            row = {
+                "employee_id": emp.id,
+                "leave_type_id": lt.id,
+                "year": year,
+                opening_col: _opening_quota_for(yrs, lt),
+                "updated_at": now,
+            }
+            for name in ("accrued", "used", "adjusted", "carry_in"):
+                if hasattr(models.LeaveBalance, name):
+                    row[name] = 0.0
+            rows.append(row)
 
-            # base
-            base = float(getattr(lt, "annual_quota", 0.0) or 0.0)
-            accrue = float(getattr(lt, "accrue_per_year", 0.0) or 0.0)
-            cap = float(getattr(lt, "max_quota", 0.0) or 0.0)
+    created = sum(1 for r in rows if (r["employee_id"], r["leave_type_id"]) not in existing)
+    updated = len(rows) - created
 
-            opening_val = base + yrs * accrue
-            if cap > 0:
-                opening_val = min(opening_val, cap)
+    try:
+        if not _upsert_leave_balances(db, rows, (opening_col, "updated_at")):
+            new_rows = [r for r in rows if (r["employee_id"], r["leave_type_id"]) not in existing]
+            upd_rows = [
+                {"id": existing[(r["employee_id"], r["leave_type_id"])], opening_col: r[opening_col], "updated_at": now}
+                for r in rows if (r["employee_id"], r["leave_type_id"]) in existing
+            ]
+            if new_rows:
+                db.bulk_insert_mappings(models.LeaveBalance, new_rows)
+            if upd_rows:
+                db.bulk_update_mappings(models.LeaveBalance, upd_rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return {"ok": True, "year": year, "created": created, "updated": updated}
 
-            # เข้ากับ schema เก่า/ใหม่
-            if hasattr(models.LeaveBalance, "opening"):
-                lb.opening = float(opening_val)
-            elif hasattr(models.LeaveBalance, "opening_quota"):
-                lb.opening_quota = float(opening_val)
+def _balance_available(lb) -> float:
+    try:
+        return float(lb.available)
+    except Exception:
+        opening = getattr(lb, "opening", None)
+        if opening is None:
+            opening = getattr(lb, "opening_quota", 0.0)
+        return float(
+            (opening or 0.0) + (getattr(lb, "accrued", 0.0) or 0.0) + (getattr(lb, "carry_in", 0.0) or 0.0)
+            + (getattr(lb, "adjusted", 0.0) or 0.0) - (getattr(lb, "used", 0.0) or 0.0)
+        )
 
-            if is_new:
-                # กัน None
-                for name in ("accrued", "used", "adjusted", "carry_in"):
-                    if hasattr(lb, name) and getattr(lb, name) is None:
-                        setattr(lb, name, 0.0)
-                created += 1
+def rollover_leave_balances(db: Session, from_year: int, dry_run: bool = False) -> dict:
+    """
+    ยกยอดสิ้นปี from_year -> from_year + 1 ของพนักงานทุกคน (ประเภทที่ affects_balance) ในรอบเดียว
+    - opening ของปีใหม่ = calc_opening_quota_for_year (รวมสิทธิ์ตามอายุงาน)
+    - carry_in = available ของปีก่อน (ไม่ติดลบ) จำกัดด้วย LeaveType.carry_over_cap (0 = ไม่ยกไป)
+    - แถวปีใหม่ที่มีอยู่แล้ว: ปรับเฉพาะ opening / carry_in (used / adjusted / accrued คงเดิม)
+    - dry_run=True: คืนรายการที่จะเขียนโดยไม่แตะ DB
+    """
+    to_year = from_year + 1
+    employees = db.query(Employee.id, Employee.hire_date).all()
+    leave_types = db.query(models.LeaveType).filter(models.LeaveType.affects_balance == True).all()
 
-    db.commit()
-    return {"ok": True, "year": year, "created": created}
+    prev = {
+        (lb.employee_id, lb.leave_type_id): lb
+        for lb in db.query(models.LeaveBalance).filter(models.LeaveBalance.year == from_year).all()
+    }
+    existing = {
+        (emp_id, lt_id)
+        for emp_id, lt_id in db.query(
+            models.LeaveBalance.employee_id, models.LeaveBalance.leave_type_id
+        ).filter(models.LeaveBalance.year == to_year).all()
+    }
+
+    opening_col = _opening_column()
+    now = datetime.utcnow()
+    rows: list[dict] = []
+    preview: list[dict] = []
+    carried_total = 0.0
+    for emp in employees:
+        for lt in leave_types:
+            cap = float(getattr(lt, "carry_over_cap", 0.0) or 0.0)
+            lb_prev = prev.get((emp.id, lt.id))
+            prev_avail = _balance_available(lb_prev) if lb_prev is not None else 0.0
+            carry = round(min(max(0.0, prev_avail), cap), 4) if cap > 0 else 0.0
+            opening = calc_opening_quota_for_year(emp, lt, to_year)
+            carried_total += carry
+
+            row = {
+                "employee_id": emp.id,
+                "leave_type_id": lt.id,
+                "year": to_year,
+                opening_col: opening,
+                "carry_in": carry,
+                "updated_at": now,
+            }
+            for name in ("accrued", "used", "adjusted"):
+                if hasattr(models.LeaveBalance, name):
+                    row[name] = 0.0
+            rows.append(row)
+            if dry_run:
+                preview.append({
+                    "employee_id": emp.id,
+                    "leave_type_id": lt.id,
+                    "leave_type_name": lt.name,
+                    "prev_available": round(prev_avail, 4),
+                    "opening": opening,
+                    "carry_in": carry,
+                    "action": "update" if (emp.id, lt.id) in existing else "create",
+                })
+
+    created = sum(1 for r in rows if (r["employee_id"], r["leave_type_id"]) not in existing)
+    result = {
+        "ok": True,
+        "from_year": from_year,
+        "to_year": to_year,
+        "dry_run": dry_run,
+        "created": created,
+        "updated": len(rows) - created,
+        "carried_total": round(carried_total, 4),
+    }
+    if dry_run:
+        result["rows"] = preview
+        return result
+
+    try:
+        if not _upsert_leave_balances(db, rows, (opening_col, "carry_in", "updated_at")):
+            ids = {
+                (emp_id, lt_id): lb_id
+                for lb_id, emp_id, lt_id in db.query(
+                    models.LeaveBalance.id, models.LeaveBalance.employee_id, models.LeaveBalance.leave_type_id
+                ).filter(models.LeaveBalance.year == to_year).all()
+            }
+            new_rows = [r for r in rows if (r["employee_id"], r["leave_type_id"]) not in ids]
+            upd_rows = [
+                {"id": ids[(r["employee_id"], r["leave_type_id"])],
+                 opening_col: r[opening_col], "carry_in": r["carry_in"], "updated_at": now}
+                for r in rows if (r["employee_id"], r["leave_type_id"]) in ids
+            ]
+            if new_rows:
+                db.bulk_insert_mappings(models.LeaveBalance, new_rows)
+            if upd_rows:
+                db.bulk_update_mappings(models.LeaveBalance, upd_rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return result
 
 def list_leave_balances(db: Session, employee_id: int, year: int):
     """
@@ -283,9 +454,73 @@ def _should_affect_balance(db: Session, leave_type_id: int) -> bool:
     lt = db.query(LeaveType).get(leave_type_id)
     return bool(getattr(lt, "affects_balance", True)) if lt else False
 
-def _split_across_years(start_d: date, end_d: date, total_days: float) -> list[tuple[int, float]]:
-    """ง่ายที่สุด: ใส่ยอดทั้งหมดในปีเริ่มต้น (ต้องการละเอียดค่อยแตกช่วง)."""
-    return [(start_d.year, total_days)]
+# ---- Leave duration (วันทำงาน) ----
+# ส่วนของวันลาในแต่ละวัน = นาทีลาที่ทับช่วงทำงาน ÷ นาทีทำงานของวันนั้น (ตาม resolve_schedule)
+# วันหยุด / วันที่ไม่มีตาราง = 0; ถ้าระบบยังไม่มีตารางเลย ใช้นาทีจริง ÷ STD_DAY_MINUTES (ไม่เกิน 1 วันต่อวัน)
+# คำนวณได้ทีละหลายคำขอ: วันหยุดโหลดครั้งเดียวทั้งช่วง, ตารางมาจาก cache -> ไม่มี query รายวัน
+
+def _leave_fractions_for(
+    employee_id: int, start_dt: datetime, end_dt: datetime, holidays: set, seg_of, std_mode: bool
+) -> list[tuple[date, float]]:
+    if end_dt <= start_dt:
+        # ลาแบบไม่ระบุเวลา (start == end) = ทั้งวันของวันเริ่ม ถ้าเป็นวันทำงาน
+        d = start_dt.date()
+        if d not in holidays and (std_mode or seg_of(employee_id, d)):
+            return [(d, 1.0)]
+        return []
+
+    out: list[tuple[date, float]] = []
+    for d in _dr_daterange(start_dt.date(), end_dt.date()):
+        if d in holidays:
+            continue
+        if std_mode:
+            mins = _dr_overlap_minutes(
+                start_dt, end_dt, datetime.combine(d, time.min), datetime.combine(d + timedelta(days=1), time.min)
+            )
+            frac = min(1.0, round(mins / float(STD_DAY_MINUTES), 4))
+        else:
+            frac = _dr_leave_fraction_on_day(start_dt, end_dt, d, seg_of(employee_id, d))
+        if frac:
+            out.append((d, frac))
+    return out
+
+def leave_day_fractions(
+    db: Session, items: Iterable[tuple[int, datetime, datetime]]
+) -> list[list[tuple[date, float]]]:
+    """
+    items: [(employee_id, start_dt, end_dt), ...]
+    คืน [(วัน, ส่วนของวัน 0..1), ...] ต่อคำขอ ตามลำดับเดียวกับ items
+    """
+    items = list(items)
+    if not items:
+        return []
+    first = min(s for _, s, _ in items).date()
+    last = max(max(s, e) for _, s, e in items).date()
+    holidays = holiday_dates(db, first, last)
+    std_mode = not _schedule_index(db)
+
+    seg_memo: dict[tuple[int, int], tuple] = {}
+
+    def seg_of(emp_id: int, d: date) -> tuple:
+        key = (emp_id, d.weekday())
+        if key not in seg_memo:
+            rs = resolve_schedule(db, emp_id, d)
+            seg_memo[key] = rs.segments if rs else ()
+        return seg_memo[key]
+
+    return [_leave_fractions_for(emp_id, s, e, holidays, seg_of, std_mode) for emp_id, s, e in items]
+
+def _split_fractions_by_year(fracs: list[tuple[date, float]]) -> list[tuple[int, float]]:
+    by_year: Dict[int, float] = {}
+    for d, f in fracs:
+        by_year[d.year] = by_year.get(d.year, 0.0) + f
+    return [(yy, round(v, 4)) for yy, v in sorted(by_year.items())]
+
+def leave_days_by_year(
+    db: Session, items: Iterable[tuple[int, datetime, datetime]]
+) -> list[list[tuple[int, float]]]:
+    """[(ปี, วันทำงานที่ลา), ...] ต่อคำขอ — ใช้ทั้งตอนตรวจสิทธิ์/หักยอดและ ledger"""
+    return [_split_fractions_by_year(f) for f in leave_day_fractions(db, items)]
 
 def approve_leave_request(db: Session, request_id: int) -> LeaveRequest:
     req = (
@@ -297,17 +532,19 @@ def approve_leave_request(db: Session, request_id: int) -> LeaveRequest:
     if not req:
         raise HTTPException(status_code=404, detail="Leave request not found")
 
-    if str(getattr(req, "status", "")).upper() == "APPROVED":
+    old_status = _leave_status_of(req.status)
+    if old_status == LeaveStatus.APPROVED:
         return req
 
+    mark_attendance_dirty(db, req.employee_id, req.start_date, req.end_date)
+
     if not _should_affect_balance(db, req.leave_type_id):
         req.status = LeaveStatus.APPROVED
         db.commit()
         db.refresh(req)
         return req
 
-    days = _days_between_std(req.start_date, req.end_date)
-    chunks = _split_across_years(req.start_date.date(), req.end_date.date(), days)
+    chunks = _usage_chunks(db, req.employee_id, req.start_date, req.end_date)
 
     # ตรวจสิทธิ์
     for (yy, d) in chunks:
@@ -323,24 +560,121 @@ def approve_leave_request(db: Session, request_id: int) -> LeaveRequest:
                 detail=f"Insufficient leave balance for year {yy}: need {d} days, available {avail:.2f}",
             )
 
-    # หักยอด
-    for (yy, d) in chunks:
-        lb, _ = get_or_create_leave_balance(db, req.employee_id, req.leave_type_id, yy)
-        lb.used = float(getattr(lb, "used", 0.0) or 0.0) + float(d)
-        db.add(lb)
+    # หักยอด (ผ่าน ledger): คืนยอด pending เดิมตามที่ลงไว้ แล้วลง used
+    _reverse_request_usage(db, req, kind="approve")
+    _post_request_usage(db, req.employee_id, req.leave_type_id, req.start_date, req.end_date,
+                        LeaveStatus.APPROVED, request_id=req.id, kind="approve")
 
     req.status = LeaveStatus.APPROVED
     db.commit()
     db.refresh(req)
     return req
 
+def approve_leave_requests_batch(db: Session, request_ids: List[int]) -> list[dict]:
+    """
+    อนุมัติหลายคำขอในครั้งเดียว: โหลดคำขอ / ประเภทลา / balance แบบ IN,
+    ตรวจสิทธิ์ในหน่วยความจำ (รวมยอดที่หักไปแล้วในชุดเดียวกัน), หักยอด แล้ว commit ครั้งเดียว
+    คืนผลรายคำขอ: {"id", "ok", "status", "detail"}
+    """
+    ids = list(dict.fromkeys(int(i) for i in request_ids))
+    if not ids:
+        return []
+
+    reqs = {r.id: r for r in db.query(LeaveRequest).filter(LeaveRequest.id.in_(ids)).all()}
+    type_ids = {r.leave_type_id for r in reqs.values()}
+    ltypes = {lt.id: lt for lt in db.query(LeaveType).filter(LeaveType.id.in_(type_ids)).all()} if type_ids else {}
+
+    # ยอดวันต่อปีของแต่ละคำขอที่กระทบ balance
+    todo = [
+        r for r in reqs.values()
+        if r.status != LeaveStatus.APPROVED
+        and (lt := ltypes.get(r.leave_type_id)) is not None
+        and bool(getattr(lt, "affects_balance", True))
+    ]
+    chunks_of: dict[int, list[tuple[int, float]]] = dict(zip(
+        (r.id for r in todo),
+        leave_days_by_year(db, [(r.employee_id, r.start_date, r.end_date) for r in todo]),
+    ))
+    # ยอดที่แต่ละคำขอลงไว้แล้ว (เช่น pending) -> ถอนตาม ledger
+    posted_of = _ledger_totals(db, chunks_of.keys())
+
+    # balance ทั้งหมดที่เกี่ยวข้องใน query เดียว (ไม่มี = สร้างใหม่แบบยอด 0 ตอนใช้)
+    keys = {(reqs[rid].employee_id, reqs[rid].leave_type_id, yy) for rid, ch in chunks_of.items() for yy, _ in ch}
+    keys |= {k for posted in posted_of.values() for k in posted}
+    balances: dict[tuple[int, int, int], LeaveBalance] = {}
+    if keys:
+        for lb in (
+            db.query(LeaveBalance)
+            .filter(
+                LeaveBalance.employee_id.in_({k[0] for k in keys}),
+                LeaveBalance.leave_type_id.in_({k[1] for k in keys}),
+                LeaveBalance.year.in_({k[2] for k in keys}),
+            )
+            .all()
+        ):
+            balances.setdefault((lb.employee_id, lb.leave_type_id, lb.year), lb)
+
+    def _balance(key) -> LeaveBalance:
+        lb = balances.get(key)
+        if lb is None:
+            lb = _new_leave_balance(*key)
+            db.add(lb)
+            balances[key] = lb
+        return lb
+
+    results: list[dict] = []
+    for rid in ids:
+        req = reqs.get(rid)
+        if not req:
+            results.append({"id": rid, "ok": False, "status": None, "detail": "Leave request not found"})
+            continue
+        if req.status == LeaveStatus.APPROVED:
+            results.append({"id": rid, "ok": True, "status": req.status.value, "detail": "already approved"})
+            continue
+
+        chunks = chunks_of.get(rid, [])
+        short = None
+        for yy, d in chunks:
+            avail = _balance((req.employee_id, req.leave_type_id, yy)).available
+            if avail < d:
+                short = f"Insufficient leave balance for year {yy}: need {d} days, available {avail:.2f}"
+                break
+        if short:
+            results.append({"id": rid, "ok": False, "status": req.status.value, "detail": short})
+            continue
+
+        if rid in posted_of:
+            for key, (used, pend) in posted_of[rid].items():
+                _post_usage_to(db, _balance(key), used_delta=-used, pending_delta=-pend,
+                               request_id=req.id, kind="approve")
+        elif _leave_status_of(req.status) == LeaveStatus.PENDING:
+            # คำขอก่อนเปิด ledger: ถอน pending ตามวันที่คำนวณได้
+            for yy, d in chunks:
+                _post_usage_to(db, _balance((req.employee_id, req.leave_type_id, yy)), pending_delta=-d,
+                               request_id=req.id, kind="approve")
+        for yy, d in chunks:
+            lb = _balance((req.employee_id, req.leave_type_id, yy))
+            _post_usage_to(db, lb, used_delta=d, request_id=req.id, kind="approve")
+        req.status = LeaveStatus.APPROVED
+        mark_attendance_dirty(db, req.employee_id, req.start_date, req.end_date)
+        results.append({"id": rid, "ok": True, "status": req.status.value, "detail": None})
+
+    try:
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return results
+
 def reject_leave_request(db: Session, request_id: int, reason: Optional[str] = None) -> LeaveRequest:
     req = db.query(LeaveRequest).filter(LeaveRequest.id == request_id).first()
     if not req:
         raise HTTPException(status_code=404, detail="Leave request not found")
+    _reverse_request_usage(db, req, kind="reject")
     req.status = LeaveStatus.REJECTED
     if hasattr(req, "note") and reason:
         req.note = reason
+    mark_attendance_dirty(db, req.employee_id, req.start_date, req.end_date)
     db.commit()
     db.refresh(req)
     return req
@@ -351,50 +685,177 @@ def _ensure_enough_balance(
     """
     ใช้ตอนสร้าง/แก้ไขคำขอที่ตั้ง Approved ตั้งแต่แรก ให้เช็คสิทธิ์ก่อน
     """
-    lt = db.query(models.LeaveType).get(leave_type_id)
-    if not lt or not bool(getattr(lt, "affects_balance", True)):
+    _ensure_enough_balance_many(db, [(employee_id, leave_type_id, start_dt, end_dt)])
+
+def _ensure_enough_balance_many(
+    db: Session, items: list[tuple[int, int, datetime, datetime]]
+) -> None:
+    """
+    เช็คสิทธิ์ของหลายคำขอ (employee, leave_type, start, end) พร้อมกัน:
+    รวมยอดวันที่ขอต่อ (พนักงาน, ประเภทลา, ปี) ในหน่วยความจำก่อน แล้วเทียบกับ balance ที่โหลดครั้งเดียว
+    -> คำขอหลายรายการของคนเดียวกันในชุดเดียวกันหักสิทธิ์รวมกันได้ไม่เกินที่มี
+    """
+    type_ids = {lt_id for _, lt_id, _, _ in items}
+    if not type_ids:
+        return
+    limited = {
+        lt.id for lt in db.query(LeaveType).filter(LeaveType.id.in_(type_ids)).all()
+        if bool(getattr(lt, "affects_balance", True)) and float(getattr(lt, "annual_quota", 0.0) or 0.0) != 0.0
+    }  # quota 0 = ไม่จำกัดโควต้า
+    todo = [it for it in items if it[1] in limited]
+    if not todo:
         return
 
-    quota = float(getattr(lt, "annual_quota", 0.0) or 0.0)
-    if quota == 0.0:
-        return  # ไม่จำกัดโควต้า
+    need: DefaultDict[tuple[int, int, int], float] = defaultdict(float)
+    split = leave_days_by_year(db, [(emp_id, sd, ed) for emp_id, _, sd, ed in todo])
+    for (emp_id, lt_id, _, _), chunks in zip(todo, split):
+        for yy, d in chunks:
+            need[(emp_id, lt_id, yy)] += d
+
+    avail: dict[tuple[int, int, int], float] = {}
+    for lb in (
+        db.query(LeaveBalance)
+        .filter(
+            LeaveBalance.employee_id.in_({k[0] for k in need}),
+            LeaveBalance.leave_type_id.in_({k[1] for k in need}),
+            LeaveBalance.year.in_({k[2] for k in need}),
+        )
+        .all()
+    ):
+        avail.setdefault((lb.employee_id, lb.leave_type_id, lb.year), float(lb.available))
 
-    y = start_dt.year
-    lb, _ = get_or_create_leave_balance(db, employee_id, leave_type_id, y)
-    need = _days_between_std(start_dt, end_dt)
+    for key in sorted(need):
+        have = avail.get(key, 0.0)  # ยังไม่มี balance = ยอด 0
+        if have < need[key]:
+            raise HTTPException(
+                status_code=409,
+                detail=f"สิทธิ์ไม่พอ (ปี {key[2]}) ต้องใช้ {need[key]:.2f} วัน เหลือ {have:.2f} วัน",
+            )
 
-    # ถ้ามี property available ใช้เลย, ไม่งั้นคำนวณคร่าวจาก quota-used
-    avail = getattr(lb, "available", None)
-    if avail is None:
-        avail = quota - float(getattr(lb, "used", 0.0) or 0.0)
+# ---- Leave usage ledger ----
+# ทุกการเปลี่ยนยอด used / pending ลง leave_usage_ledger (append-only)
+# และปรับยอดสะสมใน LeaveBalance (employee, type, year) ไปพร้อมกัน -> อ่าน balance ได้ทันที
 
-    if float(avail) < need:
-        raise HTTPException(
-            status_code=409, detail=f"สิทธิ์ไม่พอ ต้องใช้ {need:.2f} วัน เหลือ {float(avail):.2f} วัน"
-        )
+def _leave_status_of(v) -> Optional[LeaveStatus]:
+    if v is None or isinstance(v, LeaveStatus):
+        return v
+    sv = str(getattr(v, "value", v)).strip().lower()
+    for st in LeaveStatus:
+        if sv in (st.name.lower(), st.value.lower()):
+            return st
+    return None
 
-def _apply_usage(
-    db: Session, employee_id: int, leave_type_id: int, start_dt: datetime, end_dt: datetime, sign: int
-):
+def _usage_chunks(db: Session, employee_id: int, start_dt: datetime, end_dt: datetime) -> list[tuple[int, float]]:
+    return leave_days_by_year(db, [(employee_id, start_dt, end_dt)])[0]
+
+def _post_usage_to(
+    db: Session,
+    lb: LeaveBalance,
+    used_delta: float = 0.0,
+    pending_delta: float = 0.0,
+    request_id: Optional[int] = None,
+    kind: str = "usage",
+    note: Optional[str] = None,
+) -> None:
+    """ลง ledger หนึ่งแถว + ปรับยอดสะสมของ balance นั้น (ไม่ commit)"""
+    if not used_delta and not pending_delta:
+        return
+    lb.used = float(getattr(lb, "used", 0.0) or 0.0) + float(used_delta)
+    lb.pending = float(getattr(lb, "pending", 0.0) or 0.0) + float(pending_delta)
+    db.add(models.LeaveUsageLedger(
+        employee_id=lb.employee_id,
+        leave_type_id=lb.leave_type_id,
+        year=lb.year,
+        leave_request_id=request_id,
+        kind=kind,
+        used_delta=float(used_delta),
+        pending_delta=float(pending_delta),
+        note=note,
+    ))
+
+def _post_usage(
+    db: Session, employee_id: int, leave_type_id: int, year: int,
+    used_delta: float = 0.0, pending_delta: float = 0.0,
+    request_id: Optional[int] = None, kind: str = "usage", note: Optional[str] = None,
+) -> None:
+    lb, _ = get_or_create_leave_balance(db, employee_id, leave_type_id, year)
+    _post_usage_to(db, lb, used_delta, pending_delta, request_id=request_id, kind=kind, note=note)
+
+def _post_request_usage(
+    db: Session, employee_id: int, leave_type_id: int, start_dt: datetime, end_dt: datetime,
+    status_val, request_id: Optional[int] = None, kind: str = "usage",
+) -> None:
     """
-    sign = +1 เมื่อตั้ง Approved → เพิ่ม used
-    sign = -1 เมื่อเปลี่ยนจาก Approved → คืน used
+    ใส่ผลของคำขอหนึ่งรายการต่อ balance ตามสถานะ: APPROVED -> used, PENDING -> pending, อื่น ๆ -> ไม่มี
+    (การถอนผลเดิมใช้ _reverse_request_usage ซึ่งอิง ledger ไม่คำนวณวันใหม่)
     """
-    lt = db.query(models.LeaveType).get(leave_type_id)
-    if not lt or not bool(getattr(lt, "affects_balance", True)):
+    st = _leave_status_of(status_val)
+    if st not in (LeaveStatus.APPROVED, LeaveStatus.PENDING):
         return
-    y = start_dt.year
-    lb, _ = get_or_create_leave_balance(db, employee_id, leave_type_id, y)
-    inc = _days_between_std(start_dt, end_dt) * (1 if sign >= 0 else -1)
-    lb.used = max(0.0, float(getattr(lb, "used", 0.0) or 0.0) + inc)
-    db.commit()
-    db.refresh(lb)
+    if not _should_affect_balance(db, leave_type_id):
+        return
+    for yy, d in _usage_chunks(db, employee_id, start_dt, end_dt):
+        if st == LeaveStatus.APPROVED:
+            _post_usage(db, employee_id, leave_type_id, yy, used_delta=d, request_id=request_id, kind=kind)
+        else:
+            _post_usage(db, employee_id, leave_type_id, yy, pending_delta=d, request_id=request_id, kind=kind)
+
+def _ledger_totals(
+    db: Session, request_ids: Iterable[int]
+) -> dict[int, dict[tuple[int, int, int], tuple[float, float]]]:
+    """ยอดสุทธิใน ledger ต่อคำขอ: {request_id: {(employee, type, year): (used, pending)}}
+       คำขอที่มีแถวใน ledger (แม้ยอดสุทธิเป็น 0) จะมี key เสมอ; ไม่มี key = คำขอก่อนเปิด ledger"""
+    ids = list({int(i) for i in request_ids if i is not None})
+    out: dict[int, dict[tuple[int, int, int], tuple[float, float]]] = {}
+    if not ids:
+        return out
+    db.flush()  # autoflush ปิดอยู่: แถวที่เพิ่งลงใน transaction นี้ต้องถูกนับด้วย
+    L = models.LeaveUsageLedger
+    rows = (
+        db.query(L.leave_request_id, L.employee_id, L.leave_type_id, L.year,
+                 func.sum(L.used_delta), func.sum(L.pending_delta))
+        .filter(L.leave_request_id.in_(ids))
+        .group_by(L.leave_request_id, L.employee_id, L.leave_type_id, L.year)
+        .all()
+    )
+    for rid, emp_id, lt_id, yy, used, pend in rows:
+        used, pend = round(float(used or 0.0), 4), round(float(pend or 0.0), 4)
+        posted = out.setdefault(rid, {})
+        if used or pend:
+            posted[(emp_id, lt_id, yy)] = (used, pend)
+    return out
+
+def _reverse_request_usage(db: Session, req: LeaveRequest, kind: str = "usage") -> None:
+    """
+    ถอนผลทั้งหมดที่คำขอนี้เคยลง ledger (ตามยอดที่ลงจริง ไม่คำนวณวันใหม่)
+    -> ตาราง/วันหยุดที่เปลี่ยนภายหลังไม่ทำให้ used / pending เพี้ยน
+    คำขอที่อนุมัติ/รอก่อนเปิด ledger (ไม่มีแถวของตัวเอง) ถอนตามวันที่คำนวณจากค่าปัจจุบันของคำขอ
+    (req ต้องยังเป็นค่าเดิม — เรียกก่อนแก้ฟิลด์)
+    """
+    posted = _ledger_totals(db, [req.id])
+    if req.id in posted:
+        for (emp_id, lt_id, yy), (used, pend) in posted[req.id].items():
+            _post_usage(db, emp_id, lt_id, yy, used_delta=-used, pending_delta=-pend,
+                        request_id=req.id, kind=kind)
+        return
+
+    st = _leave_status_of(req.status)
+    if st not in (LeaveStatus.APPROVED, LeaveStatus.PENDING):
+        return
+    if not _should_affect_balance(db, req.leave_type_id):
+        return
+    for yy, d in _usage_chunks(db, req.employee_id, req.start_date, req.end_date):
+        if st == LeaveStatus.APPROVED:
+            _post_usage(db, req.employee_id, req.leave_type_id, yy, used_delta=-d, request_id=req.id, kind=kind)
+        else:
+            _post_usage(db, req.employee_id, req.leave_type_id, yy, pending_delta=-d, request_id=req.id, kind=kind)
 
 def get_leave_balance_year(
     db: Session, employee_id: int, leave_type_id: int, year: int, include_pending: bool = True
 ) -> dict:
     """
-    สรุป balance จาก LeaveRequest (Approved/Pending) ตามปี (อิง quota จาก LeaveType.annual_quota)
+    สรุป balance ของปีจากยอดสะสมใน LeaveBalance (used / pending ที่ ledger ดูแล)
+    quota อิง LeaveType.annual_quota
     """
     lt = db.query(LeaveType).filter(LeaveType.id == leave_type_id).first()
     if not lt:
@@ -409,30 +870,17 @@ def get_leave_balance_year(
     quota = float(getattr(lt, "annual_quota", 0.0) or 0.0)
     affects = bool(getattr(lt, "affects_balance", True))
 
-    y_start = datetime(year, 1, 1)
-    y_end = datetime(year, 12, 31, 23, 59, 59)
-
-    q = db.query(LeaveRequest).filter(
-        LeaveRequest.employee_id == employee_id,
-        LeaveRequest.leave_type_id == leave_type_id,
-        LeaveRequest.start_date <= y_end,
-        LeaveRequest.end_date >= y_start,
+    lb = (
+        db.query(LeaveBalance)
+        .filter(
+            LeaveBalance.employee_id == employee_id,
+            LeaveBalance.leave_type_id == leave_type_id,
+            LeaveBalance.year == year,
+        )
+        .first()
     )
-    rows = q.all()
-
-    used_appr = 0.0
-    used_pend = 0.0
-    for r in rows:
-        s = max(r.start_date, y_start)
-        e = min(r.end_date, y_end)
-        if e <= s:
-            continue
-        d = _days_between_std(s, e)
-        st = str(getattr(r, "status", "")).upper()
-        if st == "APPROVED":
-            used_appr += d
-        elif include_pending and st == "PENDING":
-            used_pend += d
+    used_appr = float(getattr(lb, "used", 0.0) or 0.0) if lb else 0.0
+    used_pend = float(getattr(lb, "pending", 0.0) or 0.0) if (lb and include_pending) else 0.0
 
     available = quota - used_appr if quota > 0 else float("inf")
     return {
@@ -443,6 +891,73 @@ def get_leave_balance_year(
         "affects_balance": affects,
     }
 
+def get_leave_usage_ledger(
+    db: Session, employee_id: int, leave_type_id: int, year: int, skip: int = 0, limit: int = 200
+):
+    L = models.LeaveUsageLedger
+    return (
+        db.query(L)
+        .filter(L.employee_id == employee_id, L.leave_type_id == leave_type_id, L.year == year)
+        .order_by(L.id.asc())
+        .offset(skip)
+        .limit(limit)
+        .all()
+    )
+
+def rebuild_leave_usage(db: Session, year: int, dry_run: bool = False) -> dict:
+    """
+    เทียบยอด used / pending ใน LeaveBalance ของปีกับคำขอลาจริง (Approved / Pending)
+    ส่วนต่างลง ledger เป็น kind="rebuild" (ไม่แก้แถว ledger เดิม) — ใช้ครั้งแรกหลังเปิด ledger หรือเมื่อสงสัยว่ายอดเพี้ยน
+    """
+    type_ok = {lt.id for lt in db.query(LeaveType).all() if bool(getattr(lt, "affects_balance", True))}
+    y_start = datetime(year, 1, 1)
+    y_next = datetime(year + 1, 1, 1)
+
+    # ยอดที่ควรเป็น ตามกติกาเดียวกับตอนอนุมัติ (_usage_chunks)
+    expected: DefaultDict[tuple[int, int], list] = defaultdict(lambda: [0.0, 0.0])
+    q = db.query(LeaveRequest.employee_id, LeaveRequest.leave_type_id, LeaveRequest.start_date,
+                 LeaveRequest.end_date, LeaveRequest.status).filter(
+        LeaveRequest.status.in_([LeaveStatus.APPROVED, LeaveStatus.PENDING]),
+        LeaveRequest.start_date < y_next,
+        LeaveRequest.end_date >= y_start,
+    )
+    rows = [r for r in q.all() if r[1] in type_ok]
+    split = leave_days_by_year(db, [(emp_id, sd, ed) for emp_id, _, sd, ed, _ in rows])
+    for (emp_id, lt_id, _, _, st), chunks in zip(rows, split):
+        for yy, d in chunks:
+            if yy == year:
+                expected[(emp_id, lt_id)][0 if st == LeaveStatus.APPROVED else 1] += d
+
+    balances = {
+        (lb.employee_id, lb.leave_type_id): lb
+        for lb in db.query(LeaveBalance).filter(LeaveBalance.year == year).all()
+        if lb.leave_type_id in type_ok
+    }
+
+    changes = []
+    for key in set(expected) | set(balances):
+        exp_used, exp_pend = expected.get(key, (0.0, 0.0))
+        lb = balances.get(key)
+        cur_used = float(getattr(lb, "used", 0.0) or 0.0) if lb else 0.0
+        cur_pend = float(getattr(lb, "pending", 0.0) or 0.0) if lb else 0.0
+        du, dp = round(exp_used - cur_used, 4), round(exp_pend - cur_pend, 4)
+        if du or dp:
+            changes.append({"employee_id": key[0], "leave_type_id": key[1], "used_delta": du, "pending_delta": dp})
+
+    if not dry_run and changes:
+        try:
+            for c in changes:
+                lb = balances.get((c["employee_id"], c["leave_type_id"]))
+                if lb is None:
+                    lb = _new_leave_balance(c["employee_id"], c["leave_type_id"], year)
+                    db.add(lb)
+                _post_usage_to(db, lb, c["used_delta"], c["pending_delta"], kind="rebuild")
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    return {"ok": True, "year": year, "dry_run": dry_run, "changed": len(changes), "changes": changes}
+
 # =====================================================================
 # Time entries (Report / Import)
 # =====================================================================
@@ -461,7 +976,11 @@ def get_time_entries_report(
             .filter(Employee.employee_id_number.ilike(f"%{employee_id_number}%"))
         )
     if entry_date:
-        q = q.filter(func.date(models.TimeEntry.check_in_time) == entry_date)
+        day_start = datetime.combine(entry_date, time.min)
+        q = q.filter(
+            models.TimeEntry.check_in_time >= day_start,
+            models.TimeEntry.check_in_time < day_start + timedelta(days=1),
+        )
     return q.order_by(models.TimeEntry.check_in_time.desc()).offset(skip).limit(limit).all()
 
 def get_time_entries_report_range(
@@ -492,50 +1011,133 @@ def get_time_entries_report_range(
     )
     return q.order_by(models.TimeEntry.check_in_time.desc()).offset(skip).limit(limit).all()
 
-def import_time_entries_from_csv_or_excel(db: Session, df: pd.DataFrame) -> int:
-    created = updated = 0
-    df.columns = df.columns.str.strip()
-    req = ["Employee ID", "Time"]
-    if not all(c in df.columns for c in req):
-        missing = [c for c in req if c not in df.columns]
-        raise KeyError(f"Missing required columns: {', '.join(missing)}")
+# ---- Import (สแกนนิ้ว / device export) ----
+# อ่านไฟล์เป็นก้อน ๆ แล้วรวม min/max/จำนวนครั้ง ต่อ (รหัสพนักงาน, วัน) ข้ามทุกก้อน
+# จากนั้น: หา employee ด้วย IN ครั้งเดียว, preload TimeEntry เดิมทั้งช่วงวัน,
+# แล้ว insert/update แบบ bulk ทีละ batch
 
-    df["Time"] = pd.to_datetime(df["Time"], errors="coerce")
-    df.dropna(subset=["Time"], inplace=True)
-    grouped = df.groupby([df["Employee ID"], df["Time"].dt.date])
+IMPORT_CHUNK_ROWS  = _env_int("TIME_IMPORT_CHUNK_ROWS", 50000)
+IMPORT_BATCH_SIZE  = _env_int("TIME_IMPORT_BATCH_SIZE", 1000)
+_IN_CHUNK = 900  # กันชนเพดานตัวแปรของ SQLite
 
-    for (emp_code, d), day_df in grouped:
-        emp = db.query(Employee).filter(Employee.employee_id_number == str(emp_code)).first()
-        if not emp:
-            continue
+def _emp_code_str(v) -> str:
+    # pandas อาจ infer เป็น float ในบางก้อน (มีช่องว่าง) -> 20220201.0
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    return str(v).strip()
 
-        ci = day_df["Time"].min()
-        co = day_df["Time"].max()
-        if len(day_df) < 2:
-            co = None
+def _punch_groups(chunks: Iterable[pd.DataFrame]) -> dict[tuple[str, date], list]:
+    """รวม punch ทุกก้อน -> {(code, day): [min_time, max_time, count]}"""
+    groups: dict[tuple[str, date], list] = {}
+    req = ["Employee ID", "Time"]
+    for df in chunks:
+        df.columns = df.columns.str.strip()
+        if not all(c in df.columns for c in req):
+            missing = [c for c in req if c not in df.columns]
+            raise KeyError(f"Missing required columns: {', '.join(missing)}")
+
+        t = pd.to_datetime(df["Time"], errors="coerce")
+        part = pd.DataFrame({"code": df["Employee ID"], "day": t.dt.date, "t": t}).dropna(subset=["t", "code"])
+        if part.empty:
+            continue
+        agg = part.groupby(["code", "day"])["t"].agg(["min", "max", "count"])
+        for (code, d), mn, mx, cnt in zip(agg.index, agg["min"], agg["max"], agg["count"]):
+            key = (_emp_code_str(code), d)
+            g = groups.get(key)
+            if g is None:
+                groups[key] = [mn, mx, int(cnt)]
+            else:
+                if mn < g[0]:
+                    g[0] = mn
+                if mx > g[1]:
+                    g[1] = mx
+                g[2] += int(cnt)
+    return groups
+
+def _employee_ids_by_code(db: Session, codes: Iterable[str]) -> dict[str, int]:
+    codes = list(codes)
+    out: dict[str, int] = {}
+    for i in range(0, len(codes), _IN_CHUNK):
+        q = db.query(Employee.employee_id_number, Employee.id).filter(
+            Employee.employee_id_number.in_(codes[i:i + _IN_CHUNK])
+        )
+        for code, emp_id in q.all():
+            out.setdefault(code, emp_id)
+    return out
 
-        exist = (
-            db.query(models.TimeEntry)
-            .filter(models.TimeEntry.employee_id == emp.id, func.date(models.TimeEntry.check_in_time) == d)
-            .first()
+def _existing_entry_ids(db: Session, emp_ids: list[int], start: date, end: date) -> dict[tuple[int, date], int]:
+    """TimeEntry เดิม (id ต่ำสุด) ต่อ (พนักงาน, วันที่ check-in) ในช่วง [start, end]"""
+    start_dt = datetime.combine(start, time.min)
+    end_dt = datetime.combine(end + timedelta(days=1), time.min)
+    out: dict[tuple[int, date], int] = {}
+    for i in range(0, len(emp_ids), _IN_CHUNK):
+        q = (
+            db.query(models.TimeEntry.id, models.TimeEntry.employee_id, models.TimeEntry.check_in_time)
+            .filter(
+                models.TimeEntry.employee_id.in_(emp_ids[i:i + _IN_CHUNK]),
+                models.TimeEntry.check_in_time >= start_dt,
+                models.TimeEntry.check_in_time < end_dt,
+            )
+            .order_by(models.TimeEntry.id.asc())
         )
-        if exist:
-            exist.check_in_time = ci
-            exist.check_out_time = co
-            db.add(exist)
-            updated += 1
+        for te_id, emp_id, ci in q.all():
+            out.setdefault((emp_id, ci.date()), te_id)
+    return out
+
+def import_time_entries_stream(db: Session, chunks: Iterable[pd.DataFrame]) -> dict:
+    """นำเข้า punch จาก DataFrame หลายก้อน (เช่น pd.read_csv(..., chunksize=N))
+       -> {"created", "updated", "unknown_employees"}"""
+    groups = _punch_groups(chunks)
+    if not groups:
+        return {"created": 0, "updated": 0, "unknown_employees": 0}
+
+    emp_by_code = _employee_ids_by_code(db, {code for code, _ in groups})
+    unknown = len({code for code, _ in groups if code not in emp_by_code})
+
+    days = [d for code, d in groups if code in emp_by_code]
+    existing = (
+        _existing_entry_ids(db, sorted(set(emp_by_code.values())), min(days), max(days))
+        if days else {}
+    )
+
+    inserts: list[dict] = []
+    updates: list[dict] = []
+    cells: list[tuple[int, date]] = []
+    for (code, d), (ci, co, cnt) in groups.items():
+        emp_id = emp_by_code.get(code)
+        if emp_id is None:
+            continue
+        ci = ci.to_pydatetime()
+        co = co.to_pydatetime() if cnt >= 2 else None
+        cells.append((emp_id, d))
+        te_id = existing.get((emp_id, d))
+        if te_id is not None:
+            updates.append({"id": te_id, "check_in_time": ci, "check_out_time": co})
         else:
-            db.add(
-                models.TimeEntry(
-                    employee_id=emp.id,
-                    check_in_time=ci,
-                    check_out_time=co,
-                    status=models.TimeEntryStatus.APPROVED,
-                )
-            )
-            created += 1
-    db.commit()
-    return created + updated
+            inserts.append({
+                "employee_id": emp_id,
+                "check_in_time": ci,
+                "check_out_time": co,
+                "status": models.TimeEntryStatus.APPROVED,
+            })
+
+    batch = max(1, IMPORT_BATCH_SIZE)
+    try:
+        for i in range(0, len(inserts), batch):
+            db.bulk_insert_mappings(models.TimeEntry, inserts[i:i + batch])
+        for i in range(0, len(updates), batch):
+            db.bulk_update_mappings(models.TimeEntry, updates[i:i + batch])
+        for i in range(0, len(cells), batch):
+            _mark_cells_dirty(db, cells[i:i + batch])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return {"created": len(inserts), "updated": len(updates), "unknown_employees": unknown}
+
+def import_time_entries_from_csv_or_excel(db: Session, df: pd.DataFrame) -> int:
+    res = import_time_entries_stream(db, [df])
+    return res["created"] + res["updated"]
 
 # =====================================================================
 # Holidays CRUD
@@ -546,15 +1148,54 @@ def _holiday_date_col():
             return getattr(models.Holiday, c)
     return getattr(models.Holiday, "id")  # fallback
 
-def _is_holiday(db: Session, day: date) -> bool:
+# ---- Holiday calendar (cache) ----
+# โหลดวันหยุด active ทั้งหมดครั้งเดียว: วันที่ตายตัว + (เดือน, วัน) ของวันหยุดประจำปี
+# ล้างเมื่อมีการแก้ Holiday (และหมดอายุตาม TTL กันหลาย process)
+
+ATT_HOLIDAY_CACHE_TTL = _env_int("ATT_HOLIDAY_CACHE_TTL_SEC", 300)
+_holiday_cache: dict = {"rules": None, "loaded_at": 0.0}
+
+def invalidate_holiday_cache() -> None:
+    _holiday_cache["rules"] = None
+
+def _holiday_rules(db: Session) -> tuple[frozenset, frozenset]:
+    rules = _holiday_cache["rules"]
+    if rules is not None and (_time.monotonic() - _holiday_cache["loaded_at"]) < ATT_HOLIDAY_CACHE_TTL:
+        return rules
+
     col = _holiday_date_col()
-    # ถ้าเป็นคอลัมน์ datetime ให้เทียบเฉพาะวัน
-    # ใช้ func.date เพื่อความกว้าง (บาง DB)
-    try:
-        return db.query(models.Holiday).filter(func.date(col) == day).first() is not None
-    except Exception:
-        # fallback เทียบตรง ๆ
-        return db.query(models.Holiday).filter(col == day).first() is not None
+    fixed: set[date] = set()
+    recurring: set[tuple[int, int]] = set()
+    q = db.query(col, models.Holiday.is_recurring).filter(models.Holiday.is_active == True)
+    for hd, is_recurring in q.all():
+        hd = _as_date(hd)
+        if hd is None:
+            continue
+        fixed.add(hd)
+        if is_recurring:
+            recurring.add((hd.month, hd.day))
+
+    rules = (frozenset(fixed), frozenset(recurring))
+    _holiday_cache["rules"] = rules
+    _holiday_cache["loaded_at"] = _time.monotonic()
+    return rules
+
+def holiday_dates(db: Session, start: date, end: date) -> set[date]:
+    """ชุดวันหยุดในช่วง [start, end] (ขยายวันหยุดประจำปีให้ทุกปีในช่วง)"""
+    fixed, recurring = _holiday_rules(db)
+    out = {d for d in fixed if start <= d <= end}
+    for y in range(start.year, end.year + 1):
+        for m, dd in recurring:
+            try:
+                d = date(y, m, dd)
+            except ValueError:  # 29 ก.พ. ในปีที่ไม่ใช่อธิกสุรทิน
+                continue
+            if start <= d <= end:
+                out.add(d)
+    return out
+
+def _is_holiday(db: Session, day: date) -> bool:
+    return day in holiday_dates(db, day, day)
 
 # def _holiday_date_col():
 #     """
@@ -568,36 +1209,12 @@ def _is_holiday(db: Session, day: date) -> bool:
 #     # ถ้าไม่พบจริง ๆ ก็ย้อนกลับไปใช้ id เพื่อกัน error
 #     return getattr(models.Holiday, "id")
 
-def _classify_attendance_for_day(db: Session, employee_id: int, day: date) -> Optional[dict]:
-    # 1) ถ้าเป็นวันลา (อนุมัติ) -> คืนสถานะลา (เหมือนเดิม)
-    lr = (
-        db.query(models.LeaveRequest)
-        .filter(models.LeaveRequest.employee_id == employee_id)
-        .filter(models.LeaveRequest.status == models.LeaveStatus.APPROVED)
-        .filter(models.LeaveRequest.start_date <= day)
-        .filter(models.LeaveRequest.end_date >= day)
-        .first()
-    )
-    if lr:
-        ...
-        return dict(...)
-
-    # 2) ถ้าเป็น "วันหยุด" -> ข้ามไม่สร้างแถว (แสดงว่างในหน้า)
-    if _is_holiday(db, day):
-        return None  # ไม่ถือเป็นขาดงาน/ลา
-
-    # 3) ทำงานต่อด้วย schedule ตามปกติ
-    sch = _get_schedule_for_day(db, employee_id, day)
-    if not sch:
-        return None
-    policy = _policy_from_schedule(sch)
-    if not policy["is_workday"]:
-        return None
-
 def create_holiday(db: Session, holiday: schemas.HolidayCreate):
     obj = models.Holiday(**holiday.model_dump())
     db.add(obj)
+    _mark_holiday_dirty(db, obj)
     db.commit()
+    invalidate_holiday_cache()
     db.refresh(obj)
     return obj
 
@@ -619,9 +1236,12 @@ def update_holiday(db: Session, holiday_id: int, holiday_update: schemas.Holiday
     obj = get_holiday(db, holiday_id)
     if not obj:
         return None
+    _mark_holiday_dirty(db, obj)
     for k, v in holiday_update.model_dump(exclude_unset=True).items():
         setattr(obj, k, v)
+    _mark_holiday_dirty(db, obj)
     db.commit()
+    invalidate_holiday_cache()
     db.refresh(obj)
     return obj
 
@@ -629,8 +1249,10 @@ def delete_holiday(db: Session, holiday_id: int):
     obj = get_holiday(db, holiday_id)
     if not obj:
         return None
+    _mark_holiday_dirty(db, obj)
     db.delete(obj)
     db.commit()
+    invalidate_holiday_cache()
     return {"message": "วันหยุดถูกลบแล้ว"}
 
 # =====================================================================
@@ -654,10 +1276,12 @@ def _dr_day_segments(db: Session, emp_id: int, d: date) -> List[Tuple[time, time
     - ถ้า WorkingSchedule มี break ให้แตกเป็น 2 ช่วง (ก่อนพัก/หลังพัก)
     - ถ้าเป็นวันหยุด/ไม่ใช่วันทำงาน => []
     """
-    sch = _get_schedule_for_day(db, emp_id, d)
-    if not sch:
+    if _is_holiday(db, d):
         return []
-    pol = _policy_from_schedule(sch)
+    rs = resolve_schedule(db, emp_id, d)
+    return list(rs.segments) if rs else []
+
+def _schedule_segments(sch, pol: dict) -> List[Tuple[time, time]]:
     if not pol["is_workday"]:
         return []
 
@@ -697,26 +1321,32 @@ def _dr_leave_fraction_on_day(leave_start: datetime, leave_end: datetime, d: dat
     used = min(used, total)
     return round(used / total, 4)
 
-def build_daily_report(
+# ---- รายงานรายวัน: เดินทีละชุดพนักงาน (keyset ตาม Employee.id) ----
+# หน่วยความจำคงที่ตามขนาดชุด ไม่ขึ้นกับจำนวนพนักงาน/ความยาวช่วงวัน
+
+REPORT_EMP_BATCH = _env_int("REPORT_EMP_BATCH", 200)
+
+def _daily_report_masters(db: Session) -> tuple[dict, dict]:
+    lt_list = db.query(LeaveType).all()
+    ot_list = db.query(models.OvertimeType).all() if hasattr(models, "OvertimeType") else []
+    return {x.id: x.name for x in lt_list}, {x.id: x.name for x in ot_list}
+
+def _daily_report_batch(
     db: Session,
+    employee_ids: list[int],
     date_from: date,
     date_to: date,
-    employee_id_number: Optional[str] = None,
+    lt_id2name: dict,
+    ot_id2name: dict,
     include_leaves: bool = True,
     include_ot: bool = True,
 ) -> List[dict]:
-    # master
-    lt_list = db.query(LeaveType).all()
-    ot_list = db.query(models.OvertimeType).all() if hasattr(models, "OvertimeType") else []
-    lt_id2name = {x.id: x.name for x in lt_list}
-    ot_id2name = {x.id: x.name for x in ot_list}
-
-    # employees
-    emp_q = db.query(Employee)
-    if employee_id_number:
-        emp_q = emp_q.filter(Employee.employee_id_number == employee_id_number)
-    emps = emp_q.all()
-    emp_by_id = {e.id: e for e in emps}
+    """แถวรายงานของพนักงานชุดหนึ่ง เรียงตาม (employee_id, date)
+       id ที่ไม่มีใน directory (เช่น ถูกลบไประหว่างทาง) ไม่ออกในรายงาน"""
+    emp_by_id = directory.get_many(db, employee_ids)
+    emp_ids = [i for i in employee_ids if i in emp_by_id]
+    if not emp_ids:
+        return []
 
     # time entries (ครอบคลุมช่วง)
     start_dt = datetime.combine(date_from, time.min)
@@ -725,6 +1355,7 @@ def build_daily_report(
     te_q = (
         db.query(models.TimeEntry)
         .filter(
+            models.TimeEntry.employee_id.in_(emp_ids),
             or_(
                 models.TimeEntry.check_in_time.between(start_dt, end_dt),
                 models.TimeEntry.check_out_time.between(start_dt, end_dt),
@@ -733,11 +1364,6 @@ def build_daily_report(
             )
         )
     )
-    if employee_id_number:
-        te_q = (
-            te_q.join(Employee, models.TimeEntry.employee_id == Employee.id)
-                .filter(Employee.employee_id_number == employee_id_number)
-        )
     time_entries = te_q.all()
 
     # โครงข้อมูลผลลัพธ์
@@ -747,11 +1373,10 @@ def build_daily_report(
         key = (emp_id, d)
         if key not in report:
             emp = emp_by_id.get(emp_id)
-            full_name = (f"{getattr(emp,'first_name','') or ''} {getattr(emp,'last_name','') or ''}").strip() if emp else ""
             report[key] = {
                 "employee_id": emp_id,
-                "employee_id_number": getattr(emp, "employee_id_number", None),
-                "full_name": full_name,
+                "employee_id_number": emp.code if emp else None,
+                "full_name": emp.full_name if emp else "",
                 "date": d.isoformat(),
                 "check_in_time": None,
                 "check_out_time": None,
@@ -797,28 +1422,23 @@ def build_daily_report(
         lr_q = (
             db.query(LeaveRequest)
             .filter(
+                LeaveRequest.employee_id.in_(emp_ids),
                 LeaveRequest.status.in_(approved_leave_vals),
                 LeaveRequest.start_date <= end_dt,
                 LeaveRequest.end_date >= start_dt,
             )
         )
-        if employee_id_number:
-            lr_q = (
-                lr_q.join(Employee, LeaveRequest.employee_id == Employee.id)
-                    .filter(Employee.employee_id_number == employee_id_number)
-            )
 
-        for lr in lr_q.all():
-            s = max(lr.start_date, start_dt)
-            e = min(lr.end_date,   end_dt)
-            for d in _dr_daterange(s.date(), e.date()):
-                segs = _dr_day_segments(db, lr.employee_id, d)
-                frac = _dr_leave_fraction_on_day(s, e, d, segs)
-                if not frac:
+        # ใช้ตัวคำนวณเดียวกับการหักยอด -> รายงานกับ balance ตรงกัน
+        lrs = lr_q.all()
+        fracs = leave_day_fractions(db, [(lr.employee_id, lr.start_date, lr.end_date) for lr in lrs])
+        for lr, days in zip(lrs, fracs):
+            lt_name = lt_id2name.get(lr.leave_type_id, f"Leave#{lr.leave_type_id}")
+            for d, frac in days:
+                if d < date_from or d > date_to:
                     continue
                 row = ensure_row(lr.employee_id, d)
-                row["is_workday"] = row["is_workday"] or bool(segs)
-                lt_name = lt_id2name.get(lr.leave_type_id, f"Leave#{lr.leave_type_id}")
+                row["is_workday"] = row["is_workday"] or bool(_dr_day_segments(db, lr.employee_id, d))
                 row["leaves"][lt_name] += float(frac)
 
     # OT (Approved only) → รวมเป็นชั่วโมงตามประเภท
@@ -832,16 +1452,12 @@ def build_daily_report(
         ot_q = (
             db.query(models.OvertimeRequest)
             .filter(
+                models.OvertimeRequest.employee_id.in_(emp_ids),
                 models.OvertimeRequest.status.in_(approved_ot_vals),
                 models.OvertimeRequest.start_time <= end_dt,
                 models.OvertimeRequest.end_time >= start_dt,
             )
         )
-        if employee_id_number:
-            ot_q = (
-                ot_q.join(Employee, models.OvertimeRequest.employee_id == Employee.id)
-                    .filter(Employee.employee_id_number == employee_id_number)
-            )
 
         for req in ot_q.all():
             # เฉลี่ยลง “วันของช่วงที่ทับกับหน้ารายงาน” แบบง่าย: ลงวันที่เริ่มทับ
@@ -867,6 +1483,87 @@ def build_daily_report(
     out.sort(key=lambda x: (x["employee_id"], x["date"]))
     return out
 
+def _daily_report_employee_ids(
+    db: Session,
+    employee_id_number: Optional[str],
+    after_id: Optional[int],
+    limit: int,
+) -> list[int]:
+    """employee id ของชุดถัดไป (keyset) — ใช้ตัดสินจบข้อมูล / cursor
+       ข้อมูลแสดงผลเติมจาก directory cache ตอนสร้างแถว (_daily_report_batch)"""
+    q = db.query(Employee.id)
+    if employee_id_number:
+        q = q.filter(Employee.employee_id_number == employee_id_number)
+    if after_id is not None:
+        q = q.filter(Employee.id > after_id)
+    return [i for (i,) in q.order_by(Employee.id.asc()).limit(limit).all()]
+
+def iter_daily_report(
+    db: Session,
+    date_from: date,
+    date_to: date,
+    employee_id_number: Optional[str] = None,
+    include_leaves: bool = True,
+    include_ot: bool = True,
+    after_employee_id: Optional[int] = None,
+    batch_size: Optional[int] = None,
+) -> Iterable[dict]:
+    """yield แถวรายงานทีละชุดพนักงาน (เรียง employee_id, date) — ไม่ถือทั้งรายงานไว้ในหน่วยความจำ"""
+    batch_size = max(1, batch_size or REPORT_EMP_BATCH)
+    lt_id2name, ot_id2name = _daily_report_masters(db)
+    last_id = after_employee_id
+    while True:
+        ids = _daily_report_employee_ids(db, employee_id_number, last_id, batch_size)
+        if not ids:
+            return
+        yield from _daily_report_batch(
+            db, ids, date_from, date_to, lt_id2name, ot_id2name,
+            include_leaves=include_leaves, include_ot=include_ot,
+        )
+        if len(ids) < batch_size:
+            return
+        last_id = ids[-1]
+
+def page_daily_report(
+    db: Session,
+    date_from: date,
+    date_to: date,
+    employee_id_number: Optional[str] = None,
+    include_leaves: bool = True,
+    include_ot: bool = True,
+    cursor: Optional[int] = None,
+    limit: int = 50,
+) -> dict:
+    """แบ่งหน้าตามพนักงาน: cursor = employee_id สุดท้ายของหน้าก่อน"""
+    limit = max(1, limit)
+    ids = _daily_report_employee_ids(db, employee_id_number, cursor, limit + 1)
+    has_more = len(ids) > limit
+    ids = ids[:limit]
+    lt_id2name, ot_id2name = _daily_report_masters(db)
+    items = _daily_report_batch(
+        db, ids, date_from, date_to, lt_id2name, ot_id2name,
+        include_leaves=include_leaves, include_ot=include_ot,
+    )
+    return {
+        "items": items,
+        "next_cursor": ids[-1] if (has_more and ids) else None,
+    }
+
+def build_daily_report(
+    db: Session,
+    date_from: date,
+    date_to: date,
+    employee_id_number: Optional[str] = None,
+    include_leaves: bool = True,
+    include_ot: bool = True,
+) -> List[dict]:
+    return list(iter_daily_report(
+        db, date_from, date_to,
+        employee_id_number=employee_id_number,
+        include_leaves=include_leaves,
+        include_ot=include_ot,
+    ))
+
 # =====================================================================
 # Working Schedule CRUD
 # =====================================================================
@@ -874,7 +1571,9 @@ def build_daily_report(
 def create_working_schedule(db: Session, schedule: schemas.WorkingScheduleCreate):
     obj = models.WorkingSchedule(**schedule.model_dump())
     db.add(obj)
+    _mark_schedule_dirty(db, obj)
     db.commit()
+    invalidate_schedule_cache()
     db.refresh(obj)
     return obj
 
@@ -888,9 +1587,12 @@ def update_working_schedule(db: Session, schedule_id: int, schedule_update: sche
     obj = get_working_schedule(db, schedule_id)
     if not obj:
         return None
+    _mark_schedule_dirty(db, obj)
     for k, v in schedule_update.model_dump(exclude_unset=True).items():
         setattr(obj, k, v)
+    _mark_schedule_dirty(db, obj)
     db.commit()
+    invalidate_schedule_cache()
     db.refresh(obj)
     return obj
 
@@ -898,8 +1600,10 @@ def delete_working_schedule(db: Session, schedule_id: int):
     obj = get_working_schedule(db, schedule_id)
     if not obj:
         return None
+    _mark_schedule_dirty(db, obj)
     db.delete(obj)
     db.commit()
+    invalidate_schedule_cache()
     return {"message": "ตารางเวลาทำงานถูกลบแล้ว"}
 
 # =====================================================================
@@ -909,6 +1613,7 @@ def delete_working_schedule(db: Session, schedule_id: int):
 def create_time_entry(db: Session, time_entry: schemas.TimeEntryCreate):
     obj = models.TimeEntry(**time_entry.model_dump())
     db.add(obj)
+    mark_attendance_dirty(db, obj.employee_id, obj.check_in_time)
     db.commit()
     db.refresh(obj)
     return obj
@@ -934,8 +1639,10 @@ def update_time_entry(db: Session, entry_id: int, time_entry_update: schemas.Tim
     obj = get_time_entry(db, entry_id)
     if not obj:
         return None
+    mark_attendance_dirty(db, obj.employee_id, obj.check_in_time)
     for k, v in time_entry_update.model_dump(exclude_unset=True).items():
         setattr(obj, k, v)
+    mark_attendance_dirty(db, obj.employee_id, obj.check_in_time)
     db.commit()
     db.refresh(obj)
     return obj
@@ -944,6 +1651,7 @@ def delete_time_entry(db: Session, entry_id: int):
     obj = get_time_entry(db, entry_id)
     if not obj:
         return None
+    mark_attendance_dirty(db, obj.employee_id, obj.check_in_time)
     db.delete(obj)
     db.commit()
     return {"message": "บันทึกเวลาถูกลบแล้ว"}
@@ -1012,12 +1720,79 @@ def check_for_overlapping_leave(
             detail=f"An overlapping leave request (ID: {overlap.id}) already exists for this period.",
         )
 
+# ---- Bulk overlap check (ทั้งชุดเทียบ DB + เทียบกันเอง) ----
+
+def _raise_conflicts(conflicts: dict, label: str) -> None:
+    if not conflicts:
+        return
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail={
+            "message": f"Overlapping {label} in batch ({len(conflicts)} item(s)).",
+            "conflicts": [c._asdict() for _, c in sorted(conflicts.items())],
+        },
+    )
+
+def _check_batch_intervals(items: list, start_attr: str, end_attr: str) -> list[tuple[int, datetime, datetime]]:
+    out = []
+    for i, it in enumerate(items):
+        s, e = getattr(it, start_attr), getattr(it, end_attr)
+        if e <= s:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Item #{i}: {end_attr} must be after {start_attr}.",
+            )
+        out.append((it.employee_id, s, e))
+    return out
+
+def _existing_leave_intervals(db: Session, proposed: list) -> list[tuple]:
+    keys, lo, hi = span_of(proposed)
+    LR = models.LeaveRequest
+    return (
+        db.query(LR.employee_id, LR.start_date, LR.end_date, LR.id)
+        .filter(
+            LR.employee_id.in_(keys),
+            LR.status.in_([models.LeaveStatus.PENDING, models.LeaveStatus.APPROVED]),
+            LR.start_date < hi,
+            LR.end_date > lo,
+        )
+        .all()
+    )
+
+def create_leave_requests_bulk(db: Session, leave_requests: List[schemas.LeaveRequestCreate]):
+    """สร้างคำขอลาหลายรายการ: ตรวจทับซ้อนทั้งชุดครั้งเดียว แล้ว commit ครั้งเดียว (all-or-nothing)"""
+    if not leave_requests:
+        return []
+    proposed = _check_batch_intervals(leave_requests, "start_date", "end_date")
+    _raise_conflicts(find_conflicts(proposed, _existing_leave_intervals(db, proposed)), "leave requests")
+
+    _ensure_enough_balance_many(db, [
+        (lr.employee_id, lr.leave_type_id, lr.start_date, lr.end_date)
+        for lr in leave_requests
+        if _leave_status_of(getattr(lr, "status", None)) == LeaveStatus.APPROVED
+    ])
+
+    now = datetime.utcnow()
+    objs = [models.LeaveRequest(**lr.model_dump(), request_date=now) for lr in leave_requests]
+    db.add_all(objs)
+    db.flush()
+    for obj in objs:
+        mark_attendance_dirty(db, obj.employee_id, obj.start_date, obj.end_date)
+        _post_request_usage(db, obj.employee_id, obj.leave_type_id, obj.start_date, obj.end_date,
+                            obj.status, request_id=obj.id, kind="create")
+    db.commit()
+
+    for obj in objs:
+        db.refresh(obj)
+        obj.num_days = (obj.end_date - obj.start_date).total_seconds() / (8 * 3600)
+    return objs
+
 def create_leave_request(db: Session, leave_request: schemas.LeaveRequestCreate):
     check_for_overlapping_leave(
         db, leave_request.employee_id, leave_request.start_date, leave_request.end_date
     )
 
-    if str(getattr(leave_request, "status", "Pending")).lower() == "approved":
+    if _leave_status_of(getattr(leave_request, "status", None)) == LeaveStatus.APPROVED:
         _ensure_enough_balance(
             db,
             leave_request.employee_id,
@@ -1028,11 +1803,12 @@ def create_leave_request(db: Session, leave_request: schemas.LeaveRequestCreate)
 
     obj = models.LeaveRequest(**leave_request.model_dump(), request_date=datetime.utcnow())
     db.add(obj)
+    db.flush()
+    mark_attendance_dirty(db, obj.employee_id, obj.start_date, obj.end_date)
+    _post_request_usage(db, obj.employee_id, obj.leave_type_id, obj.start_date, obj.end_date,
+                        obj.status, request_id=obj.id, kind="create")
     db.commit()
     db.refresh(obj)
-
-    if str(obj.status).lower() == "approved":
-        _apply_usage(db, obj.employee_id, obj.leave_type_id, obj.start_date, obj.end_date, +1)
     return obj
 
 def get_leave_request(db: Session, request_id: int):
@@ -1065,7 +1841,7 @@ def update_leave_request(db: Session, request_id: int, leave_request_update: sch
     if not obj:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Leave request not found")
 
-    old_status = str(obj.status).lower()
+    old_status = _leave_status_of(obj.status)
     old_start, old_end = obj.start_date, obj.end_date
     old_type, old_emp = obj.leave_type_id, obj.employee_id
 
@@ -1079,39 +1855,33 @@ def update_leave_request(db: Session, request_id: int, leave_request_update: sch
         existing_request_id=request_id,
     )
 
-    new_status = str(data.get("status", obj.status)).lower()
+    new_status = _leave_status_of(data.get("status", obj.status))
     new_start = data.get("start_date", obj.start_date)
     new_end = data.get("end_date", obj.end_date)
     new_type = data.get("leave_type_id", obj.leave_type_id)
     new_emp = data.get("employee_id", obj.employee_id)
 
-    if new_status == "approved":
+    changed = (old_status, old_start, old_end, old_type, old_emp) != (
+        new_status, new_start, new_end, new_type, new_emp
+    )
+
+    # ถอนผลเดิมออกก่อน แล้วค่อยตรวจสิทธิ์ของค่าใหม่ (กันนับยอดตัวเองซ้ำ)
+    if changed:
+        _reverse_request_usage(db, obj, kind="update")
+    if new_status == LeaveStatus.APPROVED:
+        db.flush()
         _ensure_enough_balance(db, new_emp, new_type, new_start, new_end)
 
+    mark_attendance_dirty(db, old_emp, old_start, old_end)
     for k, v in data.items():
         setattr(obj, k, v)
+    mark_attendance_dirty(db, obj.employee_id, obj.start_date, obj.end_date)
+    if changed:
+        _post_request_usage(db, obj.employee_id, obj.leave_type_id, obj.start_date, obj.end_date,
+                            obj.status, request_id=obj.id, kind="update")
     db.commit()
     db.refresh(obj)
 
-    cur_status = str(obj.status).lower()
-
-    if old_status == "approved" and cur_status != "approved":
-        _apply_usage(db, old_emp, old_type, old_start, old_end, -1)
-
-    if old_status != "approved" and cur_status == "approved":
-        _apply_usage(db, obj.employee_id, obj.leave_type_id, obj.start_date, obj.end_date, +1)
-
-    if old_status == "approved" and cur_status == "approved":
-        if (old_start, old_end, old_type, old_emp) != (
-            obj.start_date,
-            obj.end_date,
-            obj.leave_type_id,
-            obj.employee_id,
-        ):
-            _apply_usage(db, old_emp, old_type, old_start, old_end, -1)
-            _ensure_enough_balance(db, obj.employee_id, obj.leave_type_id, obj.start_date, obj.end_date)
-            _apply_usage(db, obj.employee_id, obj.leave_type_id, obj.start_date, obj.end_date, +1)
-
     delta = obj.end_date - obj.start_date
     obj.num_days = delta.total_seconds() / (8 * 3600)
     return obj
@@ -1120,6 +1890,8 @@ def delete_leave_request(db: Session, request_id: int):
     obj = get_leave_request(db, request_id)
     if not obj:
         return None
+    mark_attendance_dirty(db, obj.employee_id, obj.start_date, obj.end_date)
+    _reverse_request_usage(db, obj, kind="delete")
     db.delete(obj)
     db.commit()
     return {"message": "คำขอลาถูกลบแล้ว"}
@@ -1194,6 +1966,79 @@ def _policy_from_schedule(sch) -> dict:
         "is_workday": bool(is_working),
     }
 
+def _att_result(status_code: str, work_minutes: int = 0, is_paid_leave: bool = False, **extra) -> dict:
+    out = dict(
+        status_code=status_code,
+        late_minutes=0,
+        early_leave_minutes=0,
+        work_minutes=work_minutes,
+        is_paid_leave=is_paid_leave,
+        ot_weekday_minutes=0,
+        ot_holiday_minutes=0,
+    )
+    out.update(extra)
+    return out
+
+def _leave_is_paid(lt) -> bool:
+    is_paid = True
+    try:
+        if hasattr(lt, "is_paid_leave"):
+            is_paid = bool(lt.is_paid_leave)
+        elif hasattr(lt, "is_paid"):
+            is_paid = bool(lt.is_paid)
+    except Exception:
+        pass
+    return is_paid
+
+def _classify_from(day: date, lr, lt, policy: Optional[dict], te, is_holiday: bool = False) -> Optional[dict]:
+    """จัดสถานะของ (พนักงาน, วัน) จากข้อมูลที่โหลดมาแล้ว (ไม่แตะ DB)
+       lr = ใบลาอนุมัติที่ครอบวันนั้น, lt = LeaveType ของใบลา,
+       policy = ผลของ _policy_from_schedule (None = ไม่มีตาราง), te = TimeEntry แรกของวัน"""
+    # Leave (อนุมัติ) — วันลาไม่คิด OT
+    if lr:
+        return _att_result(AttendanceStatus.LEAVE.value, is_paid_leave=_leave_is_paid(lt))
+
+    # วันหยุด -> ข้ามไม่สร้างแถว (ไม่ถือเป็นขาดงาน/ลา)
+    if is_holiday:
+        return None
+
+    if not policy or not policy["is_workday"]:
+        return None
+
+    if not te:
+        return _att_result(AttendanceStatus.ABSENCE.value)
+
+    start_dt = datetime.combine(day, policy["start_time"])
+    end_dt = datetime.combine(day, policy["end_time"])
+    ci = te.check_in_time or start_dt
+    co = te.check_out_time or ci
+    if co < ci:
+        co = ci
+
+    raw_late = max(0, int((ci - start_dt).total_seconds() // 60))
+    late_minutes = max(0, raw_late - policy["late_grace_min"])
+    raw_early = max(0, int((end_dt - co).total_seconds() // 60))
+    early_leave_minutes = max(0, raw_early - policy["early_leave_grace_min"])
+    work_minutes = max(0, int((co - ci).total_seconds() // 60) - policy["break_minutes"])
+
+    if work_minutes < policy["absence_after_min"]:
+        return _att_result(AttendanceStatus.ABSENCE.value, work_minutes=work_minutes)
+
+    # OT วันทำงาน (นับเกินเวลาออก)
+    ot_weekday_minutes = 0
+    if te and co and co > end_dt:
+        ot_weekday_minutes = max(0, int((co - end_dt).total_seconds() // 60))
+
+    status_code = AttendanceStatus.LATE.value if late_minutes > 0 else AttendanceStatus.PRESENT.value
+    return _att_result(
+        status_code,
+        work_minutes=work_minutes,
+        is_paid_leave=True,
+        late_minutes=late_minutes,
+        early_leave_minutes=early_leave_minutes,
+        ot_weekday_minutes=ot_weekday_minutes,
+    )
+
 def _classify_attendance_for_day(db: Session, employee_id: int, day: date) -> Optional[dict]:
     # Leave (อนุมัติ)
     lr = (
@@ -1205,31 +2050,18 @@ def _classify_attendance_for_day(db: Session, employee_id: int, day: date) -> Op
         .first()
     )
     if lr:
-        # วันลาไม่คิด OT
-        is_paid = True
         try:
             lt = db.query(models.LeaveType).get(lr.leave_type_id)
-            if hasattr(lt, "is_paid_leave"):
-                is_paid = bool(lt.is_paid_leave)
-            elif hasattr(lt, "is_paid"):
-                is_paid = bool(lt.is_paid)
         except Exception:
-            pass
-        return dict(
-            status_code=AttendanceStatus.LEAVE.value,
-            late_minutes=0,
-            early_leave_minutes=0,
-            work_minutes=0,
-            is_paid_leave=is_paid,
-            ot_weekday_minutes=0,
-            ot_holiday_minutes=0,
-        )
+            lt = None
+        return _classify_from(day, lr, lt, None, None)
 
-    sch = _get_schedule_for_day(db, employee_id, day)
-    if not sch:
+    if _is_holiday(db, day):
         return None
-    policy = _policy_from_schedule(sch)
-    if not policy["is_workday"]:
+
+    rs = resolve_schedule(db, employee_id, day)
+    policy = rs.policy if rs else None
+    if not policy or not policy["is_workday"]:
         return None
 
     # time entry ของวันนั้น
@@ -1242,59 +2074,180 @@ def _classify_attendance_for_day(db: Session, employee_id: int, day: date) -> Op
         .filter(models.TimeEntry.check_in_time < day_end)
         .first()
     )
-    if not te:
-        return dict(
-            status_code=AttendanceStatus.ABSENCE.value,
-            late_minutes=0,
-            early_leave_minutes=0,
-            work_minutes=0,
-            is_paid_leave=False,
-            ot_weekday_minutes=0,
-            ot_holiday_minutes=0,
-        )
+    return _classify_from(day, None, None, policy, te)
+
+# ---- Set-based rebuild ----
+# โหลดข้อมูลทั้งช่วงครั้งเดียว (ใบลา/ตาราง/เวลาเข้าออก) แล้วจัดสถานะทุกช่องในหน่วยความจำ
+
+def _leave_days_covered(lr, start: date, end: date) -> Iterable[date]:
+    """วันที่ใบลา 'ครอบ' ตามเงื่อนไขเดิม start_date <= วัน(00:00) <= end_date"""
+    first = lr.start_date.date()
+    if lr.start_date > datetime.combine(first, time.min):
+        first += timedelta(days=1)
+    d = max(first, start)
+    last = min(lr.end_date.date(), end)
+    while d <= last:
+        yield d
+        d += timedelta(days=1)
+
+# ---- Working-schedule cache ----
+# (employee_id | None=template, DayOfWeek) -> ResolvedSchedule (policy + segments แบบ frozen)
+# โหลดตาราง active ทั้งหมดครั้งเดียว; ล้างเมื่อมีการแก้ WorkingSchedule (และหมดอายุตาม TTL กันหลาย process)
+
+ATT_SCHEDULE_CACHE_TTL = _env_int("ATT_SCHEDULE_CACHE_TTL_SEC", 300)
+
+@dataclass(frozen=True)
+class ResolvedSchedule:
+    schedule_id: int
+    policy: Mapping[str, Any]
+    segments: Tuple[Tuple[time, time], ...]
+    break_override_minutes: int
+
+_schedule_cache: dict = {"index": None, "loaded_at": 0.0}
+
+def invalidate_schedule_cache() -> None:
+    _schedule_cache["index"] = None
+
+def _schedule_sort_key(ws):
+    # ORDER BY is_default DESC (NULL ท้ายสุด), id ASC — เหมือน _get_schedule_for_day
+    return (0 if ws.is_default else (1 if ws.is_default is not None else 2), ws.id)
+
+def _resolve(ws) -> ResolvedSchedule:
+    pol = _policy_from_schedule(ws)
+    return ResolvedSchedule(
+        schedule_id=ws.id,
+        policy=MappingProxyType(pol),
+        segments=tuple(_schedule_segments(ws, pol)),
+        break_override_minutes=_break_override_of(ws),
+    )
 
-    start_dt = datetime.combine(day, policy["start_time"])
-    end_dt = datetime.combine(day, policy["end_time"])
-    ci = te.check_in_time or start_dt
-    co = te.check_out_time or ci
-    if co < ci:
-        co = ci
+def _schedule_index(db: Session) -> dict:
+    idx = _schedule_cache["index"]
+    if idx is not None and (_time.monotonic() - _schedule_cache["loaded_at"]) < ATT_SCHEDULE_CACHE_TTL:
+        return idx
 
-    raw_late = max(0, int((ci - start_dt).total_seconds() // 60))
-    late_minutes = max(0, raw_late - policy["late_grace_min"])
-    raw_early = max(0, int((end_dt - co).total_seconds() // 60))
-    early_leave_minutes = max(0, raw_early - policy["early_leave_grace_min"])
-    work_minutes = max(0, int((co - ci).total_seconds() // 60) - policy["break_minutes"])
+    grouped: DefaultDict[tuple, list] = defaultdict(list)
+    for ws in db.query(models.WorkingSchedule).filter(models.WorkingSchedule.is_active == True).all():
+        grouped[(ws.employee_id, ws.day_of_week)].append(ws)
+    idx = {k: _resolve(min(v, key=_schedule_sort_key)) for k, v in grouped.items()}
 
-    if work_minutes < policy["absence_after_min"]:
-        return dict(
-            status_code=AttendanceStatus.ABSENCE.value,
-            late_minutes=0,
-            early_leave_minutes=0,
-            work_minutes=work_minutes,
-            is_paid_leave=False,
-            ot_weekday_minutes=0,
-            ot_holiday_minutes=0,
-        )
+    _schedule_cache["index"] = idx
+    _schedule_cache["loaded_at"] = _time.monotonic()
+    return idx
 
-    # OT วันทำงาน (นับเกินเวลาออก)
-    ot_weekday_minutes = 0
-    if te and co and co > end_dt:
-        ot_weekday_minutes = max(0, int((co - end_dt).total_seconds() // 60))
+def resolve_schedule(db: Session, employee_id: Optional[int], day: date) -> Optional[ResolvedSchedule]:
+    """ตารางที่มีผลกับพนักงานในวันนั้น (ของพนักงานก่อน ถ้าไม่มีใช้ template) — ไม่ query ถ้า cache อุ่นแล้ว"""
+    idx = _schedule_index(db)
+    dow = _WEEKDAY_TO_DOW[day.weekday()]
+    return idx.get((employee_id, dow)) or idx.get((None, dow))
 
-    status_code = AttendanceStatus.LATE.value if late_minutes > 0 else AttendanceStatus.PRESENT.value
-    return dict(
-        status_code=status_code,
-        late_minutes=late_minutes,
-        early_leave_minutes=early_leave_minutes,
-        work_minutes=work_minutes,
-        is_paid_leave=True,
-        ot_weekday_minutes=ot_weekday_minutes,
-        ot_holiday_minutes=0,
+def _load_attendance_inputs(db: Session, start: date, end: date, employee_ids: Optional[list[int]]) -> dict:
+    range_start = datetime.combine(start, time.min)
+    range_end = datetime.combine(end, time.min)
+
+    # ใบลาอนุมัติที่คาบเกี่ยวช่วง -> (emp, day) -> ใบลา (id น้อยสุด)
+    q_lr = (
+        db.query(models.LeaveRequest)
+        .filter(models.LeaveRequest.status == models.LeaveStatus.APPROVED)
+        .filter(models.LeaveRequest.start_date <= range_end)
+        .filter(models.LeaveRequest.end_date >= range_start)
+    )
+    if employee_ids is not None:
+        q_lr = q_lr.filter(models.LeaveRequest.employee_id.in_(employee_ids))
+    leave_by_cell: dict[tuple[int, date], object] = {}
+    for lr in q_lr.order_by(models.LeaveRequest.id.asc()).all():
+        for d in _leave_days_covered(lr, start, end):
+            leave_by_cell.setdefault((lr.employee_id, d), lr)
+
+    leave_types = {lt.id: lt for lt in db.query(models.LeaveType).all()} if leave_by_cell else {}
+
+    # time entry แรก (id น้อยสุด) ของแต่ละ (emp, day)
+    q_te = (
+        db.query(models.TimeEntry)
+        .filter(models.TimeEntry.check_in_time >= range_start)
+        .filter(models.TimeEntry.check_in_time < range_end + timedelta(days=1))
     )
+    if employee_ids is not None:
+        q_te = q_te.filter(models.TimeEntry.employee_id.in_(employee_ids))
+    entry_by_cell: dict[tuple[int, date], object] = {}
+    for te in q_te.order_by(models.TimeEntry.id.asc()).all():
+        entry_by_cell.setdefault((te.employee_id, te.check_in_time.date()), te)
+
+    return {
+        "leave_by_cell": leave_by_cell,
+        "leave_types": leave_types,
+        "entry_by_cell": entry_by_cell,
+    }
+
+def _attendance_payload(employee_id: int, day: date, res: dict) -> dict:
+    status_code = res.get("status_code", AttendanceStatus.PRESENT.value)
+    work_minutes = int(res.get("work_minutes", 0) or 0)
+    late_minutes = int(res.get("late_minutes", 0) or 0)
+    early_leave_minutes = int(res.get("early_leave_minutes", 0) or 0)
+    is_paid_leave = bool(res.get("is_paid_leave", True))
+    ot_wd = int(res.get("ot_weekday_minutes", 0) or 0)
+    ot_hol = int(res.get("ot_holiday_minutes", 0) or 0)
+
+    if status_code == AttendanceStatus.ABSENCE.value:
+        late_minutes = 0
+        early_leave_minutes = 0
+        ot_wd = 0
+        ot_hol = 0
+
+    payload = {
+        "employee_id": employee_id,
+        "day": day,
+        "status_code": status_code,
+        "work_minutes": work_minutes,
+        "late_minutes": late_minutes,
+        "early_leave_minutes": early_leave_minutes,
+        "is_paid_leave": is_paid_leave,
+    }
+    if "ot_weekday_minutes" in AttendanceDaily.__table__.c:
+        payload["ot_weekday_minutes"] = ot_wd
+    if "ot_holiday_minutes" in AttendanceDaily.__table__.c:
+        payload["ot_holiday_minutes"] = ot_hol
+    return payload
+
+def _classify_cells(
+    db: Session, cells: Iterable[tuple[int, date]], start: date, end: date,
+    employee_ids: Optional[list[int]], debug: bool = False,
+) -> list[dict]:
+    """จัดสถานะทุก (employee_id, day) ใน cells โดยใช้ข้อมูลที่ preload ไว้ -> payload ของ AttendanceDaily"""
+    inp = _load_attendance_inputs(db, start, end, employee_ids)
+    leave_by_cell = inp["leave_by_cell"]
+    leave_types = inp["leave_types"]
+    entry_by_cell = inp["entry_by_cell"]
+    holidays = holiday_dates(db, start, end)
+
+    payloads: list[dict] = []
+    for emp_id, day in cells:
+        lr = leave_by_cell.get((emp_id, day))
+        policy = None
+        if not lr:
+            rs = resolve_schedule(db, emp_id, day)
+            policy = rs.policy if rs else None
+        res = _classify_from(
+            day, lr, leave_types.get(lr.leave_type_id) if lr else None,
+            policy, entry_by_cell.get((emp_id, day)), is_holiday=day in holidays,
+        )
+
+        if debug:
+            if res:
+                print(
+                    f"[ATT] emp={emp_id} day={day} status={res.get('status_code')} "
+                    f"work={res.get('work_minutes', 0)} late={res.get('late_minutes', 0)} "
+                    f"early={res.get('early_leave_minutes', 0)}"
+                )
+            else:
+                print(f"[ATT] emp={emp_id} day={day} status=SKIP (holiday / no schedule / non-working day)")
+
+        if res:
+            payloads.append(_attendance_payload(emp_id, day, res))
+    return payloads
 
 def rebuild_attendance_range(
-    db: Session, start: date, end: date, employee_id: Optional[int] = None, debug: bool = True
+    db: Session, start: date, end: date, employee_id: Optional[int] = None, debug: bool = False
 ):
     # ลบข้อมูลเดิมในช่วง
     q_del = db.query(AttendanceDaily).filter(AttendanceDaily.day >= start, AttendanceDaily.day <= end)
@@ -1303,85 +2256,219 @@ def rebuild_attendance_range(
     q_del.delete(synchronize_session=False)
 
     # เลือกพนักงาน
-    q_emp = db.query(Employee)
+    q_emp = db.query(Employee.id)
     if employee_id:
         q_emp = q_emp.filter(Employee.id == employee_id)
-    employees = q_emp.all()
-
-    cur = start
-    while cur <= end:
-        for emp in employees:
-            res = _classify_attendance_for_day(db, emp.id, cur)
-
-            if debug:
-                if res:
-                    print(
-                        f"[ATT] emp={emp.id} day={cur} status={res.get('status_code')} "
-                        f"work={res.get('work_minutes', 0)} late={res.get('late_minutes', 0)} "
-                        f"early={res.get('early_leave_minutes', 0)}"
-                    )
-                else:
-                    print(f"[ATT] emp={emp.id} day={cur} status=SKIP (no schedule / non-working day)")
-
-            if not res:
-                continue
+    emp_ids = [eid for (eid,) in q_emp.order_by(Employee.id).all()]
 
-            status_code = res.get("status_code", AttendanceStatus.PRESENT.value)
-            work_minutes = int(res.get("work_minutes", 0) or 0)
-            late_minutes = int(res.get("late_minutes", 0) or 0)
-            early_leave_minutes = int(res.get("early_leave_minutes", 0) or 0)
-            is_paid_leave = bool(res.get("is_paid_leave", True))
-            ot_wd = int(res.get("ot_weekday_minutes", 0) or 0)
-            ot_hol = int(res.get("ot_holiday_minutes", 0) or 0)
-
-            if status_code == AttendanceStatus.ABSENCE.value:
-                late_minutes = 0
-                early_leave_minutes = 0
-                ot_wd = 0
-                ot_hol = 0
-
-            payload = {
-                "employee_id": emp.id,
-                "day": cur,
-                "status_code": status_code,
-                "work_minutes": work_minutes,
-                "late_minutes": late_minutes,
-                "early_leave_minutes": early_leave_minutes,
-                "is_paid_leave": is_paid_leave,
-            }
-            if "ot_weekday_minutes" in AttendanceDaily.__table__.c:
-                payload["ot_weekday_minutes"] = ot_wd
-            if "ot_holiday_minutes" in AttendanceDaily.__table__.c:
-                payload["ot_holiday_minutes"] = ot_hol
+    days = list(_dr_daterange(start, end))
+    cells = ((eid, d) for d in days for eid in emp_ids)
+    payloads = _classify_cells(db, cells, start, end, [employee_id] if employee_id else None, debug=debug)
+    if payloads:
+        db.bulk_insert_mappings(AttendanceDaily, payloads)
 
-            db.add(AttendanceDaily(**payload))
+    refresh_attendance_monthly(db, _months_between(start, end), [employee_id] if employee_id else None)
+    db.commit()
 
-        cur += timedelta(days=1)
+# ---- Incremental recompute (dirty cells) ----
+# การเขียน TimeEntry / LeaveRequest / OT / WorkingSchedule / Holiday จะ mark ช่อง (emp, day) ไว้
+# แล้ว recompute_dirty_attendance() จัดสถานะใหม่เฉพาะช่องเหล่านั้น (worker เบื้องหลัง + ก่อนอ่าน metrics)
 
-    db.commit()
+ATT_DIRTY_SCHEDULE_DAYS  = _env_int("ATT_DIRTY_SCHEDULE_DAYS", 62)
+ATT_RECOMPUTE_INTERVAL   = _env_int("ATT_RECOMPUTE_INTERVAL_SEC", 30)
+ATT_RECOMPUTE_WORKER     = getenv("ATT_RECOMPUTE_WORKER", "1") not in ("0", "false", "False")
+_recompute_lock = threading.Lock()
+_DIRTY_DELETE_CHUNK = 900  # ต่ำกว่าเพดานตัวแปรของ SQLite
 
-# ---- OT fallback helpers (ใช้ใน metrics) ----
+def _as_date(v) -> Optional[date]:
+    if v is None:
+        return None
+    return v.date() if isinstance(v, datetime) else v
 
-def _get_break_override_minutes(db: Session, employee_id: int, weekday: int) -> int:
-    """
-    คืนค่านาทีพักจาก WorkingSchedule ของวันในสัปดาห์นั้น (0=Mon..6=Sun)
-    เลือกของพนักงานก่อน ถ้าไม่มีใช้ template (employee_id is NULL)
-    """
+def mark_attendance_dirty(db: Session, employee_id: Optional[int], start, end=None) -> None:
+    """mark ช่วงวัน [start, end] ของพนักงาน (None = ทุกคน) ว่าต้องคำนวณใหม่ — ไม่ commit"""
+    d1 = _as_date(start)
+    d2 = _as_date(end) or d1
+    if d1 is None:
+        return
+    if d2 < d1:
+        d1, d2 = d2, d1
+    rows = [{"employee_id": employee_id, "day": d} for d in _dr_daterange(d1, d2)]
+    if rows:
+        db.bulk_insert_mappings(models.AttendanceDirty, rows)
+
+def _mark_cells_dirty(db: Session, cells: Iterable[tuple[Optional[int], date]]) -> None:
+    rows = [{"employee_id": emp_id, "day": d} for emp_id, d in cells]
+    if rows:
+        db.bulk_insert_mappings(models.AttendanceDirty, rows)
+
+def _mark_schedule_dirty(db: Session, ws) -> None:
+    """ตารางเปลี่ยน -> mark วันในสัปดาห์นั้นย้อนหลัง ATT_DIRTY_SCHEDULE_DAYS วัน"""
+    if ws is None or ws.day_of_week is None:
+        return
     try:
-        WS = getattr(models, "WorkingSchedule")
-    except Exception:
-        return 0
-
-    q = (
-        db.query(WS)
-        .filter(WS.is_active == True, WS.day_of_week == weekday)
-        .filter(or_(WS.employee_id == employee_id, WS.employee_id == None))
-        .order_by(WS.employee_id.desc())
+        dow = ws.day_of_week if isinstance(ws.day_of_week, DayOfWeek) else DayOfWeek(ws.day_of_week)
+    except ValueError:
+        dow = DayOfWeek[str(ws.day_of_week).upper()]
+    today = date.today()
+    start = today - timedelta(days=ATT_DIRTY_SCHEDULE_DAYS)
+    _mark_cells_dirty(
+        db,
+        ((ws.employee_id, d) for d in _dr_daterange(start, today) if _WEEKDAY_TO_DOW[d.weekday()] == dow),
     )
-    ws = q.first()
-    if not ws:
+
+def _mark_holiday_dirty(db: Session, h) -> None:
+    hd = _as_date(getattr(h, "holiday_date", None))
+    if hd is None:
+        return
+    cells = [(None, hd)]
+    if getattr(h, "is_recurring", False):
+        try:
+            cells.append((None, hd.replace(year=date.today().year)))
+        except ValueError:  # 29 ก.พ.
+            pass
+    _mark_cells_dirty(db, cells)
+
+def recompute_dirty_attendance(db: Session, limit: Optional[int] = None) -> int:
+    """จัดสถานะใหม่เฉพาะช่องที่ถูก mark แล้วลบ mark ออก; คืนจำนวนช่องที่คำนวณใหม่"""
+    Dirty = models.AttendanceDirty
+    with _recompute_lock:
+        q = db.query(Dirty.id, Dirty.employee_id, Dirty.day).order_by(Dirty.id.asc())
+        if limit:
+            q = q.limit(limit)
+        marks = q.all()
+        if not marks:
+            return 0
+
+        mark_ids = [m.id for m in marks]
+        all_days = {m.day for m in marks if m.employee_id is None}
+        emp_days: DefaultDict[date, set] = defaultdict(set)
+        for m in marks:
+            if m.employee_id is not None and m.day not in all_days:
+                emp_days[m.day].add(m.employee_id)
+
+        all_emp_ids: list[int] = []
+        if all_days:
+            all_emp_ids = [eid for (eid,) in db.query(Employee.id).order_by(Employee.id).all()]
+
+        cells: list[tuple[int, date]] = []
+        for d in sorted(all_days):
+            cells.extend((eid, d) for eid in all_emp_ids)
+        for d in sorted(emp_days):
+            cells.extend((eid, d) for eid in sorted(emp_days[d]))
+
+        try:
+            for d in all_days:
+                db.query(AttendanceDaily).filter(AttendanceDaily.day == d).delete(synchronize_session=False)
+            for d, ids in emp_days.items():
+                (db.query(AttendanceDaily)
+                   .filter(AttendanceDaily.day == d, AttendanceDaily.employee_id.in_(ids))
+                   .delete(synchronize_session=False))
+
+            if cells:
+                start = min(d for _, d in cells)
+                end = max(d for _, d in cells)
+                scope_ids = None if all_days else sorted({eid for ids in emp_days.values() for eid in ids})
+                payloads = _classify_cells(db, cells, start, end, scope_ids)
+                if payloads:
+                    db.bulk_insert_mappings(AttendanceDaily, payloads)
+
+            # rollup รายเดือนของเดือนที่แตะ
+            all_months = {_month_start(d) for d in all_days}
+            if all_months:
+                refresh_attendance_monthly(db, all_months, None)
+            emp_months: DefaultDict[date, set] = defaultdict(set)
+            for d, ids in emp_days.items():
+                m = _month_start(d)
+                if m not in all_months:
+                    emp_months[m].update(ids)
+            for m, ids in emp_months.items():
+                refresh_attendance_monthly(db, [m], ids)
+
+            # ลบเฉพาะ mark ที่อ่านมา — mark ที่ writer อื่นเพิ่มระหว่างนี้ต้องรอรอบถัดไป
+            for i in range(0, len(mark_ids), _DIRTY_DELETE_CHUNK):
+                (db.query(Dirty)
+                   .filter(Dirty.id.in_(mark_ids[i:i + _DIRTY_DELETE_CHUNK]))
+                   .delete(synchronize_session=False))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        return len(cells)
+
+def drain_dirty_attendance() -> int:
+    """recompute ช่องที่ถูก mark ใน session ของตัวเอง — ใช้ก่อนอ่าน metrics
+       (ไม่ commit บน session ของผู้เรียก; error ส่งต่อให้ผู้เรียก)"""
+    from database.connection import SessionLocal
+    with SessionLocal() as db:
+        return recompute_dirty_attendance(db)
+
+def recompute_dirty_attendance_job() -> int:
+    """ใช้กับ background task / worker (เปิด session เอง)"""
+    try:
+        return drain_dirty_attendance()
+    except Exception as e:
+        print(f"[ATT] recompute dirty cells failed: {e}")
         return 0
 
+def _acquire_job_lease(name: str, owner: str, ttl_sec: int) -> bool:
+    """รับ/ต่ออายุ lease ของงาน name; คืน True ถ้า process นี้เป็นเจ้าของ"""
+    from database.connection import SessionLocal
+
+    L = models.JobLease
+    now = datetime.utcnow()
+    expires = now + timedelta(seconds=ttl_sec)
+    with SessionLocal() as db:
+        try:
+            n = (db.query(L)
+                   .filter(L.name == name, or_(L.owner == owner, L.expires_at < now))
+                   .update({L.owner: owner, L.expires_at: expires}, synchronize_session=False))
+            if not n:
+                db.add(L(name=name, owner=owner, expires_at=expires))
+            db.commit()
+            return True
+        except IntegrityError:  # มีเจ้าของอื่นที่ยังไม่หมดอายุ
+            db.rollback()
+            return False
+        except Exception as e:
+            db.rollback()
+            print(f"[ATT] lease '{name}' failed: {e}")
+            return False
+
+def start_attendance_recompute_worker(interval_sec: Optional[int] = None) -> Optional[threading.Thread]:
+    """เริ่ม thread เบื้องหลังที่ recompute ช่องที่ถูก mark ทุก ๆ interval_sec วินาที (0 = ปิด)
+       ปิดได้ด้วย ATT_RECOMPUTE_WORKER=0; รันหลาย worker (uvicorn --workers) จะมีแค่
+       process ที่ถือ lease "attendance-recompute" ใน DB ที่ทำงานจริง"""
+    interval = ATT_RECOMPUTE_INTERVAL if interval_sec is None else interval_sec
+    if interval <= 0 or not ATT_RECOMPUTE_WORKER:
+        return None
+
+    owner = f"{socket.gethostname()}:{getpid()}:{uuid.uuid4().hex[:8]}"
+    ttl = max(interval * 3, 60)
+
+    def _loop():
+        while True:
+            _time.sleep(interval)
+            if _acquire_job_lease("attendance-recompute", owner, ttl):
+                recompute_dirty_attendance_job()
+
+    t = threading.Thread(target=_loop, name="attendance-recompute", daemon=True)
+    t.start()
+    return t
+
+# ---- OT fallback helpers (ใช้ใน metrics) ----
+
+_WEEKDAY_TO_DOW = {
+    0: DayOfWeek.MONDAY,
+    1: DayOfWeek.TUESDAY,
+    2: DayOfWeek.WEDNESDAY,
+    3: DayOfWeek.THURSDAY,
+    4: DayOfWeek.FRIDAY,
+    5: DayOfWeek.SATURDAY,
+    6: DayOfWeek.SUNDAY,
+}
+
+def _break_override_of(ws) -> int:
     for fld in ("break_override_minutes", "break_override", "break_minutes_override"):
         if hasattr(ws, fld):
             try:
@@ -1391,41 +2478,152 @@ def _get_break_override_minutes(db: Session, employee_id: int, weekday: int) ->
                 pass
     return 0
 
+def _get_break_override_minutes(db: Session, employee_id: int, weekday: int) -> int:
+    """
+    คืนค่านาทีพักจาก WorkingSchedule ของวันในสัปดาห์นั้น (0=Mon..6=Sun)
+    เลือกของพนักงานก่อน ถ้าไม่มีใช้ template (employee_id is NULL)
+    คืน 0 เสมอถ้าไม่ได้เปิด ATT_OT_DEDUCT_BREAK
+    """
+    if not ATT_OT_DEDUCT_BREAK:
+        return 0
+    idx = _schedule_index(db)
+    dow = _WEEKDAY_TO_DOW[weekday]
+    rs = idx.get((employee_id, dow)) or idx.get((None, dow))
+    return rs.break_override_minutes if rs else 0
+
+def _ot_is_holiday_type(ot_type_obj) -> bool:
+    if hasattr(ot_type_obj, "is_holiday"):
+        try:
+            if bool(getattr(ot_type_obj, "is_holiday")):
+                return True
+        except Exception:
+            pass
+    mult = getattr(ot_type_obj, "multiplier", None)
+    try:
+        if mult is not None and float(mult) >= 2.5:
+            return True
+    except Exception:
+        pass
+    name = (getattr(ot_type_obj, "name", "") or "").lower()
+    return ("holiday" in name) or ("x3" in name) or (" 3" in name) or name.strip().endswith("3")
+
+def _ot_extract_multiplier(ot_type_obj) -> float:
+    for fld in ("multiplier", "ot_multiplier", "rate", "factor"):
+        if hasattr(ot_type_obj, fld):
+            try:
+                v = getattr(ot_type_obj, fld)
+                if v is not None:
+                    fv = float(v)
+                    if fv > 0:
+                        return fv
+            except Exception:
+                pass
+    name = (getattr(ot_type_obj, "name", "") or "").strip().lower()
+    if "1.5" in name or "normal" in name:
+        return 1.5
+    if "holiday" in name or "x3" in name or name.endswith("3"):
+        return 3.0
+    if "weekend" in name or "x1" in name or name.endswith("1"):
+        return 1.0
+    return 1.0
+
+def _ot_bucket_of(ot_type_obj) -> int:
+    """0 = 1x, 1 = 1.5x (วันทำงาน), 2 = 3x (วันหยุด)"""
+    if _ot_is_holiday_type(ot_type_obj):
+        return 2
+    return 1 if _ot_extract_multiplier(ot_type_obj) >= 1.4 else 0
+
+def _ot_minutes_by_employee(
+    db: Session, employee_ids: Optional[list[int]], start: date, end: date
+) -> Optional[dict[int, tuple[int, int, int]]]:
+    """นาที OT (1x, 1.5x, 3x) ต่อพนักงาน จาก OT Requests ที่อนุมัติแล้ว
+       แต่ละคำขอนับเต็มจำนวนให้ "วันที่เริ่ม" เท่านั้น (start_time อยู่ใน [start, end])
+       และหักนาทีพักของวันนั้นครั้งเดียวต่อคำขอ -> รวมรายเดือน (rollup) / ช่วงเศษ แล้วได้เท่ากันเสมอ
+       (OT ข้ามเที่ยงคืนปลายเดือนไม่ถูกตัดเศษหรือหักพักซ้ำ)
+       (การหักพักต่อคำขอทำใน SQL GROUP BY ไม่ได้ จึงดึงเฉพาะคอลัมน์ที่ใช้แล้วรวมรอบเดียว)"""
+    OTRequest = getattr(models, "OvertimeRequest", None) or getattr(models, "OTRequest", None)
+    OTType = getattr(models, "OvertimeType", None) or getattr(models, "OTType", None)
+    if not (OTRequest and OTType):
+        return None
+
+    p_start_dt = datetime.combine(start, time.min)
+    p_next_dt = datetime.combine(end + timedelta(days=1), time.min)  # ขอบบนแบบ exclusive
+    bucket_of_type = {t.id: _ot_bucket_of(t) for t in db.query(OTType).all()}
+
+    q = (
+        db.query(OTRequest.employee_id, OTRequest.ot_type_id, OTRequest.start_time, OTRequest.end_time)
+        .filter(
+            OTRequest.status == LeaveStatus.APPROVED,
+            OTRequest.start_time >= p_start_dt,
+            OTRequest.start_time < p_next_dt,
+        )
+    )
+    if employee_ids is not None:
+        q = q.filter(OTRequest.employee_id.in_(employee_ids))
+
+    out: dict[int, list[int]] = {}
+    for emp_id, type_id, st, et in q.all():
+        bucket = bucket_of_type.get(type_id)
+        if bucket is None:  # ไม่มี OvertimeType (inner join เดิม)
+            continue
+        if et <= st:
+            continue
+        mins = int((et - st).total_seconds() // 60)
+        eff_mins = max(0, mins - _get_break_override_minutes(db, emp_id, st.weekday()))
+        out.setdefault(emp_id, [0, 0, 0])[bucket] += eff_mins
+    return {emp_id: tuple(v) for emp_id, v in out.items()}
+
 # ---- Metrics ----
 
-def get_attendance_metrics(db: Session, employee_id: int, start: date, end: date) -> dict:
-    rows = (
-        db.query(AttendanceDaily)
+def _attendance_totals(db: Session, employee_ids: Optional[list[int]], start: date, end: date) -> dict[int, dict]:
+    """รวม attendance_daily ต่อพนักงานด้วย GROUP BY เดียว (employee_ids=None = ทุกคน)"""
+    cols = AttendanceDaily.__table__.c
+
+    def _sum(name: str):
+        return func.coalesce(func.sum(cols[name]), 0).label(name) if name in cols else literal(0).label(name)
+
+    q = (
+        db.query(
+            AttendanceDaily.employee_id,
+            _sum("late_minutes"),
+            _sum("early_leave_minutes"),
+            _sum("work_minutes"),
+            _sum("ot_weekday_minutes"),
+            _sum("ot_holiday_minutes"),
+            func.coalesce(func.sum(case(
+                (AttendanceDaily.status_code == AttendanceStatus.ABSENCE, 1), else_=0
+            )), 0).label("absent_days"),
+            func.coalesce(func.sum(case(
+                (and_(
+                    AttendanceDaily.status_code == AttendanceStatus.LEAVE,
+                    or_(AttendanceDaily.is_paid_leave == False, AttendanceDaily.is_paid_leave.is_(None)),
+                ), 1),
+                else_=0,
+            )), 0).label("unpaid_leave_days"),
+        )
         .filter(
-            AttendanceDaily.employee_id == employee_id,
             AttendanceDaily.day >= start,
             AttendanceDaily.day <= end,
         )
-        .all()
-    )
-
-    late_minutes = sum((getattr(r, "late_minutes", 0) or 0) for r in rows)
-    early_leave_minutes = (
-        sum((getattr(r, "early_leave_minutes", 0) or 0) for r in rows)
-        if "early_leave_minutes" in AttendanceDaily.__table__.c
-        else 0
+        .group_by(AttendanceDaily.employee_id)
     )
-    absent_days = sum(1 for r in rows if r.status_code == AttendanceStatus.ABSENCE.value)
-    unpaid_leave_days = sum(
-        1
-        for r in rows
-        if (r.status_code == AttendanceStatus.LEAVE.value and not bool(getattr(r, "is_paid_leave", False)))
-    )
-    work_minutes = (
-        sum((getattr(r, "work_minutes", 0) or 0) for r in rows)
-        if "work_minutes" in AttendanceDaily.__table__.c
-        else 0
-    )
-
+    if employee_ids is not None:
+        q = q.filter(AttendanceDaily.employee_id.in_(employee_ids))
+    return {r.employee_id: r._asdict() for r in q.all()}
+
+_ZERO_TOTALS = {
+    "late_minutes": 0, "early_leave_minutes": 0, "work_minutes": 0,
+    "ot_weekday_minutes": 0, "ot_holiday_minutes": 0,
+    "absent_days": 0, "unpaid_leave_days": 0,
+}
+
+def _metrics_from_totals(tot: Mapping, ot_loader) -> dict:
+    """ประกอบ metrics จากผลรวมของพนักงานหนึ่งคน
+       ot_loader() จะถูกเรียกเฉพาะตอนต้อง fallback ไปอ่าน OT Requests"""
     has_ot_wd = "ot_weekday_minutes" in AttendanceDaily.__table__.c
     has_ot_hol = "ot_holiday_minutes" in AttendanceDaily.__table__.c
-    ot_weekday_minutes = sum((getattr(r, "ot_weekday_minutes", 0) or 0) for r in rows) if has_ot_wd else 0
-    ot_holiday_minutes = sum((getattr(r, "ot_holiday_minutes", 0) or 0) for r in rows) if has_ot_hol else 0
+    ot_weekday_minutes = int(tot["ot_weekday_minutes"] or 0)
+    ot_holiday_minutes = int(tot["ot_holiday_minutes"] or 0)
 
     # Fallback โดยอ่านจาก OT Requests (ถ้าไม่มีคอลัมน์ OT หรือรวมแล้วยัง 0)
     wd1_min = 0
@@ -1433,102 +2631,20 @@ def get_attendance_metrics(db: Session, employee_id: int, start: date, end: date
     hol3_min = 0
 
     if (not has_ot_wd and not has_ot_hol) or (ot_weekday_minutes + ot_holiday_minutes) == 0:
-        OTRequest = getattr(models, "OvertimeRequest", None) or getattr(models, "OTRequest", None)
-        OTType = getattr(models, "OvertimeType", None) or getattr(models, "OTType", None)
-
-        def _is_approved(val) -> bool:
-            try:
-                name = getattr(val, "name", None)
-                if name:
-                    return name.upper() == "APPROVED"
-            except Exception:
-                pass
-            s = str(val or "").strip()
-            return s.upper() == "APPROVED" or s == "อนุมัติ"
-
-        def _is_holiday_type(ot_type_obj) -> bool:
-            if hasattr(ot_type_obj, "is_holiday"):
-                try:
-                    if bool(getattr(ot_type_obj, "is_holiday")):
-                        return True
-                except Exception:
-                    pass
-            mult = getattr(ot_type_obj, "multiplier", None)
-            try:
-                if mult is not None and float(mult) >= 2.5:
-                    return True
-            except Exception:
-                pass
-            name = (getattr(ot_type_obj, "name", "") or "").lower()
-            return ("holiday" in name) or ("x3" in name) or (" 3" in name) or name.strip().endswith("3")
-
-        def _extract_multiplier(ot_type_obj) -> float:
-            for fld in ("multiplier", "ot_multiplier", "rate", "factor"):
-                if hasattr(ot_type_obj, fld):
-                    try:
-                        v = getattr(ot_type_obj, fld)
-                        if v is not None:
-                            fv = float(v)
-                            if fv > 0:
-                                return fv
-                    except Exception:
-                        pass
-            name = (getattr(ot_type_obj, "name", "") or "").strip().lower()
-            if "1.5" in name or "normal" in name:
-                return 1.5
-            if "holiday" in name or "x3" in name or name.endswith("3"):
-                return 3.0
-            if "weekend" in name or "x1" in name or name.endswith("1"):
-                return 1.0
-            return 1.0
-
-        if OTRequest and OTType:
-            p_start_dt = datetime.combine(start, time.min)
-            p_end_dt = datetime.combine(end, time.max)
-
-            q = (
-                db.query(OTRequest, OTType)
-                .join(OTType, OTType.id == OTRequest.ot_type_id)
-                .filter(
-                    OTRequest.employee_id == employee_id,
-                    OTRequest.start_time <= p_end_dt,
-                    OTRequest.end_time >= p_start_dt,
-                )
-            )
-            for req, t in q.all():
-                raw_status = getattr(req, "status", None)
-                if not _is_approved(raw_status):
-                    continue
-
-                s = max(req.start_time, p_start_dt)
-                e = min(req.end_time, p_end_dt)
-                if e <= s:
-                    continue
-
-                mins = int((e - s).total_seconds() // 60)
-                brk = _get_break_override_minutes(db, employee_id, s.weekday())
-                eff_mins = max(0, mins - brk)
-
-                mult = _extract_multiplier(t)
-
-                if _is_holiday_type(t):
-                    hol3_min += eff_mins
-                elif mult >= 1.4:
-                    wd15_min += eff_mins
-                else:
-                    wd1_min += eff_mins
-
+        res = ot_loader()
+        if res is not None:
+            wd1_min, wd15_min, hol3_min = res
             ot_weekday_minutes = wd15_min
             ot_holiday_minutes = hol3_min
 
     ot_total_minutes = (wd1_min + wd15_min + hol3_min) if (wd1_min or wd15_min or hol3_min) else (ot_weekday_minutes + ot_holiday_minutes)
 
     return {
-        "late_minutes": late_minutes,
-        "early_leave_minutes": early_leave_minutes,
-        "absent_days": absent_days,
-        "unpaid_leave_days": unpaid_leave_days,
-        "work_minutes": work_minutes,
+        "late_minutes": int(tot["late_minutes"] or 0),
+        "early_leave_minutes": int(tot["early_leave_minutes"] or 0),
+        "absent_days": int(tot["absent_days"] or 0),
+        "unpaid_leave_days": int(tot["unpaid_leave_days"] or 0),
+        "work_minutes": int(tot["work_minutes"] or 0),
         # คีย์เดิม (ให้สูตรเดิมใช้ได้ต่อ)
         "ot_weekday_minutes": ot_weekday_minutes,  # 1.5x
         "ot_holiday_minutes": ot_holiday_minutes,  # 3x
@@ -1539,6 +2655,135 @@ def get_attendance_metrics(db: Session, employee_id: int, start: date, end: date
         "ot_total_minutes": ot_total_minutes,
     }
 
+def get_attendance_metrics(db: Session, employee_id: int, start: date, end: date) -> dict:
+    return get_attendance_metrics_bulk(db, [employee_id], start, end)[int(employee_id)]
+
+# ---- Monthly rollup (attendance_monthly) ----
+# เดือนที่ rebuild / recompute แตะ จะถูกสรุปใหม่ทั้งเดือน
+# metrics ใช้ rollup กับเดือนเต็ม และอ่านรายวันเฉพาะส่วนต้น/ท้ายที่ไม่เต็มเดือน (หรือเดือนที่ยังไม่มี rollup)
+
+_MONTHLY_SUM_FIELDS = (
+    "late_minutes", "early_leave_minutes", "absent_days", "unpaid_leave_days", "work_minutes",
+)
+
+def _month_start(d: date) -> date:
+    return d.replace(day=1)
+
+def _month_end(d: date) -> date:
+    nxt = (d.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return nxt - timedelta(days=1)
+
+def _months_between(start: date, end: date) -> list[date]:
+    out = []
+    m = _month_start(start)
+    while m <= end:
+        out.append(m)
+        m = _month_end(m) + timedelta(days=1)
+    return out
+
+def refresh_attendance_monthly(
+    db: Session, months: Iterable[date], employee_ids: Optional[Iterable[int]] = None
+) -> None:
+    """สรุป attendance_monthly ใหม่ของเดือนที่ระบุ (employee_ids=None = ทุกคน) — ไม่ commit"""
+    Monthly = models.AttendanceMonthly
+    scope = None if employee_ids is None else sorted({int(i) for i in employee_ids})
+    if scope is not None and not scope:
+        return
+    if scope is None:
+        emp_ids = [eid for (eid,) in db.query(Employee.id).order_by(Employee.id).all()]
+    else:
+        emp_ids = scope
+
+    now = datetime.utcnow()
+    for m in sorted({_month_start(_as_date(x)) for x in months}):
+        m_end = _month_end(m)
+        q_del = db.query(Monthly).filter(Monthly.month == m)
+        if scope is not None:
+            q_del = q_del.filter(Monthly.employee_id.in_(scope))
+        q_del.delete(synchronize_session=False)
+
+        totals = _attendance_totals(db, scope, m, m_end)
+        ot = _ot_minutes_by_employee(db, scope, m, m_end) or {}
+        rows = []
+        for eid in emp_ids:
+            tot = totals.get(eid, _ZERO_TOTALS)
+            o1, o15, o3 = ot.get(eid, (0, 0, 0))
+            row = {"employee_id": eid, "month": m, "refreshed_at": now,
+                   "ot1x_minutes": o1, "ot15x_minutes": o15, "ot3x_minutes": o3}
+            for f in _MONTHLY_SUM_FIELDS:
+                row[f] = int(tot[f] or 0)
+            rows.append(row)
+        if rows:
+            db.bulk_insert_mappings(Monthly, rows)
+
+def _month_aligned_split(start: date, end: date) -> tuple[list[date], list[tuple[date, date]]]:
+    """แยกช่วงเป็น (เดือนเต็ม, ช่วงเศษต้น/ท้าย)"""
+    first = start if start.day == 1 else _month_end(start) + timedelta(days=1)
+    last_end = end if end == _month_end(end) else _month_start(end) - timedelta(days=1)
+    if first > last_end:
+        return [], [(start, end)]
+    edges = []
+    if start < first:
+        edges.append((start, first - timedelta(days=1)))
+    if last_end < end:
+        edges.append((last_end + timedelta(days=1), end))
+    return _months_between(first, last_end), edges
+
+def get_attendance_metrics_bulk(
+    db: Session, employee_ids: Iterable[int], start: date, end: date, recompute: bool = True
+) -> dict[int, dict]:
+    """metrics ของพนักงานหลายคนในครั้งเดียว -> {employee_id: metrics}
+       เดือนเต็มอ่านจาก attendance_monthly; ส่วนที่ไม่เต็มเดือนใช้ GROUP BY บน attendance_daily
+       และ OT Requests 1 query ต่อช่วง
+       recompute=False: อ่านอย่างเดียว (ผู้เรียกต้อง recompute ช่องที่ mark ไว้เองก่อน เช่น worker ของ payroll)"""
+    ids = sorted({int(i) for i in employee_ids})
+    if not ids:
+        return {}
+    if recompute:
+        drain_dirty_attendance()
+
+    totals: dict[int, dict] = {i: dict(_ZERO_TOTALS) for i in ids}
+    ot: dict[int, list[int]] = {i: [0, 0, 0] for i in ids}
+
+    def _add_daily(emp_ids: list[int], s: date, e: date) -> None:
+        for eid, t in _attendance_totals(db, emp_ids, s, e).items():
+            acc = totals[eid]
+            for k in _ZERO_TOTALS:
+                acc[k] += int(t[k] or 0)
+        for eid, buckets in (_ot_minutes_by_employee(db, emp_ids, s, e) or {}).items():
+            acc = ot[eid]
+            for i, v in enumerate(buckets):
+                acc[i] += v
+
+    months, edges = _month_aligned_split(start, end)
+    if months:
+        Monthly = models.AttendanceMonthly
+        have: set[tuple[int, date]] = set()
+        for r in (
+            db.query(Monthly)
+            .filter(Monthly.employee_id.in_(ids), Monthly.month.in_(months))
+            .all()
+        ):
+            have.add((r.employee_id, r.month))
+            acc = totals[r.employee_id]
+            for f in _MONTHLY_SUM_FIELDS:
+                acc[f] += int(getattr(r, f) or 0)
+            o = ot[r.employee_id]
+            o[0] += r.ot1x_minutes or 0
+            o[1] += r.ot15x_minutes or 0
+            o[2] += r.ot3x_minutes or 0
+        for m in months:
+            missing = [i for i in ids if (i, m) not in have]
+            if missing:
+                _add_daily(missing, m, _month_end(m))
+    for s, e in edges:
+        _add_daily(ids, s, e)
+
+    return {
+        emp_id: _metrics_from_totals(totals[emp_id], lambda emp_id=emp_id: tuple(ot[emp_id]))
+        for emp_id in ids
+    }
+
 # =====================================================================
 # Overtime Types / Requests
 # =====================================================================
@@ -1556,12 +2801,29 @@ def get_ot_type(db: Session, ot_type_id: int):
 def get_ot_types(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.OvertimeType).offset(skip).limit(limit).all()
 
+def _refresh_monthly_for_ot_type(db: Session, ot_type_id: int) -> None:
+    """อัตรา/ชื่อประเภท OT เปลี่ยน -> bucket ใน rollup ของเดือนที่มีคำขอประเภทนี้ต้องสรุปใหม่"""
+    months_by_emp: DefaultDict[int, set] = defaultdict(set)
+    q = db.query(
+        models.OvertimeRequest.employee_id, models.OvertimeRequest.start_time, models.OvertimeRequest.end_time
+    ).filter(models.OvertimeRequest.ot_type_id == ot_type_id)
+    for emp_id, st, et in q.all():
+        months_by_emp[emp_id].update(_months_between(st.date(), et.date()))
+    by_month: DefaultDict[date, set] = defaultdict(set)
+    for emp_id, months in months_by_emp.items():
+        for m in months:
+            by_month[m].add(emp_id)
+    for m, emp_ids in by_month.items():
+        refresh_attendance_monthly(db, [m], emp_ids)
+
 def update_ot_type(db: Session, ot_type_id: int, ot_type_update: schemas.OvertimeTypeUpdate):
     obj = get_ot_type(db, ot_type_id)
     if not obj:
         return None
     for k, v in ot_type_update.model_dump(exclude_unset=True).items():
         setattr(obj, k, v)
+    db.flush()
+    _refresh_monthly_for_ot_type(db, obj.id)
     db.commit()
     db.refresh(obj)
     return obj
@@ -1609,10 +2871,47 @@ def check_for_overlapping_ot(
             detail=f"An overlapping OT request (ID: {overlap.id}) already exists for this period.",
         )
 
+def _existing_ot_intervals(db: Session, proposed: list) -> list[tuple]:
+    keys, lo, hi = span_of(proposed)
+    OT = models.OvertimeRequest
+    return (
+        db.query(OT.employee_id, OT.start_time, OT.end_time, OT.id)
+        .filter(
+            OT.employee_id.in_(keys),
+            OT.status.in_([models.LeaveStatus.PENDING, models.LeaveStatus.APPROVED]),
+            OT.start_time < hi,
+            OT.end_time > lo,
+        )
+        .all()
+    )
+
+def create_ot_requests_bulk(db: Session, ot_requests: List[schemas.OvertimeRequestCreate]):
+    """สร้างคำขอ OT หลายรายการ: ตรวจทับซ้อนทั้งชุดครั้งเดียว แล้ว commit ครั้งเดียว (all-or-nothing)"""
+    if not ot_requests:
+        return []
+    proposed = _check_batch_intervals(ot_requests, "start_time", "end_time")
+    _raise_conflicts(find_conflicts(proposed, _existing_ot_intervals(db, proposed)), "OT requests")
+
+    now = datetime.utcnow()
+    objs = [models.OvertimeRequest(**r.model_dump(), request_date=now) for r in ot_requests]
+    db.add_all(objs)
+    for obj in objs:
+        mark_attendance_dirty(db, obj.employee_id, obj.start_time, obj.end_time)
+    db.commit()
+    ids = [o.id for o in objs]
+    return (
+        db.query(models.OvertimeRequest)
+        .options(joinedload(models.OvertimeRequest.employee), joinedload(models.OvertimeRequest.ot_type))
+        .filter(models.OvertimeRequest.id.in_(ids))
+        .order_by(models.OvertimeRequest.id.asc())
+        .all()
+    )
+
 def create_ot_request(db: Session, ot_request: schemas.OvertimeRequestCreate):
     check_for_overlapping_ot(db, ot_request.employee_id, ot_request.start_time, ot_request.end_time)
     obj = models.OvertimeRequest(**ot_request.model_dump(), request_date=datetime.utcnow())
     db.add(obj)
+    mark_attendance_dirty(db, obj.employee_id, obj.start_time, obj.end_time)
     db.commit()
     db.refresh(obj)
     return obj
@@ -1647,8 +2946,10 @@ def update_ot_request(db: Session, request_id: int, ot_request_update: schemas.O
         data.get("end_time", obj.end_time),
         existing_request_id=request_id,
     )
+    mark_attendance_dirty(db, obj.employee_id, obj.start_time, obj.end_time)
     for k, v in data.items():
         setattr(obj, k, v)
+    mark_attendance_dirty(db, obj.employee_id, obj.start_time, obj.end_time)
     db.commit()
     db.refresh(obj)
     return obj
@@ -1657,6 +2958,7 @@ def delete_ot_request(db: Session, request_id: int):
     obj = get_ot_request(db, request_id)
     if not obj:
         return None
+    mark_attendance_dirty(db, obj.employee_id, obj.start_time, obj.end_time)
     db.delete(obj)
     db.commit()
     return {"message": "OT request deleted successfully."}